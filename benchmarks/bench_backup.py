@@ -0,0 +1,100 @@
+"""Benchmark online backups of a large database against live ingestion latency.
+
+Grows a throwaway adms.db to --size-mb with filler pages, then measures the latency
+of single-record attendance uploads (store_attendance_records, the receive_data write
+path) once on an idle server and once while backup_job snapshots the database. It
+prints the backup duration and throughput and the write latency percentiles.
+
+    python benchmarks/bench_backup.py --size-mb 2048
+"""
+import argparse
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def grow(size_mb: int):
+    conn = sqlite3.connect('adms.db')
+    conn.execute('CREATE TABLE bench_filler (payload BLOB)')
+    rows = size_mb * 256  # 4 KB each
+    for start in range(0, rows, 25600):
+        conn.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO bench_filler SELECT randomblob(4000) FROM n
+        ''', (min(25600, rows - start),))
+        conn.commit()
+    conn.close()
+
+
+def measure_writes(main, seconds: float, stop_when=None):
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    n = 0
+    while time.monotonic() < deadline and not (stop_when and stop_when()):
+        n += 1
+        started = time.perf_counter()
+        try:
+            main.store_attendance_records(f"BENCH{n % 50:03d}", [(str(n), f"2026-01-01 08:{n // 60 % 60:02d}:{n % 60:02d}", 1, 0)])
+        except sqlite3.Error:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+        time.sleep(0.01)
+    latencies.sort()
+    return latencies, errors
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.BACKUP_DIR = os.path.join(workdir, "backups")
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+    main.run_migrations()
+    grow(args.size_mb)
+    anchor = sqlite3.connect('adms.db')  # what keep_databases_open does at startup
+    anchor.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+
+    idle, idle_errors = measure_writes(main, args.idle_seconds)
+
+    job = {"progress": {}}
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(main.backup_job(job)))
+    thread.start()
+    busy, busy_errors = measure_writes(main, 3600, stop_when=lambda: not thread.is_alive())
+    thread.join()
+
+    print(f"database={os.path.getsize('adms.db') / 1e6:,.0f} MB pages_per_step={main.BACKUP_PAGES_PER_STEP} "
+          f"step_sleep={main.BACKUP_STEP_SLEEP}s")
+    print(f"backup: {result['size_bytes'] / 1e6:,.0f} MB in {result['duration_seconds']:.1f}s "
+          f"({result['mb_per_second']} MB/s)")
+    print(f"{'writes':<16}{'count':>7}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'errors':>8}")
+    for label, values, errors in (("idle", idle, idle_errors), ("during backup", busy, busy_errors)):
+        print(f"{label:<16}{len(values):>7}{percentile(values, 0.5):>9.1f}{percentile(values, 0.99):>9.1f}"
+              f"{values[-1] * 1000:>9.1f}{errors:>8}")
+
+    anchor.close()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,144 @@
+"""Measure bandwidth and server CPU of dashboard refreshes with and without conditional GET.
+
+Starts the server in a subprocess on a throwaway database, then replays dashboard
+refreshes (/api/devices, /api/commands, /api/attendance?limit=20) with a command
+queued every few refreshes. The "plain" client re-downloads everything; the
+"conditional" client sends If-None-Match and Accept-Encoding: gzip like a browser.
+Server CPU is read from the child's rusage after it exits.
+
+    python benchmarks/bench_conditional_get.py --refreshes 500 --write-every 10
+"""
+import argparse
+import http.client
+import os
+import random
+import shutil
+import signal
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASHBOARD_URLS = ["/api/devices", "/api/commands", "/api/attendance?limit=20"]
+
+
+def seed(devices: int, commands: int, punches: int):
+    conn = sqlite3.connect('adms.db')
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    conn.executemany(
+        "INSERT INTO devices (serial_number, ip_address, model, firmware_version, last_seen, status) VALUES (?, ?, 'SpeedFace', 'Ver 8.0', ?, 'online')",
+        ((f"SN{i:05d}", f"10.0.{i // 250}.{i % 250}", now) for i in range(devices))
+    )
+    conn.executemany(
+        "INSERT INTO device_commands (device_sn, command, status, response) VALUES (?, ?, 'completed', 'Return=0')",
+        ((f"SN{i % devices:05d}", "INFO") for i in range(commands))
+    )
+    rng = random.Random(3)
+    conn.executemany(
+        "INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, 0)",
+        ((f"SN{i % devices:05d}", str(rng.randrange(2000)), f"2026-01-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i // 60) % 60:02d}")
+         for i in range(punches))
+    )
+    conn.commit()
+    conn.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int):
+    server = subprocess.Popen(
+        [sys.executable, "-c",
+         f"import sys; sys.path.insert(0, {REPO_DIR!r}); import uvicorn, main; "
+         f"uvicorn.run(main.app, host='127.0.0.1', port={port}, log_level='warning', access_log=False)"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def stop_server(server) -> float:
+    """Stop the server and return the CPU seconds it used"""
+    server.send_signal(signal.SIGINT)
+    _, _, usage = os.wait4(server.pid, 0)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_client(port: int, refreshes: int, write_every: int, conditional: bool):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    etags = {}
+    wire_bytes = not_modified = requests = 0
+    started = time.perf_counter()
+    for refresh in range(refreshes):
+        if write_every and refresh % write_every == 0:
+            conn.request("POST", "/api/devices/SN00000/command", body='{"command": "INFO"}',
+                         headers={"Content-Type": "application/json"})
+            conn.getresponse().read()
+        for url in DASHBOARD_URLS:
+            headers = {}
+            if conditional:
+                headers["Accept-Encoding"] = "gzip"
+                if url in etags:
+                    headers["If-None-Match"] = etags[url]
+            conn.request("GET", url, headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            requests += 1
+            wire_bytes += len(body) + sum(len(k) + len(v) + 4 for k, v in response.getheaders())
+            if response.status == 304:
+                not_modified += 1
+            elif response.getheader("ETag"):
+                etags[url] = response.getheader("ETag")
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return requests, wire_bytes, not_modified, elapsed
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--punches", type=int, default=50000)
+    parser.add_argument("--refreshes", type=int, default=500)
+    parser.add_argument("--write-every", type=int, default=10, help="queue a command every N refreshes (0: never)")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.run_migrations()
+    seed(args.devices, args.commands, args.punches)
+
+    results = {}
+    for mode in ("plain", "conditional"):
+        port = free_port()
+        server = start_server(port)
+        requests, wire_bytes, not_modified, elapsed = run_client(port, args.refreshes, args.write_every, mode == "conditional")
+        results[mode] = (requests, wire_bytes, not_modified, elapsed, stop_server(server))
+
+    print(f"devices={args.devices} commands={args.commands} refreshes={args.refreshes} write_every={args.write_every}")
+    print(f"{'client':<13}{'requests':>10}{'304s':>8}{'wire MB':>10}{'server cpu s':>14}{'wall s':>9}")
+    for mode, (requests, wire_bytes, not_modified, elapsed, cpu) in results.items():
+        print(f"{mode:<13}{requests:>10}{not_modified:>8}{wire_bytes / 1e6:>10.2f}{cpu:>14.2f}{elapsed:>9.2f}")
+    plain, conditional = results["plain"], results["conditional"]
+    print(f"bandwidth saved: {1 - conditional[1] / plain[1]:.1%}, server CPU saved: {1 - conditional[4] / plain[4]:.1%}")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,157 @@
+"""Measure what one dashboard refresh costs the server with a large fleet.
+
+Seeds a throwaway database with --devices devices, --commands commands and
+--punches attendance rows, then plays --rounds refresh intervals. In each interval
+--active of the devices poll, --new-commands commands are queued and half of the
+queued ones are sent, and --new-punches punches arrive. After every interval the
+dashboard's refresh is replayed through the ASGI app (in-process, no sockets, gzip
+accepted) two ways:
+  full:  the old refresh - every device and every command, re-rendered from scratch;
+  delta: the ?since= refresh - only rows changed since the previous cursor.
+Reported are the response bytes on the wire and the server time per refresh.
+
+    python benchmarks/bench_dashboard.py --devices 5000 --commands 20000
+"""
+import argparse
+import asyncio
+import datetime
+import gzip
+import json
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def call(app, path: str, query: str = "") -> bytes:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": "GET", "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"adms"), (b"accept-encoding", b"gzip")],
+        "client": ("10.0.0.7", 40000), "server": ("127.0.0.1", 8080),
+    }
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+    body = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return b"".join(body)
+
+
+def seed(devices: int, commands: int, punches: int):
+    rng = random.Random(5)
+    now = datetime.datetime.now()
+    conn = sqlite3.connect('adms.db')
+    conn.executemany(
+        "INSERT INTO devices (serial_number, ip_address, model, last_seen, firmware_version, status) VALUES (?, ?, 'K40', ?, '6.60', 'online')",
+        ((f"SN{n:05d}", f"10.{n // 65536}.{n // 256 % 256}.{n % 256}",
+          (now - datetime.timedelta(seconds=rng.randrange(600))).isoformat()) for n in range(devices))
+    )
+    conn.executemany(
+        "INSERT INTO device_commands (device_sn, command, status, response) VALUES (?, 'INFO', ?, ?)",
+        ((f"SN{rng.randrange(devices):05d}", status, "Return=0" if status == "completed" else None)
+         for status in (rng.choice(("completed", "completed", "sent", "timeout")) for _ in range(commands)))
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, 0)",
+        ((f"SN{rng.randrange(devices):05d}", str(rng.randrange(20000)),
+          (now - datetime.timedelta(seconds=rng.randrange(30 * 86400))).isoformat(sep=" ", timespec="seconds"))
+         for _ in range(punches))
+    )
+    conn.commit()
+    conn.close()
+
+
+def churn(main, rng, args, round_index: int):
+    """One refresh interval of fleet activity"""
+    for n in rng.sample(range(args.devices), int(args.devices * args.active)):
+        main.register_or_update_device(f"SN{n:05d}", f"10.{n // 65536}.{n // 256 % 256}.{n % 256}")
+    conn = sqlite3.connect('adms.db')
+    conn.executemany("INSERT INTO device_commands (device_sn, command, status) VALUES (?, 'INFO', 'queued')",
+                     ((f"SN{rng.randrange(args.devices):05d}",) for _ in range(args.new_commands)))
+    conn.execute("UPDATE device_commands SET status = 'sent' WHERE id IN "
+                 "(SELECT id FROM device_commands WHERE status = 'queued' ORDER BY id LIMIT ?)", (args.new_commands // 2,))
+    conn.commit()
+    conn.close()
+    main.bump_resource_versions("commands")
+    stamp = datetime.datetime.now() + datetime.timedelta(minutes=round_index)
+    for sn in {f"SN{rng.randrange(args.devices):05d}" for _ in range(args.new_punches)}:
+        main.store_attendance_records(sn, [(str(rng.randrange(20000)), stamp.isoformat(sep=" ", timespec="seconds"), 1, 0)])
+
+
+async def refresh_full(main):
+    # What the dashboard fetched before: all devices and all commands every 30 s
+    return [await call(main.app, "/api/devices"), await call(main.app, "/api/commands")]
+
+
+async def refresh_delta(main, cursors: dict):
+    bodies = []
+    for name, path, query in (("devices", "/api/devices", ""), ("commands", "/api/commands", "limit=1000&"),
+                              ("attendance", "/api/attendance", "limit=500&")):
+        body = await call(main.app, path, f"{query}since={cursors.get(name, '')}")
+        bodies.append(body)
+        cursors[name] = json.loads(gzip.decompress(body) if body[:2] == b"\x1f\x8b" else body)["cursor"]
+    return bodies
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=5000)
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--punches", type=int, default=200000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--active", type=float, default=0.2, help="share of the fleet polling between refreshes")
+    parser.add_argument("--new-commands", type=int, default=50, help="commands queued between refreshes")
+    parser.add_argument("--new-punches", type=int, default=200, help="punches arriving between refreshes")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    os.environ["ADMS_BACKUP_INTERVAL"] = "0"
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+    main.run_migrations()
+    seed(args.devices, args.commands, args.punches)
+
+    rng = random.Random(9)
+    cursors = {}
+    asyncio.run(refresh_delta(main, cursors))  # the dashboard's first load
+    totals = {"full": [0, 0.0], "delta": [0, 0.0]}
+    for round_index in range(args.rounds):
+        churn(main, rng, args, round_index)
+        for label in ("full", "delta"):
+            started = time.perf_counter()
+            bodies = asyncio.run(refresh_full(main) if label == "full" else refresh_delta(main, cursors))
+            totals[label][0] += sum(len(body) for body in bodies)
+            totals[label][1] += time.perf_counter() - started
+
+    print(f"devices={args.devices} commands={args.commands} punches={args.punches} "
+          f"per refresh: {args.active:.0%} of devices polled, {args.new_commands} commands, {args.new_punches} punches")
+    print(f"{'refresh':<10}{'bytes':>12}{'server ms':>12}")
+    for label, (size, seconds) in totals.items():
+        print(f"{label:<10}{size // args.rounds:>12,}{seconds * 1000 / args.rounds:>12.1f}")
+
+    main.close_idle_connections(0)
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
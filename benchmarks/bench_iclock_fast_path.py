@@ -0,0 +1,89 @@
+"""Benchmark per-request overhead of the /iclock fast path against the full FastAPI stack.
+
+Calls the ASGI app in-process (no sockets) on a throwaway database, with the fast
+path on and off (main.ICLOCK_FAST_PATH), for a catch-all ping that does no database
+work and for a getrequest poll.
+
+    python benchmarks/bench_iclock_fast_path.py --requests 5000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_scope(method: str, path: str, query: str):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"adms")],
+        "client": ("10.0.0.7", 40000), "server": ("127.0.0.1", 8080),
+    }
+
+
+async def call(app, scope, body: bytes = b""):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)  # the client never disconnects; the server stops listening
+        return {"type": "http.disconnect"}
+
+    status = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+async def bench(app, requests: int, method: str, path: str, query: str) -> float:
+    scope = make_scope(method, path, query)
+    assert await call(app, dict(scope)) == 200
+    started = time.perf_counter()
+    for _ in range(requests):
+        await call(app, dict(scope))
+    return (time.perf_counter() - started) / requests
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.run_migrations()
+    # Keep the log calls (they are part of each stack's cost) but drop the output
+    logging.getLogger().handlers = [logging.NullHandler()]
+
+    cases = [
+        ("catch-all ping", "GET", "/iclock/ping", "SN=BENCH0001"),
+        ("getrequest poll", "GET", "/iclock/getrequest", "SN=BENCH0001"),
+    ]
+    print(f"requests={args.requests} per case")
+    print(f"{'endpoint':<18}{'fastapi us':>12}{'fast path us':>14}{'saved us':>10}{'speedup':>9}")
+    for label, method, path, query in cases:
+        main.ICLOCK_FAST_PATH = False
+        full = asyncio.run(bench(main.app, args.requests, method, path, query))
+        main.ICLOCK_FAST_PATH = True
+        fast = asyncio.run(bench(main.app, args.requests, method, path, query))
+        print(f"{label:<18}{full * 1e6:>12.0f}{fast * 1e6:>14.0f}{(full - fast) * 1e6:>10.0f}{full / fast:>8.1f}x")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,109 @@
+"""Compare loading an ATTLOG .dat export by replaying it through /iclock/cdata with the bulk import.
+
+Writes an export of --records punches for --users users, then loads it into a fresh
+database twice: once posted to /iclock/cdata in --chunk-size line requests through the
+ASGI app (in-process, no sockets), the way a backlog was replayed before, and once
+with import_attlog_file. A second import of the same file measures the duplicate path.
+
+    python benchmarks/bench_import.py --records 1000000 --users 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def call(app, path: str, query: str = "", method: str = "GET", body: bytes = b"") -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"adms")],
+        "client": ("10.0.0.7", 40000), "server": ("127.0.0.1", 8080),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def write_export(file_path: str, records: int, users: int):
+    """USB exports pad the user id and carry two trailing work-code columns"""
+    rng = random.Random(3)
+    with open(file_path, "w") as f:
+        for n in range(records):
+            f.write(f"{rng.randrange(users):>9}\t2026-{1 + n * 12 // records:02d}-{1 + rng.randrange(28):02d} "
+                    f"{rng.randrange(24):02d}:{rng.randrange(60):02d}:{rng.randrange(60):02d}\t1\t0\t1\t0\n")
+
+
+async def replay(main, file_path: str, chunk_size: int) -> int:
+    with open(file_path, "rb") as f:
+        lines = f.readlines()
+    for start in range(0, len(lines), chunk_size):
+        status = await call(main.app, "/iclock/cdata", "SN=REPLAY01&table=ATTLOG", "POST",
+                            b"".join(lines[start:start + chunk_size]))
+        assert status == 200, status
+    return len(lines)
+
+
+def fresh_database(main):
+    for name in os.listdir("."):
+        if name.startswith("adms.db"):
+            os.remove(name)
+    main.close_idle_connections(0)
+    main.run_migrations()
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--chunk-size", type=int, default=2000, help="lines per replayed /iclock/cdata upload")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    os.environ["ADMS_BACKUP_INTERVAL"] = "0"
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+    write_export("ATTLOG.dat", args.records, args.users)
+
+    print(f"records={args.records} users={args.users} file={os.path.getsize('ATTLOG.dat') / 1e6:.1f} MB")
+    print(f"{'load':<30}{'seconds':>10}{'records/s':>12}")
+    fresh_database(main)
+    started = time.perf_counter()
+    count = asyncio.run(replay(main, "ATTLOG.dat", args.chunk_size))
+    elapsed = time.perf_counter() - started
+    print(f"{'replay through /iclock/cdata':<30}{elapsed:>10.1f}{count / elapsed:>12,.0f}")
+
+    fresh_database(main)
+    for label in ("bulk import", "bulk import (all duplicates)"):
+        result = main.import_attlog_file("ATTLOG.dat", "IMPORT01")
+        print(f"{label:<30}{result['seconds']:>10.1f}{result['records_per_second']:>12,}")
+
+    main.close_idle_connections(0)
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
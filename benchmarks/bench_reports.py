@@ -0,0 +1,107 @@
+"""Benchmark the vectorized report engine against a row-by-row Python loop.
+
+Seeds a throwaway database with a month of punches, then computes the hours-worked
+report both ways and prints rows/sec for loading, for the aggregation itself and
+end to end.
+
+    python benchmarks/bench_reports.py --punches 2000000 --users 5000
+"""
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(punches: int, users: int):
+    rng = random.Random(7)
+    conn = sqlite3.connect('adms.db')
+    conn.executemany(
+        "INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, 0)",
+        ((f"SN{i % 100}", str(rng.randrange(users)),
+          f"2026-01-{1 + rng.randrange(28):02d} {rng.randrange(6, 20):02d}:{rng.randrange(60):02d}:{i % 60:02d}")
+         for i in range(punches))
+    )
+    conn.commit()
+    conn.close()
+
+
+def naive_hours(rows):
+    """Row-by-row first/last punch per user-day, the way get_attendance_logs walks tuples"""
+    spans = {}
+    for user_id, timestamp in rows:
+        moment = datetime.datetime.strptime(timestamp[:19], "%Y-%m-%d %H:%M:%S")
+        key = (user_id, moment.date())
+        span = spans.get(key)
+        if span is None:
+            spans[key] = [moment, moment]
+        else:
+            if moment < span[0]:
+                span[0] = moment
+            if moment > span[1]:
+                span[1] = moment
+
+    hours = {}
+    for (user_id, _), (first, last) in spans.items():
+        hours[user_id] = hours.get(user_id, 0.0) + (last - first).total_seconds() / 3600.0
+    return hours
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--punches", type=int, default=2000000)
+    parser.add_argument("--users", type=int, default=5000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.run_migrations()
+    seed(args.punches, args.users)
+
+    start, end = datetime.date(2026, 1, 1), datetime.date(2026, 1, 31)
+    conn = sqlite3.connect('adms.db')
+
+    # Row-by-row baseline
+    started = time.perf_counter()
+    rows = conn.execute(
+        "SELECT user_id, timestamp FROM attendance_logs WHERE timestamp >= ? AND timestamp < ?",
+        (start.isoformat(), (end + datetime.timedelta(days=1)).isoformat())
+    ).fetchall()
+    naive_load = time.perf_counter() - started
+    started = time.perf_counter()
+    expected = naive_hours(rows)
+    naive_compute = time.perf_counter() - started
+
+    # Vectorized engine
+    started = time.perf_counter()
+    user_index, user_codes, epochs = main.load_punch_columns(start, end)
+    vector_load = time.perf_counter() - started
+    started = time.perf_counter()
+    seg_users, _, seg_first, seg_last, _ = main.user_day_segments(user_codes, epochs)
+    hours = main.np.bincount(seg_users, weights=(seg_last - seg_first) / 3600.0, minlength=len(user_index))
+    vector_compute = time.perf_counter() - started
+    conn.close()
+
+    mismatches = sum(1 for i, user_id in enumerate(user_index) if abs(hours[i] - expected.get(user_id, 0.0)) > 1e-6)
+    count = len(rows)
+    print(f"punches={count} users={args.users} (hours report, results match: {mismatches == 0})")
+    print(f"{'stage':<22}{'naive rows/s':>16}{'vectorized rows/s':>20}{'speedup':>10}")
+    for stage, naive_time, vector_time in (("load", naive_load, vector_load),
+                                           ("aggregate", naive_compute, vector_compute),
+                                           ("end to end", naive_load + naive_compute, vector_load + vector_compute)):
+        print(f"{stage:<22}{count / naive_time:>16,.0f}{count / vector_time:>20,.0f}{naive_time / vector_time:>9.1f}x")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,106 @@
+"""Benchmark attendance write throughput with 1, 4 and 16 shards.
+
+Writer threads play devices uploading ATTLOG batches through store_attendance_records
+(the receive_data write path), while poller threads keep updating the devices table
+in the control database the way every device poll does. With one shard the inserts and
+the polls all queue on the adms.db write lock; with more shards they spread out.
+
+    python benchmarks/bench_shards.py --devices 200 --batches 20 --batch-size 50
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(main, shards: int, args):
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    main.ATTENDANCE_SHARDS = shards
+    main.ATTENDANCE_SHARD_DIR = os.path.join(workdir, "shards")
+    main.run_migrations()
+    main.migrate_attendance_shards()
+    main.seed_attendance_ids()
+
+    devices = [f"BENCH{i:05d}" for i in range(args.devices)]
+    for sn in devices:
+        main.register_or_update_device(sn, "10.0.0.7")
+    next_device = iter(range(len(devices)))
+    device_lock = threading.Lock()
+    stop = threading.Event()
+    polls = [0]
+    errors = []
+
+    def writer():
+        while True:
+            with device_lock:
+                index = next(next_device, None)
+            if index is None:
+                return
+            sn = devices[index]
+            for batch in range(args.batches):
+                records = [(str(index * 100 + user), f"2026-01-{1 + batch % 28:02d} {8 + user % 10:02d}:{batch % 60:02d}:{user % 60:02d}", 1, 0)
+                           for user in range(args.batch_size)]
+                try:
+                    main.store_attendance_records(sn, records)
+                except Exception as e:
+                    errors.append(str(e))  # not the exception: its traceback would keep the connection (and its lock) alive
+
+    def poller():
+        while not stop.is_set():
+            try:
+                main.register_or_update_device(devices[polls[0] % len(devices)], "10.0.0.7")
+                polls[0] += 1
+            except Exception as e:
+                errors.append(str(e))
+
+    pollers = [threading.Thread(target=poller) for _ in range(args.pollers)]
+    writers = [threading.Thread(target=writer) for _ in range(args.writers)]
+    started = time.perf_counter()
+    for thread in pollers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in pollers:
+        thread.join()
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+    return elapsed, polls[0], errors
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200)
+    parser.add_argument("--batches", type=int, default=20, help="uploads per device")
+    parser.add_argument("--batch-size", type=int, default=50, help="records per upload")
+    parser.add_argument("--writers", type=int, default=16, help="concurrent uploading threads")
+    parser.add_argument("--pollers", type=int, default=2, help="threads updating the devices table")
+    parser.add_argument("--shards", default="1,4,16")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+
+    records = args.devices * args.batches * args.batch_size
+    print(f"records={records} devices={args.devices} writers={args.writers} pollers={args.pollers} cpus={os.cpu_count()}")
+    print(f"{'shards':>6}{'seconds':>10}{'records/s':>12}{'polls/s':>10}{'errors':>8}")
+    for shards in (int(value) for value in args.shards.split(",")):
+        elapsed, polls, errors = run(main, shards, args)
+        print(f"{shards:>6}{elapsed:>10.2f}{records / elapsed:>12,.0f}{polls / elapsed:>10,.0f}{len(errors):>8}")
+        if errors:
+            print(f"       first error: {errors[0]}")
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,161 @@
+"""Benchmark device-poll latency of light tenants while one tenant uploads a heavy backlog.
+
+Uploader threads play the devices of one customer catching up on a backlog, posting
+large ATTLOG batches to /iclock/cdata as fast as they are accepted. Poller threads
+play the devices of --tenants other customers: a getrequest poll followed by a
+one-punch upload, over and over. Requests go through the ASGI app in-process (no
+sockets), each thread running its own event loop.
+
+With one database every poll writes to the file the backlog is being written to and
+queues on its write lock. In multi-tenant mode each customer has its own file, and
+the light tenants only share the CPU with the backlog.
+
+    python benchmarks/bench_tenants.py --seconds 10 --tenants 8 --batch-size 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def call(app, path: str, query: str = "", method: str = "GET", body: bytes = b"") -> int:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"adms")],
+        "client": ("10.0.0.7", 40000), "server": ("127.0.0.1", 8080),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = []
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def attlog(user: int, second: int, count: int) -> bytes:
+    return "".join(
+        f"{user + n % 50}\t2026-{1 + second // 2419200 % 12:02d}-{1 + second // 86400 % 28:02d} "
+        f"{second // 3600 % 24:02d}:{second // 60 % 60:02d}:{second % 60:02d}\t1\t0\n"
+        for n, second in enumerate(range(second, second + count))
+    ).encode()
+
+
+def run(main, multi_tenant: bool, args):
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    main.MULTI_TENANT = multi_tenant
+    main.run_migrations()
+    light = [f"light{i:02d}" for i in range(args.tenants)]
+    if multi_tenant:
+        for tenant in ["heavy"] + light:
+            main.create_tenant(tenant)
+        for i in range(args.uploaders):
+            main.assign_device_tenant(f"HEAVY{i:03d}", "heavy")
+        for i, tenant in enumerate(light):
+            main.assign_device_tenant(f"LIGHT{i:03d}", tenant)
+        main.load_tenant_registry()
+
+    stop = threading.Event()
+    latencies = []
+    uploaded = [0]
+    errors = []
+    lock = threading.Lock()
+
+    def uploader(index: int):
+        async def loop():
+            batch = 0
+            while not stop.is_set():
+                body = attlog(index * 1000, batch * args.batch_size, args.batch_size)
+                batch += 1
+                status = await call(main.app, "/iclock/cdata", f"SN=HEAVY{index:03d}&table=ATTLOG", "POST", body)
+                with lock:
+                    if status == 200:
+                        uploaded[0] += args.batch_size
+                    else:
+                        errors.append(status)
+        asyncio.run(loop())
+
+    def poller(index: int):
+        async def loop():
+            n = 0
+            while not stop.is_set():
+                sn = f"LIGHT{index:03d}"
+                started = time.perf_counter()
+                statuses = (await call(main.app, "/iclock/getrequest", f"SN={sn}"),
+                            await call(main.app, "/iclock/cdata", f"SN={sn}&table=ATTLOG", "POST", attlog(index, n, 1)))
+                elapsed = time.perf_counter() - started
+                n += 1
+                with lock:
+                    latencies.append(elapsed)
+                    errors.extend(status for status in statuses if status != 200)
+                await asyncio.sleep(args.poll_interval)
+        asyncio.run(loop())
+
+    threads = [threading.Thread(target=uploader, args=(i,)) for i in range(args.uploaders)]
+    threads += [threading.Thread(target=poller, args=(i,)) for i in range(args.tenants)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    main.close_idle_connections(0)
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+    latencies.sort()
+    return {
+        "polls": len(latencies),
+        "p50": latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        "p99": latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+        "max": latencies[-1] * 1000 if latencies else 0.0,
+        "records_per_second": uploaded[0] / elapsed,
+        "errors": len(errors),
+    }
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--tenants", type=int, default=8, help="light tenants, one polling device each")
+    parser.add_argument("--uploaders", type=int, default=2, help="devices of the heavy tenant uploading its backlog")
+    parser.add_argument("--batch-size", type=int, default=2000, help="records per backlog upload")
+    parser.add_argument("--poll-interval", type=float, default=0.05, help="seconds between a light device's polls")
+    args = parser.parse_args()
+
+    os.environ["ADMS_BACKUP_INTERVAL"] = "0"
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print(f"light tenants={args.tenants} backlog uploaders={args.uploaders} batch={args.batch_size} "
+          f"seconds={args.seconds:g} cpus={os.cpu_count()}")
+    print(f"{'mode':<14}{'polls':>8}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}{'backlog rec/s':>15}{'errors':>8}")
+    for label, multi_tenant in (("one database", False), ("per tenant", True)):
+        result = run(main, multi_tenant, args)
+        print(f"{label:<14}{result['polls']:>8}{result['p50']:>9.1f}{result['p99']:>9.1f}{result['max']:>9.1f}"
+              f"{result['records_per_second']:>15,.0f}{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    main_cli()
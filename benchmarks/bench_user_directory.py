@@ -0,0 +1,107 @@
+"""Benchmark attendance enrichment through the in-process user directory.
+
+Seeds a throwaway database with 100k users and a page-sized attendance workload,
+then compares enriching /api/attendance pages through lookup_user_names (cold and
+warm directory) against a SQL join per page.
+
+    python benchmarks/bench_user_directory.py --users 100000 --pages 2000
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed(users: int, punches: int):
+    conn = sqlite3.connect('adms.db')
+    conn.executemany(
+        "INSERT INTO users (user_id, name, privilege, group_id) VALUES (?, ?, 0, ?)",
+        ((str(i), f"Employee {i}", str(i % 40)) for i in range(users))
+    )
+    rng = random.Random(1)
+    conn.executemany(
+        "INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, 0)",
+        ((f"SN{i % 200}", str(rng.randrange(users)), f"2026-01-{1 + i % 28:02d} {i % 24:02d}:{i % 60:02d}:{(i // 60) % 60:02d}")
+         for i in range(punches))
+    )
+    conn.commit()
+    conn.close()
+
+
+def page_user_ids(conn, page_size: int, offset: int):
+    cursor = conn.execute(
+        "SELECT user_id FROM attendance_logs ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+        (page_size, offset)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def bench_join(conn, page_size: int, pages: int, max_offset: int) -> float:
+    started = time.perf_counter()
+    for page in range(pages):
+        conn.execute('''
+            SELECT a.device_sn, a.user_id, a.timestamp, u.name
+            FROM (SELECT * FROM attendance_logs ORDER BY timestamp DESC LIMIT ? OFFSET ?) a
+            LEFT JOIN users u ON u.user_id = a.user_id
+        ''', (page_size, (page * page_size) % max_offset)).fetchall()
+    return time.perf_counter() - started
+
+
+def bench_directory(main, conn, page_size: int, pages: int, max_offset: int) -> float:
+    started = time.perf_counter()
+    for page in range(pages):
+        user_ids = page_user_ids(conn, page_size, (page * page_size) % max_offset)
+        main.lookup_user_names(user_ids, conn)
+    return time.perf_counter() - started
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--punches", type=int, default=200000)
+    parser.add_argument("--pages", type=int, default=2000)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.run_migrations()
+
+    seed(args.users, args.punches)
+    conn = sqlite3.connect('adms.db')
+    # Clients read the newest pages; cycle through the first 100 of them
+    max_offset = min(args.punches, 100 * args.page_size)
+
+    join_time = bench_join(conn, args.page_size, args.pages, max_offset)
+    main.invalidate_users()
+    cold_time = bench_directory(main, conn, args.page_size, args.pages, max_offset)
+    warm_time = bench_directory(main, conn, args.page_size, args.pages, max_offset)
+    all_user_ids = [str(i) for i in range(args.users)]
+    started = time.perf_counter()
+    main.lookup_user_names(all_user_ids, conn)
+    fill_time = time.perf_counter() - started
+    started = time.perf_counter()
+    main.lookup_user_names(all_user_ids, conn)
+    hit_time = time.perf_counter() - started
+    conn.close()
+
+    print(f"users={args.users} punches={args.punches} pages={args.pages} page_size={args.page_size}")
+    for label, elapsed in (("sql join per page", join_time),
+                           ("directory (cold)", cold_time),
+                           ("directory (warm)", warm_time)):
+        print(f"{label:<20} {elapsed:8.3f}s  {args.pages / elapsed:10.0f} pages/s")
+    print(f"resolve all {args.users} users: {fill_time:.3f}s from SQL, {hit_time:.3f}s from the directory")
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
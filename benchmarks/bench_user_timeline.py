@@ -0,0 +1,141 @@
+"""Load-test /api/users/{user_id}/attendance.
+
+Seeds a throwaway database with --punches records for --users users over 60 days,
+then measures:
+  1. uncached lookups/s of a 7-day timeline with the old (user_id, timestamp) index
+     and with the covering index from migration 12;
+  2. requests/s through the ASGI app (in-process, no sockets) for a hot set of
+     users, with the timeline cache off and on, while attendance uploads keep
+     invalidating the users they touch.
+
+    python benchmarks/bench_user_timeline.py --punches 1000000 --users 5000
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAST_DAY = datetime.date(2026, 3, 1)
+
+
+def seed(punches: int, users: int):
+    rng = random.Random(7)
+    conn = sqlite3.connect('adms.db')
+    conn.executemany(
+        "INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, 0)",
+        ((f"SN{rng.randrange(200)}", str(rng.randrange(users)),
+          f"{LAST_DAY - datetime.timedelta(days=rng.randrange(60))} {rng.randrange(6, 20):02d}:{rng.randrange(60):02d}:{i % 60:02d}")
+         for i in range(punches))
+    )
+    conn.commit()
+    conn.close()
+
+
+def use_index(covering: bool):
+    conn = sqlite3.connect('adms.db')
+    if covering:
+        conn.execute('DROP INDEX IF EXISTS idx_attendance_user')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_user_timeline '
+                     'ON attendance_logs (user_id, timestamp DESC, device_sn, verify_mode, status)')
+    else:
+        conn.execute('DROP INDEX IF EXISTS idx_attendance_user_timeline')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_attendance_user ON attendance_logs (user_id, timestamp DESC)')
+    conn.commit()
+    conn.close()
+
+
+def bench_direct(main, users: int, lookups: int) -> float:
+    rng = random.Random(1)
+    start, end = (LAST_DAY - datetime.timedelta(days=6)).isoformat(), LAST_DAY.isoformat()
+    started = time.perf_counter()
+    for _ in range(lookups):
+        main.read_user_timeline(str(rng.randrange(users)), start, end, 500)
+    return lookups / (time.perf_counter() - started)
+
+
+async def call(app, path: str, query: str = "", method: str = "GET", body: bytes = b""):
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "scheme": "http",
+        "method": method, "path": path, "raw_path": path.encode(), "root_path": "",
+        "query_string": query.encode(), "headers": [(b"host", b"adms")],
+        "client": ("10.0.0.7", 40000), "server": ("127.0.0.1", 8080),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.sleep(3600)
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(scope, receive, send)
+
+
+async def bench_app(main, hot_users: int, requests: int, upload_every: int):
+    rng = random.Random(2)
+    query = f"start={LAST_DAY - datetime.timedelta(days=6)}&end={LAST_DAY}"
+    latencies = []
+    for n in range(requests):
+        user_id = str(int(rng.paretovariate(1.2)) % hot_users)
+        if upload_every and n % upload_every == 0:
+            punch = f"{user_id}\t{LAST_DAY} 21:{n // 60 % 60:02d}:{n % 60:02d}\t1\t0\n"
+            await call(main.app, "/iclock/cdata", "SN=BENCH0001&table=ATTLOG", "POST", punch.encode())
+        started = time.perf_counter()
+        await call(main.app, f"/api/users/{user_id}/attendance", query)
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return len(latencies) / sum(latencies), latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--punches", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--hot-users", type=int, default=500)
+    parser.add_argument("--upload-every", type=int, default=20, help="one single-punch upload per N lookups")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+    main.run_migrations()
+    seed(args.punches, args.users)
+    anchor = sqlite3.connect('adms.db')  # what keep_databases_open does at startup
+    anchor.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+
+    print(f"punches={args.punches} users={args.users} window=7 days")
+    print(f"{'uncached lookup':<34}{'lookups/s':>12}")
+    for label, covering in (("(user_id, timestamp) index", False), ("covering index", True)):
+        use_index(covering)
+        print(f"{label:<34}{bench_direct(main, args.users, args.lookups):>12,.0f}")
+
+    print(f"\nthrough the app: {args.hot_users} hot users, one upload per {args.upload_every} lookups")
+    print(f"{'cache':<34}{'requests/s':>12}{'p50 us':>10}{'p99 us':>10}")
+    for label, size in (("off", 0), ("on", main.USER_TIMELINE_CACHE_SIZE)):
+        main.USER_TIMELINE_CACHE_SIZE = size
+        main.invalidate_user_timelines()
+        rate, p50, p99 = asyncio.run(bench_app(main, args.hot_users, args.lookups, args.upload_every))
+        print(f"{label:<34}{rate:>12,.0f}{p50:>10.0f}{p99:>10.0f}")
+
+    anchor.close()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,272 @@
+"""Simulated device fleet for the ADMS endpoints.
+
+Starts the server in a subprocess on a throwaway database and runs N simulated
+terminals against it. Each terminal handshakes (cdata?options=all), uploads a
+backlog of punches, then polls getrequest. Halfway through, a network blip makes
+every terminal fail at once; it waits ErrorDelay, handshakes again and re-uploads.
+
+"fixed" terminals keep factory defaults (Delay=10, ErrorDelay=30); "adaptive"
+terminals obey the Delay/ErrorDelay the server sends. Per-second arrival rates
+and request latencies show how well each mode spreads the storms.
+
+The "commands" scenario measures command delivery instead: an operator queues
+commands for random terminals through /api/devices/{sn}/command, terminals
+acknowledge what they receive, and the time from queueing to delivery is compared
+between plain polling and long polling (ADMS_LONG_POLL_TIMEOUT).
+
+    python benchmarks/simulator.py --devices 600 --duration 240
+    python benchmarks/simulator.py --scenario commands --devices 2000 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FACTORY_DELAY = 10
+FACTORY_ERROR_DELAY = 30
+REQUEST_TIMEOUT = 10
+COMMAND_DRAIN_SECONDS = 45  # commands scenario: no new commands in the last seconds of the run
+
+
+class Fleet:
+    def __init__(self, port: int, adaptive: bool, backlog: int, blip_at: float, end_at: float,
+                 request_timeout: float = REQUEST_TIMEOUT):
+        self.port = port
+        self.adaptive = adaptive
+        self.backlog = backlog
+        self.blip_at = blip_at
+        self.end_at = end_at
+        self.request_timeout = request_timeout
+        self.started = time.monotonic()
+        self.arrivals = {}  # second since start -> requests sent
+        self.latencies = []  # (second sent, latency)
+        self.errors = 0
+        self.backoffs = []
+        self.delivered = {}  # command id -> monotonic time the terminal received it
+
+    async def request(self, method: str, path: str, body: bytes = b""):
+        second = int(time.monotonic() - self.started)
+        self.arrivals[second] = self.arrivals.get(second, 0) + 1
+        sent = time.monotonic()
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection("127.0.0.1", self.port), REQUEST_TIMEOUT)
+            writer.write(
+                f"{method} {path} HTTP/1.1\r\nHost: adms\r\nConnection: close\r\n"
+                f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+            )
+            raw = await asyncio.wait_for(reader.read(-1), self.request_timeout)
+            writer.close()
+        except (OSError, asyncio.TimeoutError):
+            self.errors += 1
+            return None
+        self.latencies.append((second, time.monotonic() - sent))
+        head, _, payload = raw.partition(b"\r\n\r\n")
+        if not head.startswith(b"HTTP/1.1 200"):
+            self.errors += 1
+            return None
+        return payload.decode(errors="replace")
+
+    def apply_options(self, text: str, delays: dict):
+        if not (self.adaptive and text):
+            return
+        for line in text.splitlines():
+            key, _, value = line.partition("=")
+            if key in ("Delay", "ErrorDelay") and value.isdigit():
+                delays[key] = int(value)
+        if "Delay" in delays:
+            self.backoffs.append(delays["Delay"])
+
+    async def connect(self, sn: str, delays: dict):
+        self.apply_options(await self.request("GET", f"/iclock/cdata?SN={sn}&options=all&pushver=2.4.1"), delays)
+        rows = "".join(f"{i}\t2026-01-01 {8 + i // 60 % 10:02d}:{i % 60:02d}:{ord(sn[-1]) % 60:02d}\t0\t1\t0\n"
+                       for i in range(self.backlog))
+        await self.request("POST", f"/iclock/cdata?SN={sn}&table=ATTLOG", rows.encode())
+
+    async def acknowledge(self, sn: str, text: str):
+        received = time.monotonic()
+        acks = []
+        for line in text.splitlines():
+            _, command_id, command = line.split(":", 2)
+            self.delivered.setdefault(int(command_id), received)
+            acks.append(f"ID={command_id}&Return=0&CMD={command.split(' ', 1)[0]}\n")
+        await self.request("POST", f"/iclock/devicecmd?SN={sn}", "".join(acks).encode())
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(max(0.0, min(seconds, self.end_at - time.monotonic())))
+
+    async def device(self, sn: str):
+        delays = {"Delay": FACTORY_DELAY, "ErrorDelay": FACTORY_ERROR_DELAY}
+        await asyncio.sleep(random.uniform(0, 1))  # the whole fleet comes up within a second
+        await self.connect(sn, delays)
+        blipped = False
+        while time.monotonic() < self.end_at:
+            if not blipped and time.monotonic() >= self.blip_at:
+                # The link drops for everyone at once; each terminal retries after its ErrorDelay
+                blipped = True
+                await self.sleep(delays["ErrorDelay"])
+                if time.monotonic() < self.end_at:
+                    await self.connect(sn, delays)
+                continue
+            text = await self.request("GET", f"/iclock/getrequest?SN={sn}")
+            self.apply_options(text, delays)
+            if text and text.startswith("C:"):
+                await self.acknowledge(sn, text)
+            await self.sleep(delays["Delay"] if text is not None else delays["ErrorDelay"])
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, env: dict):
+    server = subprocess.Popen(
+        [sys.executable, "-c",
+         f"import sys; sys.path.insert(0, {REPO_DIR!r}); import uvicorn, main; "
+         f"uvicorn.run(main.app, host='127.0.0.1', port={port}, log_level='warning', access_log=False, backlog=4096)"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, env={**os.environ, **env}
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.1).close()
+            return server
+        except OSError:
+            time.sleep(0.1)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+def percentile(values, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_fleet(port: int, adaptive: bool, args) -> Fleet:
+    now = time.monotonic()
+    fleet = Fleet(port, adaptive, args.backlog, now + args.duration / 2, now + args.duration)
+    await asyncio.gather(*(fleet.device(f"SIM{i:05d}") for i in range(args.devices)))
+    return fleet
+
+
+async def queue_command(port: int, sn: str):
+    """Queue an INFO command the way an operator does; returns the command id"""
+    body = b'{"command": "INFO"}'
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(
+        f"POST /api/devices/{sn}/command HTTP/1.1\r\nHost: adms\r\nConnection: close\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n".encode() + body
+    )
+    raw = await reader.read(-1)
+    writer.close()
+    payload = raw.partition(b"\r\n\r\n")[2]
+    return json.loads(payload)["id"] if raw.startswith(b"HTTP/1.1 200") else None
+
+
+async def run_command_fleet(port: int, long_poll: float, args):
+    """Adaptive terminals without a blip, plus an operator queueing --command-rate commands/s"""
+    now = time.monotonic()
+    fleet = Fleet(port, True, args.backlog, float("inf"), now + args.duration, REQUEST_TIMEOUT + long_poll)
+    queued = {}  # command id -> monotonic time it was queued
+
+    async def operator():
+        await asyncio.sleep(5)  # every terminal has connected
+        # Stop early enough that the last commands can still be picked up
+        stop_at = fleet.end_at - COMMAND_DRAIN_SECONDS
+        while time.monotonic() < stop_at:
+            sent = time.monotonic()
+            command_id = await queue_command(port, f"SIM{random.randrange(args.devices):05d}")
+            if command_id is not None:
+                queued[command_id] = sent
+            await asyncio.sleep(max(0.0, 1 / args.command_rate - (time.monotonic() - sent)))
+
+    await asyncio.gather(operator(), *(fleet.device(f"SIM{i:05d}") for i in range(args.devices)))
+    delays = [fleet.delivered[command_id] - sent for command_id, sent in queued.items() if command_id in fleet.delivered]
+    return fleet, len(queued), delays
+
+
+def commands_scenario(args):
+    print(f"devices={args.devices} duration={args.duration}s commands/s={args.command_rate} "
+          f"long_poll={args.long_poll:g}s target_rps={args.target_rps}")
+    print(f"{'mode':<11}{'queued':>8}{'delivered':>11}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+          f"{'polls/s':>9}{'errors':>8}{'server cpu':>12}")
+    for mode, long_poll in (("polling", 0.0), ("long-poll", args.long_poll)):
+        port = free_port()
+        server = start_server(port, {"ADMS_TARGET_DEVICE_RPS": str(args.target_rps),
+                                     "ADMS_MAX_POLL_BACKOFF": str(args.max_backoff),
+                                     "ADMS_LONG_POLL_TIMEOUT": str(long_poll)})
+        fleet, queued, delays = asyncio.run(run_command_fleet(port, long_poll, args))
+        server.send_signal(signal.SIGINT)
+        _, _, usage = os.wait4(server.pid, 0)
+        print(f"{mode:<11}{queued:>8}{len(delays):>11}{statistics.median(delays or [0]) * 1000:>10.0f}"
+              f"{percentile(delays, 0.99) * 1000:>10.0f}{max(delays or [0]) * 1000:>10.0f}"
+              f"{sum(fleet.arrivals.values()) / args.duration:>9.1f}{fleet.errors:>8}"
+              f"{usage.ru_utime + usage.ru_stime:>11.2f}s")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=600)
+    parser.add_argument("--duration", type=int, default=240, help="seconds; the blip happens halfway")
+    parser.add_argument("--backlog", type=int, default=20, help="punches uploaded on every (re)connect")
+    parser.add_argument("--target-rps", type=float, default=100, help="ADMS_TARGET_DEVICE_RPS for the server")
+    parser.add_argument("--max-backoff", type=float, default=4, help="ADMS_MAX_POLL_BACKOFF for the server")
+    parser.add_argument("--mode", choices=("fixed", "adaptive", "both"), default="both")
+    parser.add_argument("--scenario", choices=("blip", "commands"), default="blip")
+    parser.add_argument("--command-rate", type=float, default=5, help="commands queued per second (commands scenario)")
+    parser.add_argument("--long-poll", type=float, default=25, help="ADMS_LONG_POLL_TIMEOUT for the long-poll run")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="adms-sim-")
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_DIR)
+    import main
+    main.run_migrations()
+    if args.scenario == "commands":
+        commands_scenario(args)
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+        return
+
+    modes = ("fixed", "adaptive") if args.mode == "both" else (args.mode,)
+    print(f"devices={args.devices} duration={args.duration}s backlog={args.backlog} "
+          f"target_rps={args.target_rps} max_backoff={args.max_backoff}")
+    print(f"{'mode':<10}{'phase':<11}{'requests':>10}{'peak rps':>10}{'busy secs':>11}"
+          f"{'lat p50 ms':>12}{'lat p99 ms':>12}")
+    for mode in modes:
+        port = free_port()
+        server = start_server(port, {"ADMS_TARGET_DEVICE_RPS": str(args.target_rps),
+                                     "ADMS_MAX_POLL_BACKOFF": str(args.max_backoff)})
+        fleet = asyncio.run(run_fleet(port, mode == "adaptive", args))
+        server.send_signal(signal.SIGINT)
+        _, _, usage = os.wait4(server.pid, 0)
+
+        blip = args.duration // 2
+        for phase, seconds in (("startup", range(0, blip)), ("reconnect", range(blip, args.duration))):
+            per_second = [fleet.arrivals.get(second, 0) for second in seconds]
+            latencies = [latency for second, latency in fleet.latencies if second in seconds]
+            # Seconds in which more than a tenth of the fleet arrived at once
+            busy = sum(1 for count in per_second if count > args.devices / 10)
+            print(f"{mode:<10}{phase:<11}{sum(per_second):>10}{max(per_second):>10}{busy:>11}"
+                  f"{statistics.median(latencies or [0]) * 1000:>12.1f}{percentile(latencies, 0.99) * 1000:>12.1f}")
+        print(f"{mode:<10}errors={fleet.errors} largest Delay handed out={max(fleet.backoffs or [FACTORY_DELAY])}s "
+              f"server cpu={usage.ru_utime + usage.ru_stime:.2f}s")
+
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,288 @@
+"""Regression-guarded micro-benchmarks of the device hot paths.
+
+Seeds a database of realistic size (by default 1k devices, 10M punches and 1M queued
+and executed commands), then times, each over --rounds rounds keeping the best:
+
+  register_or_update_device   one device poll's bookkeeping
+  get_pending_commands        one device's queue lookup
+  clear_commands_from_queue   marking one device's 10 queued commands as sent
+  parse_attendance_line       one ATTLOG line of a cdata upload
+  format_device_commands      rendering one device's 10 queued commands
+  GET /api/devices            the get_devices handler
+  GET /api/attendance         the get_attendance_logs handler (limit=100)
+
+Results are compared with the baseline stored for the same dataset in
+benchmarks/baseline.json; the run exits with status 1 if any benchmark is more than
+--threshold slower. Everything runs in-process with no network access. The seeded
+database is cached in --cache-dir and copied for each run, so only the first run
+pays for seeding.
+
+    python benchmarks/suite.py                       # compare with the baseline
+    python benchmarks/suite.py --save-baseline       # record a new baseline
+    python benchmarks/suite.py --scale 0.01          # 10 devices, 100k punches, 10k commands
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+USERS_PER_DEVICE = 20
+QUEUED_PER_DEVICE = 10
+SEED_VERSION = 1  # bump when seed() changes so cached databases are rebuilt
+FIRST_DAY = "2025-01-01"
+COMMAND_TEMPLATES = (
+    "INFO", "CHECK", "REBOOT", "c:DATA QUERY ATTLOG StartTime=2026-01-01 00:00:00\tEndTime=2026-01-31 23:59:59",
+    "DATA UPDATE USERINFO PIN=%d\tName=Employee %d\tPri=0\tPasswd=\tCard=\tGrp=1", "DATA DELETE USERINFO PIN=%d",
+)
+
+
+def dataset_key(args) -> str:
+    return f"devices={args.devices} punches={args.punches} commands={args.commands}"
+
+
+def rebuild_indexes(conn, table: str, build):
+    """Drop the secondary indexes of table, run build(), and recreate them in one pass each"""
+    indexes = conn.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                           (table,)).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX {name}')
+    build()
+    for _, sql in indexes:
+        conn.execute(sql)
+    conn.commit()
+
+
+def seed(main, args, path: str):
+    """Write a migrated database holding the benchmark dataset to path"""
+    workdir = tempfile.mkdtemp(prefix="adms-seed-")
+    os.chdir(workdir)
+    main.run_migrations()
+    conn = sqlite3.connect('adms.db')
+    users = args.devices * USERS_PER_DEVICE
+    started = time.perf_counter()
+
+    conn.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1)
+        INSERT INTO devices (serial_number, ip_address, model, last_seen, firmware_version, status)
+        SELECT printf('SN%05d', i), printf('10.0.%d.%d', i / 250, i % 250 + 2), 'MB460',
+               strftime('%Y-%m-%dT%H:%M:%S', 'now', printf('-%d seconds', i * 3)), 'Ver 8.0.4.2', 'online'
+        FROM n
+    ''', (args.devices,))
+    conn.execute('''
+        WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1)
+        INSERT INTO users (user_id, name, privilege, card, group_id, device_sn, updated_at)
+        SELECT printf('%d', i), printf('Employee %d', i), 0, '', '1', printf('SN%05d', i / ?), ? FROM n
+    ''', (users, USERS_PER_DEVICE, FIRST_DAY))
+    conn.commit()
+
+    # Two punches per user per day, spread over 90-minute arrival and departure windows.
+    # They are generated in (device_sn, user_id, timestamp) order so the UNIQUE index,
+    # which cannot be dropped, is appended to rather than updated at random
+    per_device = args.punches // args.devices
+    per_user = max(1, per_device // USERS_PER_DEVICE)
+
+    def insert_punches():
+        step = 1000000
+        for first in range(0, args.devices * per_device, step):
+            last = min(first + step, args.devices * per_device)
+            conn.execute('''
+                WITH RECURSIVE n(i) AS (SELECT ? UNION ALL SELECT i + 1 FROM n WHERE i < ? - 1)
+                INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status)
+                SELECT printf('SN%05d', i / ?),
+                       printf('%d', (i / ?) * ? + (i % ?) / ?),
+                       strftime('%Y-%m-%d %H:%M:%S', ?, printf('+%d days', (i % ?) / 2),
+                                printf('+%d seconds', CASE i % 2 WHEN 0 THEN 27000 ELSE 60000 END + i * 2654435761 % 5400)),
+                       1 + i % 2, i % 2
+                FROM n
+            ''', (first, last, per_device, per_device, USERS_PER_DEVICE, per_device, per_user, FIRST_DAY, per_user))
+            conn.commit()
+            print(f"  seeded {last:,} punches ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    rebuild_indexes(conn, "attendance_logs", insert_punches)
+
+    # Per device: executed history first, the newest QUEUED_PER_DEVICE still queued
+    per_device_commands = max(QUEUED_PER_DEVICE, args.commands // args.devices)
+
+    def command_rows():
+        for device in range(args.devices):
+            for n in range(per_device_commands):
+                template = COMMAND_TEMPLATES[n % len(COMMAND_TEMPLATES)]
+                created = f"2026-01-{1 + n * 28 // per_device_commands:02d} {device % 24:02d}:{n % 60:02d}:00"
+                if n >= per_device_commands - QUEUED_PER_DEVICE:
+                    status, executed_at, response = "queued", None, None
+                else:
+                    status = ("completed", "completed", "completed", "failed", "timeout")[n % 5]
+                    executed_at, response = created, "OK" if status == "completed" else None
+                yield (f"SN{device:05d}", template % ((n,) * template.count("%d")), status, created, executed_at, response)
+
+    def insert_commands():
+        conn.executemany('''
+            INSERT INTO device_commands (device_sn, command, status, created_at, executed_at, response, command_type)
+            VALUES (?, ?, ?, ?, ?, ?, 'raw')
+        ''', command_rows())
+        conn.commit()
+
+    rebuild_indexes(conn, "device_commands", insert_commands)
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+    print(f"  seeded {args.commands:,} commands ({time.perf_counter() - started:.0f}s)", flush=True)
+
+    os.chdir(REPO_DIR)
+    shutil.move(os.path.join(workdir, 'adms.db'), path)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def requeue_sent_commands():
+    conn = sqlite3.connect('adms.db')
+    conn.execute("UPDATE device_commands SET status = 'queued', sent_at = NULL WHERE status = 'sent'")
+    conn.commit()
+    conn.close()
+
+
+def build_benchmarks(main, args):
+    """name -> (setup run before each round, op(i), ops per round)"""
+    devices = [f"SN{i:05d}" for i in range(args.devices)]
+    users = args.devices * USERS_PER_DEVICE
+    loop = asyncio.new_event_loop()
+    noop = lambda: None
+
+    conn = sqlite3.connect('adms.db')
+    queued = {}
+    for command_id, sn, command in conn.execute(
+            "SELECT id, device_sn, command FROM device_commands WHERE status = 'queued' ORDER BY id"):
+        queued.setdefault(sn, []).append((command_id, command))
+    conn.close()
+    batches = [(sn, [command_id for command_id, _ in commands]) for sn, commands in queued.items()]
+    rows = [[(command_id, command, "raw") for command_id, command in commands] for commands in queued.values()]
+
+    lines = []
+    for n in range(1000):
+        user_id, day, minute = n * 7919 % users, 1 + n % 28, n % 60
+        lines.append((f"{user_id}\t2026-02-{day:02d} 08:{minute:02d}:00\t1\t0",
+                      f"TRANS\t{user_id}\t2026-02-{day:02d} 17:{minute:02d}:00\t15\t1",
+                      f"{user_id} 2026-02-{day:02d} 12:{minute:02d}:00 1 0 0 0")[n % 3])
+
+    return {
+        "register_or_update_device": (noop, lambda i: main.register_or_update_device(
+            devices[i % len(devices)], "10.0.0.7", "MB460", "Ver 8.0.4.2"), 2000),
+        "get_pending_commands": (noop, lambda i: main.get_pending_commands(devices[i * 7 % len(devices)]), 2000),
+        "clear_commands_from_queue": (requeue_sent_commands,
+                                      lambda i: main.clear_commands_from_queue(*batches[i]), min(1000, len(batches))),
+        "parse_attendance_line": (noop, lambda i: main.parse_attendance_line(lines[i % len(lines)]), 200000),
+        "format_device_commands": (noop, lambda i: main.format_device_commands(rows[i % len(rows)]), 50000),
+        "GET /api/devices": (noop, lambda i: loop.run_until_complete(main.get_devices()), 50),
+        "GET /api/attendance": (noop, lambda i: loop.run_until_complete(main.get_attendance_logs(limit=100)), 500),
+    }
+
+
+def run_benchmark(setup, op, ops: int, rounds: int) -> float:
+    """Best ops/s over rounds, after one untimed warm-up round"""
+    best = 0.0
+    for round_number in range(rounds + 1):
+        setup()
+        started = time.perf_counter()
+        for i in range(ops):
+            op(i)
+        if round_number:
+            best = max(best, ops / (time.perf_counter() - started))
+    return best
+
+
+def load_baselines(path: str):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the default dataset size")
+    parser.add_argument("--devices", type=int)
+    parser.add_argument("--punches", type=int)
+    parser.add_argument("--commands", type=int)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--only", help="comma-separated benchmark names")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown against the baseline (0.2 = 20%%)")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline of its dataset")
+    parser.add_argument("--cache-dir", default=os.path.join(tempfile.gettempdir(), "adms-bench-cache"))
+    args = parser.parse_args()
+    args.devices = args.devices or max(10, int(1000 * args.scale))
+    args.punches = args.punches or int(10000000 * args.scale)
+    args.commands = args.commands or int(1000000 * args.scale)
+
+    sys.path.insert(0, REPO_DIR)
+    import main
+    logging.getLogger().handlers = [logging.NullHandler()]
+    logging.getLogger().setLevel(logging.WARNING)
+    main.ATTENDANCE_SHARDS = 0
+
+    # A new migration changes the schema, so it gets a fresh seed
+    os.makedirs(args.cache_dir, exist_ok=True)
+    seed_path = os.path.join(args.cache_dir, f"seed-{SEED_VERSION}-{args.devices}-{args.punches}-{args.commands}-v{len(main.MIGRATIONS)}.db")
+    if not os.path.exists(seed_path):
+        print(f"seeding {dataset_key(args)} into {seed_path}", flush=True)
+        seed(main, args, seed_path)
+
+    workdir = tempfile.mkdtemp(prefix="adms-bench-")
+    shutil.copyfile(seed_path, os.path.join(workdir, 'adms.db'))
+    os.chdir(workdir)
+    anchor = sqlite3.connect('adms.db')  # what keep_databases_open does at startup
+    anchor.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+
+    benchmarks = build_benchmarks(main, args)
+    if args.only:
+        benchmarks = {name: benchmarks[name] for name in args.only.split(",")}
+
+    baselines = load_baselines(args.baseline)
+    baseline = baselines.get(dataset_key(args), {}).get("results", {})
+    print(f"{dataset_key(args)} rounds={args.rounds} threshold={args.threshold:.0%}")
+    print(f"{'benchmark':<30}{'ops/s':>14}{'baseline':>14}{'change':>9}")
+    results = {}
+    regressions = []
+    for name, (setup, op, ops) in benchmarks.items():
+        results[name] = run_benchmark(setup, op, ops, args.rounds)
+        line = f"{name:<30}{results[name]:>14,.1f}"
+        if name in baseline:
+            change = results[name] / baseline[name] - 1
+            line += f"{baseline[name]:>14,.1f}{change:>+9.1%}"
+            if change < -args.threshold:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line, flush=True)
+
+    anchor.close()
+    os.chdir(REPO_DIR)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        baselines[dataset_key(args)] = {
+            "machine": {"python": platform.python_version(), "platform": platform.platform(),
+                        "processor": platform.processor(), "cpus": os.cpu_count()},
+            "recorded_at": time.strftime("%Y-%m-%d"),
+            "results": {**baseline, **{name: round(value, 1) for name, value in results.items()}},
+        }
+        with open(args.baseline, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+    elif not baseline:
+        print(f"no baseline for this dataset in {args.baseline}; record one with --save-baseline")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
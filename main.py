@@ -1,6 +1,9 @@
 from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, Response
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Address, MutableHeaders, QueryParams
 from pydantic import BaseModel
 from typing import Optional, List
 import sqlite3
@@ -9,10 +12,43 @@ import datetime
 from datetime import timezone, timedelta
 import logging
 import os
+import sys
 import urllib.request
 import urllib.error
+import urllib.parse
 import threading
+import asyncio
 import time
+import gzip
+import csv
+import heapq
+import itertools
+import fnmatch
+import uuid
+import hashlib
+import tempfile
+import shutil
+import mmap
+import re
+import contextlib
+import contextvars
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # reports are unavailable without NumPy
+    np = None
+
+try:
+    import brotli
+except ImportError:  # the dashboard is then served gzip or uncompressed
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:  # Windows locks the process lock file with msvcrt
+    fcntl = None
+    import msvcrt
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -35,79 +71,177 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database migration function
-def migrate_database():
-    """Migrate existing database to add unique constraints and indexes"""
-    conn = sqlite3.connect('adms.db')
-    cursor = conn.cursor()
-    
+# Schema migrations
+# Every step is numbered and idempotent; PRAGMA user_version records the last step
+# applied, so a database that is up to date costs a single PRAGMA read at startup.
+# Migrations run explicitly (start_server.py, `python main.py migrate`) or from the
+# startup hook when the schema is behind, never at import time.
+MIGRATION_CHUNK_SIZE = int(os.environ.get("ADMS_MIGRATION_CHUNK_SIZE", "50000"))  # rows per transaction when copying or moving data
+MIGRATION_CHUNK_PAUSE = float(os.environ.get("ADMS_MIGRATION_CHUNK_PAUSE", "0.01"))  # seconds between chunks
+
+ATTENDANCE_LOG_COLUMNS = ["id", "device_sn", "user_id", "timestamp", "verify_mode", "status", "created_at"]
+
+def attendance_logs_ddl(table_name: str = "attendance_logs") -> str:
+    return f'''
+        CREATE TABLE IF NOT EXISTS {table_name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_sn TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            verify_mode INTEGER,
+            status INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (device_sn) REFERENCES devices (serial_number),
+            UNIQUE(device_sn, user_id, timestamp)
+        )
+    '''
+
+def table_exists(conn, table_name: str) -> bool:
+    cursor = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return cursor.fetchone() is not None
+
+def has_unique_index(conn, table_name: str, columns: List[str]) -> bool:
+    """Check for a UNIQUE index (or constraint) covering exactly the given columns"""
+    for index in conn.execute(f"PRAGMA index_list({table_name})").fetchall():
+        if not index[2]:  # not unique
+            continue
+        index_columns = [info[2] for info in conn.execute(f"PRAGMA index_info('{index[1]}')").fetchall()]
+        if index_columns == columns:
+            return True
+    return False
+
+def rebuild_table_online(conn, table_name: str, create_ddl: str, columns: List[str]):
+    """Rebuild a table into {table_name}_new in id-ordered chunks, then swap it in.
+
+    Each chunk is its own short transaction so the server keeps serving while a large
+    table is copied. Triggers on the source table log the id of every row inserted,
+    updated or deleted meanwhile into {table_name}_changes; those rows are re-copied
+    from the source (or dropped) before, and finally during, the short swap. An
+    interrupted rebuild resumes from the rows already copied. The copy uses INSERT OR
+    IGNORE, so rows violating the new table's constraints are dropped; their ids wait
+    in {table_name}_pending until a change frees the conflicting key or the swap.
+    create_ddl must create {table_name}_new with IF NOT EXISTS.
+    """
+    new_table = f"{table_name}_new"
+    changes_table = f"{table_name}_changes"
+    pending_table = f"{table_name}_pending"
+    column_list = ", ".join(columns)
+
+    conn.execute("BEGIN IMMEDIATE")
+    trigger_names = [f"{table_name}_rebuild_{event}" for event in ("insert", "update", "delete")]
+    logged = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name IN (?, ?, ?)",
+                          trigger_names).fetchone()[0]
+    if logged < 3:
+        # A copy made without the change log (or a half-created one) cannot be resumed
+        conn.execute(f"DROP TABLE IF EXISTS {new_table}")
+        conn.execute(f"DROP TABLE IF EXISTS {changes_table}")
+        conn.execute(f"DROP TABLE IF EXISTS {pending_table}")
+    conn.execute(create_ddl)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {changes_table} (seq INTEGER PRIMARY KEY, row_id INTEGER NOT NULL)")
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {pending_table} (row_id INTEGER PRIMARY KEY)")
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rebuild_insert AFTER INSERT ON {table_name}
+        BEGIN INSERT INTO {changes_table} (row_id) VALUES (NEW.id); END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rebuild_update AFTER UPDATE ON {table_name}
+        BEGIN
+            INSERT INTO {changes_table} (row_id) VALUES (OLD.id);
+            INSERT INTO {changes_table} (row_id) SELECT NEW.id WHERE NEW.id != OLD.id;
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS {table_name}_rebuild_delete AFTER DELETE ON {table_name}
+        BEGIN INSERT INTO {changes_table} (row_id) VALUES (OLD.id); END
+    ''')
+    conn.execute("COMMIT")
+
+    last_id = conn.execute(f"SELECT COALESCE(MAX(id), 0) FROM {new_table}").fetchone()[0]
+    total = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE id > ?", (last_id,)).fetchone()[0]
+    copied = 0
+    logger.info(f"[Migration] Rebuilding {table_name}: {total} rows to copy in chunks of {MIGRATION_CHUNK_SIZE}")
+
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        chunk_end = conn.execute(f'''
+            SELECT MAX(id) FROM (SELECT id FROM {table_name} WHERE id > ? ORDER BY id LIMIT ?)
+        ''', (last_id, MIGRATION_CHUNK_SIZE)).fetchone()[0]
+        if chunk_end is None:
+            conn.execute("COMMIT")
+            break
+        cursor = conn.execute(f'''
+            INSERT OR IGNORE INTO {new_table} ({column_list})
+            SELECT {column_list} FROM {table_name} WHERE id > ? AND id <= ? ORDER BY id
+        ''', (last_id, chunk_end))
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {pending_table} (row_id)
+            SELECT id FROM {table_name} AS source WHERE id > ? AND id <= ?
+            AND NOT EXISTS (SELECT 1 FROM {new_table} WHERE id = source.id)
+        ''', (last_id, chunk_end))
+        conn.execute("COMMIT")
+
+        copied += cursor.rowcount
+        last_id = chunk_end
+        logger.info(f"[Migration] Rebuilding {table_name}: copied {copied}/{total} rows")
+        time.sleep(MIGRATION_CHUNK_PAUSE)
+
+    def replay_changes(limit: int) -> int:
+        """Bring up to limit logged rows of the new table in line with the source"""
+        replayed = 0
+        through = conn.execute(f'''
+            SELECT MAX(seq) FROM (SELECT seq FROM {changes_table} ORDER BY seq LIMIT ?)
+        ''', (limit,)).fetchone()[0]
+        if through is not None:
+            changed = f"SELECT row_id FROM {changes_table} WHERE seq <= ?"
+            conn.execute(f"DELETE FROM {new_table} WHERE id IN ({changed})", (through,))
+            conn.execute(f"INSERT OR IGNORE INTO {pending_table} (row_id) {changed}", (through,))
+            replayed = conn.execute(f"DELETE FROM {changes_table} WHERE seq <= ?", (through,)).rowcount
+        # Changed rows, and rows dropped earlier whose conflicting row may be gone now
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {new_table} ({column_list})
+            SELECT {column_list} FROM {table_name} WHERE id IN (SELECT row_id FROM {pending_table}) ORDER BY id
+        ''')
+        conn.execute(f'''
+            DELETE FROM {pending_table} WHERE row_id IN (SELECT id FROM {new_table})
+            OR row_id NOT IN (SELECT id FROM {table_name})
+        ''')
+        return replayed
+
+    # Catch up with the changes made during the copy, a chunk per transaction
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        replayed = replay_changes(MIGRATION_CHUNK_SIZE)
+        conn.execute("COMMIT")
+        if replayed < MIGRATION_CHUNK_SIZE:
+            break
+        time.sleep(MIGRATION_CHUNK_PAUSE)
+
+    # Swap in one short transaction, after the changes that arrived since
+    conn.execute("BEGIN IMMEDIATE")
     try:
-        # Check if the attendance_logs table needs migration
-        cursor.execute("PRAGMA table_info(attendance_logs)")
-        columns = cursor.fetchall()
-        
-        # Check if UNIQUE constraint exists by checking indexes
-        cursor.execute("PRAGMA index_list(attendance_logs)")
-        indexes = cursor.fetchall()
-        
-        # Check if unique constraint already exists
-        has_unique_constraint = False
-        for index in indexes:
-            cursor.execute(f"PRAGMA index_info({index[1]})")
-            index_info = cursor.fetchall()
-            if len(index_info) == 3:  # device_sn, user_id, timestamp
-                has_unique_constraint = True
-                break
-        
-        if not has_unique_constraint:
-            logger.info("[Migration] Adding unique constraint to attendance_logs table...")
-            
-            # Create new table with unique constraint
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS attendance_logs_new (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    device_sn TEXT NOT NULL,
-                    user_id TEXT NOT NULL,
-                    timestamp TIMESTAMP NOT NULL,
-                    verify_mode INTEGER,
-                    status INTEGER,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (device_sn) REFERENCES devices (serial_number),
-                    UNIQUE(device_sn, user_id, timestamp)
-                )
-            ''')
-            
-            # Copy data from old table to new table, removing duplicates
-            cursor.execute('''
-                INSERT OR IGNORE INTO attendance_logs_new 
-                (id, device_sn, user_id, timestamp, verify_mode, status, created_at)
-                SELECT id, device_sn, user_id, timestamp, verify_mode, status, created_at
-                FROM attendance_logs
-                ORDER BY created_at ASC
-            ''')
-            
-            # Drop old table
-            cursor.execute('DROP TABLE IF EXISTS attendance_logs')
-            
-            # Rename new table
-            cursor.execute('ALTER TABLE attendance_logs_new RENAME TO attendance_logs')
-            
-            logger.info("[Migration] Successfully migrated attendance_logs table")
-        
-        conn.commit()
-    except Exception as e:
-        logger.error(f"[Migration] Error during database migration: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+        while replay_changes(MIGRATION_CHUNK_SIZE):
+            pass
+        # AUTOINCREMENT must not hand out the ids of rows deleted before the rebuild
+        sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table_name,)).fetchone()
+        conn.execute(f"DROP TABLE {table_name}")  # and its triggers
+        conn.execute(f"DROP TABLE {changes_table}")
+        conn.execute(f"DROP TABLE {pending_table}")
+        conn.execute(f"ALTER TABLE {new_table} RENAME TO {table_name}")
+        if sequence:
+            conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = ?", (sequence[0], table_name))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"[Migration] Rebuilt {table_name}")
 
-# Database setup
-def init_db():
-    conn = sqlite3.connect('adms.db')
-    cursor = conn.cursor()
-    
-    # Create devices table
-    cursor.execute('''
+def migration_initial_schema(conn):
+    # Let bulk deletes hand free pages back a chunk at a time. This only takes effect
+    # on a brand new database; `python main.py vacuum` converts existing ones.
+    if not table_exists(conn, "devices"):
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS devices (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             serial_number TEXT UNIQUE NOT NULL,
@@ -119,8 +253,7 @@ def init_db():
         )
     ''')
     
-    # Create device_commands table
-    cursor.execute('''
+    conn.execute('''
         CREATE TABLE IF NOT EXISTS device_commands (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             device_sn TEXT NOT NULL,
@@ -133,34 +266,790 @@ def init_db():
         )
     ''')
     
-    # Create attendance_logs table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS attendance_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            device_sn TEXT NOT NULL,
-            user_id TEXT NOT NULL,
-            timestamp TIMESTAMP NOT NULL,
-            verify_mode INTEGER,
-            status INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (device_sn) REFERENCES devices (serial_number),
-            UNIQUE(device_sn, user_id, timestamp)
-        )
-    ''')
-    
-    # Create index for faster queries on attendance logs
-    cursor.execute('''
+    conn.execute(attendance_logs_ddl())
+
+def migration_attendance_unique(conn):
+    # Databases created by early versions lack UNIQUE(device_sn, user_id, timestamp)
+    if has_unique_index(conn, "attendance_logs", ["device_sn", "user_id", "timestamp"]):
+        return
+    logger.info("[Migration] Adding unique constraint to attendance_logs table...")
+    rebuild_table_online(conn, "attendance_logs", attendance_logs_ddl("attendance_logs_new"), ATTENDANCE_LOG_COLUMNS)
+
+def migration_attendance_indexes(conn):
+    conn.execute('''
         CREATE INDEX IF NOT EXISTS idx_attendance_device_timestamp 
         ON attendance_logs (device_sn, timestamp DESC)
     ''')
     
-    cursor.execute('''
+    conn.execute('''
         CREATE INDEX IF NOT EXISTS idx_attendance_user 
         ON attendance_logs (user_id, timestamp DESC)
     ''')
     
-    conn.commit()
+    # Used by /api/attendance ordering and by the retention job to find old months
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_timestamp 
+        ON attendance_logs (timestamp)
+    ''')
+
+def migration_attendance_archives(conn):
+    # One row per archived month partition
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS attendance_archives (
+            month TEXT PRIMARY KEY,
+            file_path TEXT NOT NULL,
+            record_count INTEGER NOT NULL,
+            first_timestamp TIMESTAMP,
+            last_timestamp TIMESTAMP,
+            archived_at TIMESTAMP
+        )
+    ''')
+
+def column_exists(conn, table_name: str, column_name: str) -> bool:
+    return any(column[1] == column_name for column in conn.execute(f"PRAGMA table_info({table_name})").fetchall())
+
+def migration_command_type(conn):
+    # Time sync is a first-class command type instead of a timestamp-shaped command string
+    if not column_exists(conn, "device_commands", "command_type"):
+        conn.execute(f"ALTER TABLE device_commands ADD COLUMN command_type TEXT NOT NULL DEFAULT '{COMMAND_TYPE_RAW}'")
+    conn.execute('''
+        UPDATE device_commands SET command_type = ?
+        WHERE command GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+    ''', (COMMAND_TYPE_SYNCTIME,))
+
+def migration_command_retries(conn):
+    # Ack-timeout tracking for commands that were sent but never acknowledged
+    if not column_exists(conn, "device_commands", "sent_at"):
+        conn.execute("ALTER TABLE device_commands ADD COLUMN sent_at TIMESTAMP NULL")
+    if not column_exists(conn, "device_commands", "retry_count"):
+        conn.execute("ALTER TABLE device_commands ADD COLUMN retry_count INTEGER NOT NULL DEFAULT 0")
+    
+    # Pending-command lookups per device, and the startup scan of in-flight commands
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commands_device_status 
+        ON device_commands (device_sn, status, created_at)
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_commands_status 
+        ON device_commands (status)
+    ''')
+
+def migration_blob_store(conn):
+    # Content-addressed uploads (fingerprint templates, attendance photos)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            file_path TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS device_uploads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_sn TEXT NOT NULL,
+            table_name TEXT NOT NULL,
+            pin TEXT,
+            sha256 TEXT NOT NULL,
+            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (device_sn) REFERENCES devices (serial_number),
+            FOREIGN KEY (sha256) REFERENCES blobs (sha256)
+        )
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_uploads_device 
+        ON device_uploads (device_sn, uploaded_at DESC)
+    ''')
+
+def migration_users(conn):
+    # Users enrolled on the terminals, synced from USERINFO/OPERLOG uploads
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id TEXT PRIMARY KEY,
+            name TEXT,
+            privilege INTEGER,
+            card TEXT,
+            group_id TEXT,
+            device_sn TEXT,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+def migration_daily_attendance(conn):
+    # First-in / last-out per user per day, maintained by ingestion
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS daily_attendance (
+            user_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            first_in TIMESTAMP NOT NULL,
+            last_out TIMESTAMP NOT NULL,
+            punch_count INTEGER NOT NULL,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_daily_attendance_day 
+        ON daily_attendance (day, user_id)
+    ''')
+    
+    # Backfill from the hot table one month at a time so each transaction stays short
+    lower_bound = ""
+    while True:
+        oldest = conn.execute('''
+            SELECT MIN(timestamp) FROM attendance_logs WHERE timestamp >= ? AND timestamp GLOB ?
+        ''', (lower_bound, MONTH_TIMESTAMP_GLOB)).fetchone()[0]
+        if not oldest:
+            break
+        year, month = int(oldest[0:4]), int(oldest[5:7])
+        upper_bound = month_start(*next_month(year, month))
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute('''
+            INSERT OR REPLACE INTO daily_attendance (user_id, day, first_in, last_out, punch_count)
+            SELECT user_id, substr(timestamp, 1, 10), MIN(timestamp), MAX(timestamp), COUNT(*)
+            FROM attendance_logs
+            WHERE timestamp >= ? AND timestamp < ? AND timestamp GLOB ?
+            GROUP BY user_id, substr(timestamp, 1, 10)
+        ''', (month_start(year, month), upper_bound, MONTH_TIMESTAMP_GLOB))
+        conn.execute("COMMIT")
+        lower_bound = upper_bound
+
+def migration_webhooks(conn):
+    # Downstream consumers of new attendance; cursor is the last attendance_logs.id delivered
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS webhook_subscribers (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            url TEXT NOT NULL,
+            cursor INTEGER NOT NULL DEFAULT 0,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_delivery_at TIMESTAMP,
+            last_error TEXT
+        )
+    ''')
+
+def migration_wal(conn):
+    # Write-ahead logging: readers (API queries, backup snapshots) no longer block
+    # ingestion and ingestion no longer blocks them. The mode is stored in the file.
+    mode = conn.execute('PRAGMA journal_mode=WAL').fetchone()[0]
+    if mode != "wal":
+        logger.warning(f"[Migration] Write-ahead logging is not available here; journal mode stays {mode}")
+
+def migration_user_timeline_index(conn):
+    # Covers /api/users/{user_id}/attendance so lookups never read the table rows.
+    # idx_attendance_user (user_id, timestamp DESC) is a prefix of it and goes away.
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_attendance_user_timeline
+        ON attendance_logs (user_id, timestamp DESC, device_sn, verify_mode, status)
+    ''')
+    conn.execute('DROP INDEX IF EXISTS idx_attendance_user')
+
+def migration_tenants(conn):
+    # Tenant registry for multi-tenant mode. Only the default database uses it;
+    # tenant databases get the (empty) tables along with the rest of the schema.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tenants (
+            name TEXT PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS tenant_devices (
+            serial_number TEXT PRIMARY KEY,
+            tenant TEXT NOT NULL REFERENCES tenants (name),
+            assigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def migration_command_changes(conn):
+    # change_seq numbers every insert and status change of a command in commit order,
+    # so /api/commands?since= can return just the commands changed after a cursor
+    if not column_exists(conn, "device_commands", "change_seq"):
+        conn.execute("ALTER TABLE device_commands ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+        conn.execute("UPDATE device_commands SET change_seq = id")
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_commands_change_seq ON device_commands (change_seq)')
+    for name, event in (("device_commands_inserted", "INSERT"),
+                        ("device_commands_changed", "UPDATE OF status, executed_at, response, retry_count")):
+        conn.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON device_commands
+            BEGIN
+                UPDATE device_commands SET change_seq = (SELECT MAX(change_seq) FROM device_commands) + 1
+                WHERE id = NEW.id;
+            END
+        ''')
+
+def migration_id_sequences(conn):
+    # Ids handed out across databases (attendance records in the shards), one row per sequence
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS id_sequences (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        )
+    ''')
+
+# (version, description, step). Append new steps; never renumber or edit applied ones.
+MIGRATIONS = [
+    (1, "initial schema", migration_initial_schema),
+    (2, "unique attendance records", migration_attendance_unique),
+    (3, "attendance indexes", migration_attendance_indexes),
+    (4, "attendance archive partitions", migration_attendance_archives),
+    (5, "device command types", migration_command_type),
+    (6, "command ack timeouts", migration_command_retries),
+    (7, "blob store", migration_blob_store),
+    (8, "users", migration_users),
+    (9, "daily attendance summaries", migration_daily_attendance),
+    (10, "webhook subscribers", migration_webhooks),
+    (11, "write-ahead log", migration_wal),
+    (12, "user timeline covering index", migration_user_timeline_index),
+    (13, "tenant registry", migration_tenants),
+    (14, "command change sequence", migration_command_changes),
+    (15, "id sequences", migration_id_sequences),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(db_path: str = 'adms.db') -> int:
+    """Apply all pending migration steps and return the resulting schema version"""
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        version = get_schema_version(conn)
+        if version >= SCHEMA_VERSION:
+            return version
+
+        for step_version, description, step in MIGRATIONS:
+            if step_version <= version:
+                continue
+
+            started = time.time()
+            logger.info(f"[Migration] Applying {step_version}: {description}")
+            step(conn)
+            conn.execute(f"PRAGMA user_version = {step_version}")
+            version = step_version
+            logger.info(f"[Migration] Applied {step_version} in {time.time() - started:.2f}s")
+
+        return version
+    except Exception as e:
+        logger.error(f"[Migration] Error during database migration: {e}", exc_info=True)
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+# Process lock
+# Attendance publication order, ack deadlines, resource versions and delta cursors
+# are kept in memory, so one server process owns a data directory. The server takes
+# an exclusive lock on PROCESS_LOCK_FILE at startup and holds it until it exits; a
+# second server or uvicorn worker on the same directory refuses to start.
+PROCESS_LOCK_FILE = os.environ.get("ADMS_LOCK_FILE", "adms.lock")
+
+_process_lock = None  # the open, locked file while this process holds the lock
+
+def acquire_process_lock() -> bool:
+    """Take the data directory lock for this process; False if another process holds it"""
+    global _process_lock
+    if _process_lock is not None:
+        return True
+    lock_file = open(PROCESS_LOCK_FILE, "a+")
+    try:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        lock_file.close()
+        return False
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    _process_lock = lock_file
+    return True
+
+def process_lock_owner() -> Optional[str]:
+    """Process id recorded by the holder of the lock"""
+    try:
+        with open(PROCESS_LOCK_FILE) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+@app.on_event("startup")
+async def lock_data_directory():
+    if not acquire_process_lock():
+        logger.error(f"[Startup] Another ADMS server (pid {process_lock_owner()}) is using this data directory; "
+                     f"run a single worker per directory")
+        raise RuntimeError(f"{PROCESS_LOCK_FILE} is locked by another process")
+
+@app.on_event("startup")
+async def ensure_schema():
+    conn = sqlite3.connect('adms.db')
+    version = get_schema_version(conn)
     conn.close()
+    
+    if version < SCHEMA_VERSION:
+        logger.warning(f"[Migration] Database schema is at version {version}, expected {SCHEMA_VERSION}; migrating now")
+        run_migrations()
+    migrate_attendance_shards()
+    if MULTI_TENANT:
+        load_tenant_registry()
+        migrate_tenants()
+
+# An idle connection per database keeps the WAL open. Otherwise closing the last
+# short-lived request connection checkpoints and deletes the WAL every time.
+_database_anchors = []
+
+@app.on_event("startup")
+async def keep_databases_open():
+    for db_path in database_paths():
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()
+        _database_anchors.append(conn)
+
+# Tenants
+# With ADMS_MULTI_TENANT=1 one server hosts several customers, each with its own
+# adms.db (and archive, blob, spool and backup directories) under TENANT_DIR/<name>/,
+# so one customer's writes never wait on another's lock. A request is routed to a
+# tenant by URL prefix (/t/<name>/api/..., /t/<name>/iclock/...) or, for devices
+# that cannot be pointed at a path, by the tenant its serial number is registered
+# to. Anything else goes to the default database, adms.db, which also holds the
+# tenant registry. The tenant of the running request is kept in a context variable;
+# background threads set it for the tenant they work on.
+MULTI_TENANT = os.environ.get("ADMS_MULTI_TENANT", "0") == "1"
+TENANT_DIR = os.environ.get("ADMS_TENANT_DIR", "tenants")
+TENANT_URL_PREFIX = "/t/"
+TENANT_WARM_COUNT = int(os.environ.get("ADMS_TENANT_WARM", "8"))  # busiest tenants opened at startup
+TENANT_WARM_HANDLES = 2  # connections opened per warmed tenant
+DEFAULT_TENANT = ""
+TENANT_NAME_PATTERN = re.compile(r"[a-z0-9][a-z0-9_-]{0,62}")
+
+_current_tenant = contextvars.ContextVar("tenant", default=DEFAULT_TENANT)
+_tenants = set()
+_tenant_devices = {}  # serial number -> tenant
+_tenants_lock = threading.Lock()
+
+def current_tenant() -> str:
+    return _current_tenant.get()
+
+@contextlib.contextmanager
+def use_tenant(tenant: str):
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+def tenant_path(path: str) -> str:
+    """path inside the current tenant's directory; unchanged for the default tenant"""
+    tenant = _current_tenant.get()
+    return os.path.join(TENANT_DIR, tenant, path) if tenant else path
+
+def tenant_url(path: str) -> str:
+    """URL of an API path for the current tenant"""
+    tenant = _current_tenant.get()
+    return f"{TENANT_URL_PREFIX}{tenant}{path}" if tenant else path
+
+def all_tenants():
+    """The default tenant followed by every registered one"""
+    with _tenants_lock:
+        return [DEFAULT_TENANT] + sorted(_tenants)
+
+def tenant_for_device(sn: Optional[str]) -> str:
+    return _tenant_devices.get(sn, DEFAULT_TENANT) if sn else DEFAULT_TENANT
+
+def load_tenant_registry():
+    conn = sqlite3.connect('adms.db')
+    try:
+        tenants = {name for (name,) in conn.execute('SELECT name FROM tenants').fetchall()}
+        devices = dict(conn.execute('SELECT serial_number, tenant FROM tenant_devices').fetchall())
+    finally:
+        conn.close()
+    with _tenants_lock:
+        _tenants.clear()
+        _tenants.update(tenants)
+        _tenant_devices.clear()
+        _tenant_devices.update(devices)
+
+def migrate_tenants():
+    """Bring every tenant database to the current schema"""
+    for tenant in all_tenants()[1:]:
+        os.makedirs(os.path.join(TENANT_DIR, tenant), exist_ok=True)
+        run_migrations(os.path.join(TENANT_DIR, tenant, 'adms.db'))
+
+def create_tenant(name: str) -> bool:
+    """Register a tenant and create its database; False if it already exists"""
+    os.makedirs(os.path.join(TENANT_DIR, name), exist_ok=True)
+    run_migrations(os.path.join(TENANT_DIR, name, 'adms.db'))
+    conn = sqlite3.connect('adms.db')
+    try:
+        cursor = conn.execute('INSERT OR IGNORE INTO tenants (name, created_at) VALUES (?, ?)',
+                              (name, datetime.datetime.now().isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    with _tenants_lock:
+        _tenants.add(name)
+    return cursor.rowcount > 0
+
+def assign_device_tenant(sn: str, tenant: Optional[str]):
+    """Route a device's /iclock requests to tenant, or back to the default database (None)"""
+    conn = sqlite3.connect('adms.db')
+    try:
+        if tenant:
+            conn.execute('INSERT OR REPLACE INTO tenant_devices (serial_number, tenant, assigned_at) VALUES (?, ?, ?)',
+                         (sn, tenant, datetime.datetime.now().isoformat()))
+        else:
+            conn.execute('DELETE FROM tenant_devices WHERE serial_number = ?', (sn,))
+        conn.commit()
+    finally:
+        conn.close()
+    with _tenants_lock:
+        if tenant:
+            _tenant_devices[sn] = tenant
+        else:
+            _tenant_devices.pop(sn, None)
+
+@app.on_event("startup")
+async def warm_tenants():
+    if not MULTI_TENANT:
+        return
+    if ATTENDANCE_SHARDS > 1:
+        logger.warning("[Tenants] ADMS_ATTENDANCE_SHARDS is ignored in multi-tenant mode")
+    
+    # Open the tenants with the most devices first, so their first polls find warm handles
+    counts = {}
+    for tenant in _tenant_devices.values():
+        counts[tenant] = counts.get(tenant, 0) + 1
+    hottest = sorted(all_tenants()[1:], key=lambda tenant: counts.get(tenant, 0), reverse=True)[:TENANT_WARM_COUNT]
+    for tenant in hottest:
+        with use_tenant(tenant):
+            handles = [connect_db() for _ in range(TENANT_WARM_HANDLES)]
+            for conn in handles:
+                conn.execute('SELECT 1 FROM sqlite_master LIMIT 1').fetchall()  # loads the schema
+                conn.close()
+    logger.info(f"[Tenants] {len(_tenants)} tenant(s), {len(_tenant_devices)} routed device(s); warmed {len(hottest)}")
+
+# Query tracing
+# With ADMS_QUERY_TRACE=1 (off by default; it roughly doubles the cost of a point
+# lookup), every statement run on a connect_db() connection is timed from execute
+# through its last fetch and counted under its family: the SQL with literals
+# replaced by ? and IN lists collapsed. It is counted when its rows run out, or when its cursor or
+# connection is closed. The first time one of the first QUERY_FAMILIES_MAX families
+# is seen its EXPLAIN QUERY PLAN is captured and full table scans are flagged. A
+# statement is logged with a fresh plan once its time passes SLOW_QUERY_MS.
+# /api/admin/queries lists the costliest families.
+QUERY_TRACE = os.environ.get("ADMS_QUERY_TRACE", "0") == "1"
+SLOW_QUERY_MS = float(os.environ.get("ADMS_SLOW_QUERY_MS", "100"))
+QUERY_FAMILIES_MAX = 1000  # later families are counted under QUERY_FAMILY_OTHER, unexplained
+QUERY_FAMILY_OTHER = "(other)"
+QUERY_PLAN_VERBS = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+_SQL_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LISTS = re.compile(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", re.IGNORECASE)
+_SQL_SPACES = re.compile(r"\s+")
+_FULL_SCAN = re.compile(r"SCAN (?:TABLE )?(\w+)")
+
+_query_stats = {}  # family -> totals, plan and full-scan flags
+_query_families = {}  # SQL text -> family
+_explained_families = set()  # families whose plan was captured
+_query_stats_lock = threading.Lock()
+
+def query_family(sql: str) -> str:
+    family = _query_families.get(sql)
+    if family is None:
+        family = _SQL_SPACES.sub(" ", _SQL_IN_LISTS.sub("IN (...)", _SQL_LITERALS.sub("?", sql))).strip()
+        if len(_query_families) >= QUERY_FAMILIES_MAX * 4:
+            _query_families.clear()
+        _query_families[sql] = family
+    return family
+
+def claim_query_plan(family: str) -> bool:
+    """True the first time a family is seen, until QUERY_FAMILIES_MAX families have been explained"""
+    with _query_stats_lock:
+        if family in _explained_families or len(_explained_families) >= QUERY_FAMILIES_MAX:
+            return False
+        _explained_families.add(family)
+        return True
+
+def explain_query(conn, sql: str, parameters):
+    """EXPLAIN QUERY PLAN detail lines; None for statements without a plan"""
+    if not sql.lstrip().upper().startswith(QUERY_PLAN_VERBS):
+        return None
+    if parameters is None:
+        parameters = [None] * sql.count("?")  # executemany: any values give the same plan
+    try:
+        return [row[3] for row in sqlite3.Connection.execute(conn, "EXPLAIN QUERY PLAN " + sql, parameters).fetchall()]
+    except sqlite3.Error:
+        return None
+
+def full_scans(plan) -> List[str]:
+    """Tables a plan reads without an index"""
+    return [match.group(1) for match in map(_FULL_SCAN.fullmatch, plan or ()) if match]
+
+def record_query(trace):
+    """Count one finished statement under its family"""
+    family, _, _, elapsed, rows, slow, plan = trace
+    with _query_stats_lock:
+        stats = _query_stats.get(family)
+        if stats is None:
+            if len(_query_stats) >= QUERY_FAMILIES_MAX:
+                family, plan = QUERY_FAMILY_OTHER, None
+                stats = _query_stats.get(family)
+            if stats is None:
+                stats = _query_stats[family] = {
+                    "calls": 0, "total": 0.0, "max": 0.0, "rows": 0, "slow": 0,
+                    "plan": plan, "full_scans": full_scans(plan)
+                }
+        stats["calls"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        stats["rows"] += rows
+        stats["slow"] += slow
+
+def log_slow_query(conn, trace):
+    family, sql, parameters, elapsed, rows = trace[:5]
+    plan = explain_query(conn, sql, parameters)
+    scans = full_scans(plan)
+    logger.warning(f"[SlowQuery] {elapsed * 1000:.1f} ms ({rows} rows fetched): {family}"
+                   f" | plan: {'; '.join(plan or ['-'])}" + (f" | FULL SCAN of {', '.join(scans)}" if scans else ""))
+
+class TracedCursor(sqlite3.Cursor):
+    """Times its statement across execute and every fetch"""
+    # [family, sql, parameters, seconds, rows, logged as slow, plan if the family is new]
+    _trace = None
+    
+    def _begin(self, sql, parameters, elapsed):
+        self._finish()
+        family = query_family(sql)
+        plan = None
+        if claim_query_plan(family):
+            # The plan of a new family is captured while its parameters are at hand
+            plan = explain_query(self.connection, sql, parameters)
+            scans = full_scans(plan)
+            if scans:
+                logger.info(f"[QueryPlan] Full scan of {', '.join(scans)}: {family}")
+        self._trace = [family, sql, parameters, 0.0, 0, False, plan]
+        # rowcount covers statements that change rows; fetches count the rest
+        self._fetched(elapsed, max(self.rowcount, 0))
+        if self.description is None:
+            self._finish()  # no result set: done once executed
+        else:
+            self.connection.traced_cursors.add(self)
+    
+    def _finish(self):
+        """Count the statement once; its rows ran out, or the cursor or its connection was closed"""
+        trace = self._trace
+        if trace is not None:
+            self._trace = None
+            self.connection.traced_cursors.discard(self)
+            record_query(trace)
+    
+    def _fetched(self, elapsed, rows):
+        trace = self._trace
+        if trace is not None:
+            trace[3] += elapsed
+            trace[4] += rows
+            if not trace[5] and trace[3] >= SLOW_QUERY_MS / 1000:
+                trace[5] = True
+                log_slow_query(self.connection, trace)
+    
+    def close(self):
+        self._finish()
+        super().close()
+    
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        self._begin(sql, parameters, time.perf_counter() - started)
+        return self
+    
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        self._begin(sql, None, time.perf_counter() - started)
+        return self
+    
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._fetched(time.perf_counter() - started, row is not None)
+        if row is None:
+            self._finish()
+        return row
+    
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._fetched(time.perf_counter() - started, len(rows))
+        if len(rows) < size:
+            self._finish()
+        return rows
+    
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        self._fetched(time.perf_counter() - started, len(rows))
+        self._finish()
+        return rows
+    
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._fetched(time.perf_counter() - started, 0)
+            self._finish()
+            raise
+        self._fetched(time.perf_counter() - started, 1)
+        return row
+
+class TracedConnection(sqlite3.Connection):
+    """A connection whose cursors, and execute shortcuts, are traced"""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.traced_cursors = set()  # cursors with rows left to read
+    
+    def finish_traces(self):
+        """Count the statements of cursors that were not read to the end"""
+        for cursor in list(self.traced_cursors):
+            cursor._finish()
+    
+    def close(self):
+        self.finish_traces()
+        super().close()
+    
+    def cursor(self, factory=None):
+        return super().cursor(factory or (TracedCursor if QUERY_TRACE else sqlite3.Cursor))
+    
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+    
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+def query_report(limit: int, sort: str):
+    with _query_stats_lock:
+        families = [(family, dict(stats)) for family, stats in _query_stats.items()]
+    families.sort(key=lambda item: item[1][sort], reverse=True)
+    return [{
+        "query": family,
+        "calls": stats["calls"],
+        "total_ms": round(stats["total"] * 1000, 2),
+        "avg_ms": round(stats["total"] * 1000 / stats["calls"], 3) if stats["calls"] else None,
+        "max_ms": round(stats["max"] * 1000, 2),
+        "rows": stats["rows"],
+        "slow": stats["slow"],
+        "full_scans": stats["full_scans"],
+        "plan": stats["plan"]
+    } for family, stats in families[:limit]]
+
+def reset_query_stats():
+    with _query_stats_lock:
+        _query_stats.clear()
+        _explained_families.clear()
+
+# Database handles
+# connect_db() hands out pooled connections to the current tenant's database (or to
+# db_path): close() returns them to the pool instead of closing, so a request skips
+# opening the file and parsing its schema. At most DB_POOL_SIZE idle handles stay
+# open across all databases; past that the least recently used database gives one
+# up. Handles idle for DB_POOL_IDLE_SECONDS are closed by the reaper thread.
+DB_POOL_SIZE = int(os.environ.get("ADMS_DB_POOL_SIZE", "64"))
+DB_POOL_IDLE_SECONDS = float(os.environ.get("ADMS_DB_POOL_IDLE_SECONDS", "300"))
+
+_db_pool = OrderedDict()  # db path -> [(released at, connection)], least recently used path first
+_db_pool_stats = {"idle": 0, "opened": 0, "reused": 0, "closed": 0}
+_db_pool_lock = threading.Lock()
+
+class PooledConnection(TracedConnection):
+    """A connection whose close() hands it back to the pool"""
+    
+    def close(self):
+        self.finish_traces()
+        release_connection(self)
+
+def connect_db(db_path: Optional[str] = None):
+    db_path = db_path or tenant_path('adms.db')
+    with _db_pool_lock:
+        idle = _db_pool.get(db_path)
+        if idle:
+            _, conn = idle.pop()
+            if not idle:
+                del _db_pool[db_path]
+            _db_pool_stats["idle"] -= 1
+            _db_pool_stats["reused"] += 1
+            conn.pool_idle = False
+            return conn
+        _db_pool_stats["opened"] += 1
+    
+    # Checked out by one thread at a time, but not always the thread that opened it
+    conn = sqlite3.connect(db_path, factory=PooledConnection, check_same_thread=False)
+    conn.pool_path = db_path
+    conn.pool_idle = False
+    return conn
+
+def _close_handles(handles):
+    for conn in handles:
+        sqlite3.Connection.close(conn)
+    if handles:
+        with _db_pool_lock:
+            _db_pool_stats["closed"] += len(handles)
+
+def release_connection(conn):
+    if conn.pool_idle:
+        return  # closed twice
+    if conn.in_transaction:
+        conn.rollback()  # what closing would have done with uncommitted work
+    conn.pool_idle = True
+    
+    evicted = []
+    with _db_pool_lock:
+        _db_pool.setdefault(conn.pool_path, []).append((time.monotonic(), conn))
+        _db_pool.move_to_end(conn.pool_path)
+        _db_pool_stats["idle"] += 1
+        while _db_pool_stats["idle"] > DB_POOL_SIZE:
+            path, idle = next(iter(_db_pool.items()))
+            evicted.append(idle.pop(0)[1])
+            if not idle:
+                del _db_pool[path]
+            _db_pool_stats["idle"] -= 1
+    _close_handles(evicted)
+
+def close_idle_connections(max_idle: float):
+    """Close handles idle for longer than max_idle seconds"""
+    cutoff = time.monotonic() - max_idle
+    expired = []
+    with _db_pool_lock:
+        for path in list(_db_pool):
+            idle = _db_pool[path]
+            while idle and idle[0][0] <= cutoff:
+                expired.append(idle.pop(0)[1])
+            if not idle:
+                del _db_pool[path]
+        _db_pool_stats["idle"] -= len(expired)
+    _close_handles(expired)
+    return len(expired)
+
+def db_pool_stats():
+    with _db_pool_lock:
+        return dict(_db_pool_stats, databases=len(_db_pool))
+
+def db_pool_reaper():
+    while True:
+        time.sleep(max(1.0, DB_POOL_IDLE_SECONDS / 4))
+        try:
+            close_idle_connections(DB_POOL_IDLE_SECONDS)
+        except Exception as e:
+            logger.error(f"[DBPool] Closing idle handles failed: {e}", exc_info=True)
+
+@app.on_event("startup")
+async def start_db_pool_reaper():
+    threading.Thread(target=db_pool_reaper, name="db-pool-reaper", daemon=True).start()
 
 # Pydantic models
 class Device(BaseModel):
@@ -178,6 +1067,13 @@ class CommandResponse(BaseModel):
     command: str
     status: str
 
+class WebhookRequest(BaseModel):
+    name: str
+    url: str
+
+class TenantRequest(BaseModel):
+    name: str
+
 # Helper functions
 def get_kabul_time():
     """Get current time in Kabul timezone (UTC+4:30)"""
@@ -186,18 +1082,131 @@ def get_kabul_time():
     kabul_time = datetime.datetime.now()
     return kabul_time
 
+# Command types stored in device_commands.command_type
+COMMAND_TYPE_RAW = "raw"
+COMMAND_TYPE_SYNCTIME = "synctime"
+SYNCTIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 def format_synctime_command(kabul_time):
     """Format time sync command with Kabul time in ZKTeco format"""
     # ZKTeco ADMS protocol uses specific command format
     # The correct format for setting time is just the timestamp without command prefix
     # Device will interpret this as time sync when sent properly
     # Format: YYYY-MM-DD HH:MM:SS
-    time_str = kabul_time.strftime("%Y-%m-%d %H:%M:%S")
+    time_str = kabul_time.strftime(SYNCTIME_FORMAT)
     # Return the raw timestamp - the protocol handler will format it correctly
     return time_str
 
+def parse_synctime_command(command: str) -> int:
+    """Convert a stored time sync command (YYYY-MM-DD HH:MM:SS) to a unix timestamp"""
+    return int(datetime.datetime.strptime(command.strip(), SYNCTIME_FORMAT).timestamp())
+
+# Pending time syncs per device: (tenant, sn) -> (command_id, unix timestamp, monotonic time queued).
+# device_cmd answers with this Stamp for TIME_SYNC_STAMP_WINDOW seconds after the
+# SYNCTIME was queued, without having to look the command up in the database.
+TIME_SYNC_STAMP_WINDOW = 60  # seconds
+
+_pending_time_syncs = {}
+_pending_time_syncs_lock = threading.Lock()
+
+def record_time_sync(sn: str, command_id: int, unix_timestamp: int):
+    with _pending_time_syncs_lock:
+        _pending_time_syncs[current_tenant(), sn] = (command_id, unix_timestamp, time.monotonic())
+
+def get_pending_time_sync(sn: str) -> Optional[int]:
+    """Return the Stamp of a time sync queued for this device within the window, if any"""
+    with _pending_time_syncs_lock:
+        key = (current_tenant(), sn)
+        pending = _pending_time_syncs.get(key)
+        if pending is None:
+            return None
+        if time.monotonic() - pending[2] > TIME_SYNC_STAMP_WINDOW:
+            del _pending_time_syncs[key]
+            return None
+        return pending[1]
+
+# Resource versions for conditional GET on the /api read endpoints.
+# Every write bumps the counters of the resources it changes; the ETag of a read is
+# built from those counters, so a client that is current gets a 304 without any
+# database work. The boot id keeps ETags from one process run matching another's.
+# The counters (like the delta generations below) only see this process's writes, so
+# a second worker serving the same directory would answer 304 for data it never saw;
+# the process lock (lock_data_directory) keeps it from starting.
+API_GZIP_MIN_SIZE = int(os.environ.get("ADMS_API_GZIP_MIN_SIZE", "1024"))  # bytes
+DEVICE_STATUS_ETAG_SECONDS = 15  # online/offline follows last_seen age, not writes
+
+# Read endpoint -> resources its response is built from
+CONDITIONAL_GET_RESOURCES = {
+    "/api/devices": ("devices",),
+    "/api/commands": ("commands",),
+    "/api/attendance": ("attendance", "users"),
+    "/api/attendance/daily": ("attendance", "users"),
+    "/api/users": ("users",),
+}
+
+_resource_versions = {"devices": 0, "commands": 0, "attendance": 0, "users": 0}
+_resource_versions_lock = threading.Lock()
+_resource_boot_id = uuid.uuid4().hex[:8]
+
+def bump_resource_versions(*resources: str):
+    with _resource_versions_lock:
+        for resource in resources:
+            _resource_versions[resource] += 1
+
+def resource_etag(resources, query: str = "") -> str:
+    """Weak ETag for a read of the given resources (weak: the body may be gzip-encoded)"""
+    with _resource_versions_lock:
+        versions = [str(_resource_versions[resource]) for resource in resources]
+    if "devices" in resources:
+        # Devices turn offline 5 minutes after their last poll without any write
+        versions.append(str(int(time.time() // DEVICE_STATUS_ETAG_SECONDS)))
+    if query:
+        versions.append(hashlib.sha1(query.encode()).hexdigest()[:8])
+    if current_tenant():
+        versions.insert(0, current_tenant())
+    return f'W/"{_resource_boot_id}-{"-".join(versions)}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # Weak comparison: W/"x" and "x" name the same representation
+    candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag.removeprefix("W/") in candidates
+
+# Dashboard deltas
+# /api/devices, /api/commands and /api/attendance take ?since=<cursor> and then return
+# only the rows added or changed after the cursor, with the cursor for the next call:
+# devices by last_seen (plus those that went offline in between), commands by
+# change_seq, attendance by id. Deletes cannot be seen that way; they bump the
+# resource's generation, and a cursor from an older generation or another process
+# run (or since= empty) gets the full listing with "full": true.
+DEVICE_OFFLINE_MINUTES = 5  # a device is offline this long after its last poll
+DELTA_OVERLAP_SECONDS = 2  # last_seen is stamped before its commit; re-read that much
+
+_delta_generations = {}  # (tenant, resource) -> deletes so far
+_delta_generations_lock = threading.Lock()
+
+def bump_delta_generations(*resources: str):
+    tenant = current_tenant()
+    with _delta_generations_lock:
+        for resource in resources:
+            _delta_generations[(tenant, resource)] = _delta_generations.get((tenant, resource), 0) + 1
+
+def parse_delta_cursor(resource: str, since: str):
+    """(generation, position) for a read; position is None when since cannot be continued"""
+    with _delta_generations_lock:
+        generation = _delta_generations.get((current_tenant(), resource), 0)
+    boot_id, _, rest = since.partition(".")
+    seen_generation, _, position = rest.partition(".")
+    if boot_id != _resource_boot_id or seen_generation != str(generation) or not position:
+        return generation, None
+    return generation, position
+
+def delta_cursor(generation: int, position) -> str:
+    return f"{_resource_boot_id}.{generation}.{position}"
+
 def register_or_update_device(sn: str, ip: str, model: Optional[str] = None, firmware: Optional[str] = None):
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Check if device exists
@@ -232,13 +1241,14 @@ def register_or_update_device(sn: str, ip: str, model: Optional[str] = None, fir
     
     conn.commit()
     conn.close()
+    bump_resource_versions("devices")
 
 def get_pending_commands(sn: str):
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     cursor.execute('''
-        SELECT id, command FROM device_commands 
+        SELECT id, command, command_type FROM device_commands 
         WHERE device_sn = ? AND status = 'queued'
         ORDER BY created_at ASC
     ''', (sn,))
@@ -248,9 +1258,25 @@ def get_pending_commands(sn: str):
     
     return commands
 
+def format_device_commands(commands):
+    """Render queued (id, command, ...) rows as one response body; returns (text, command ids)"""
+    lines = []
+    command_ids = []
+    for command_id, command, *_ in commands:
+        # Convert to uppercase and format according to ZKTeco standards with proper line endings
+        # Remove any existing C: prefix and whitespace
+        clean_command = command.upper().strip()
+        if clean_command.startswith("C:"):
+            clean_command = clean_command[2:].strip()
+        
+        # Format as C:{id}:{command} per ZKTeco ADMS protocol
+        lines.append(f"C:{command_id}:{clean_command}\r\n")
+        command_ids.append(command_id)
+    return "".join(lines), command_ids
+
 def get_device_info(sn: str):
     """Get device information including IP address and status"""
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -266,7 +1292,7 @@ def get_device_info(sn: str):
     return None
 
 def update_command_status(command_id: int, status: str, response: Optional[str] = None):
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Convert datetime to string to avoid deprecation warning
@@ -287,44 +1313,2544 @@ def update_command_status(command_id: int, status: str, response: Optional[str]
     
     conn.commit()
     conn.close()
+    bump_resource_versions("commands")
 
 def clear_commands_from_queue(sn: str, command_ids: List[int]):
     """Clear specific commands from the queue for a device"""
     if not command_ids:
         return
     
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Update status of commands to 'sent'
+    sent_at = time.time()
+    sent_at_str = datetime.datetime.fromtimestamp(sent_at).isoformat()
     placeholders = ','.join('?' * len(command_ids))
     cursor.execute(f'''
         UPDATE device_commands 
-        SET status = 'sent'
+        SET status = 'sent', sent_at = ?
         WHERE id IN ({placeholders})
-    ''', command_ids)
+    ''', [sent_at_str, *command_ids])
     
-    conn.commit()
+    # Devices never acknowledge a time sync: the time travels in the Stamp header of
+    # this very response, so SYNCTIME is complete once sent and gets no ack deadline
+    cursor.execute(f'''
+        UPDATE device_commands 
+        SET status = 'completed', executed_at = ?, response = 'Time sent in Stamp header'
+        WHERE id IN ({placeholders}) AND command_type = ?
+    ''', [sent_at_str, *command_ids, COMMAND_TYPE_SYNCTIME])
+    
+    cursor.execute(f"SELECT id, command, retry_count FROM device_commands WHERE id IN ({placeholders}) AND status = 'sent'", command_ids)
+    sent_commands = cursor.fetchall()
+    
+    conn.commit()
+    conn.close()
+    bump_resource_versions("commands")
+    
+    track_inflight_commands(sn, [(command_id, command) for command_id, command, _ in sent_commands])
+    for command_id, _, retry_count in sent_commands:
+        schedule_ack_deadline(sn, command_id, retry_count, sent_at)
+    
+    logger.info(f"Cleared {len(command_ids)} commands from queue for device {sn}")
+
+# In-flight (sent, not yet acknowledged) commands per device, keyed by normalized
+# command text and by its verb, for acknowledgements that carry CMD= but no ID=.
+# (tenant, sn) -> {key: [command ids, oldest first]}
+_inflight_commands = {}
+_inflight_lock = threading.Lock()
+
+def normalize_command(command: str) -> str:
+    normalized = command.strip().upper()
+    if normalized.startswith("C:"):
+        normalized = normalized[2:].strip()
+    return normalized
+
+def _inflight_keys(command: str):
+    normalized = normalize_command(command)
+    verb = normalized.split(" ", 1)[0]
+    return {normalized, verb} if verb else {normalized}
+
+def track_inflight_commands(sn: str, commands):
+    """Index commands that were just sent to a device; commands is a list of (id, command)"""
+    with _inflight_lock:
+        device_index = _inflight_commands.setdefault((current_tenant(), sn), {})
+        for command_id, command in commands:
+            for key in _inflight_keys(command):
+                device_index.setdefault(key, []).append(command_id)
+
+def untrack_inflight_command(sn: str, command_id: int, command: Optional[str] = None):
+    with _inflight_lock:
+        device = (current_tenant(), sn)
+        device_index = _inflight_commands.get(device)
+        if not device_index:
+            return
+        keys = _inflight_keys(command) if command is not None else list(device_index)
+        for key in keys:
+            command_ids = device_index.get(key)
+            if command_ids and command_id in command_ids:
+                command_ids.remove(command_id)
+                if not command_ids:
+                    del device_index[key]
+        if not device_index:
+            del _inflight_commands[device]
+
+def match_inflight_command(sn: str, cmd: str) -> Optional[int]:
+    """Most recently sent in-flight command matching the acknowledged CMD, by full text then by verb"""
+    normalized = normalize_command(cmd)
+    with _inflight_lock:
+        device_index = _inflight_commands.get((current_tenant(), sn), {})
+        for key in (normalized, normalized.split(" ", 1)[0]):
+            command_ids = device_index.get(key)
+            if command_ids:
+                return command_ids[-1]
+    return None
+
+def load_inflight_commands():
+    """Rebuild the in-flight index and ack deadlines from commands left in 'sent' by a previous run"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    # Time syncs sent before SYNCTIME was completed on send
+    cursor.execute('''
+        UPDATE device_commands 
+        SET status = 'completed', executed_at = sent_at, response = 'Time sent in Stamp header'
+        WHERE status = 'sent' AND command_type = ?
+    ''', (COMMAND_TYPE_SYNCTIME,))
+    conn.commit()
+    cursor.execute('''
+        SELECT device_sn, id, command, retry_count, sent_at 
+        FROM device_commands 
+        WHERE status = 'sent' 
+        ORDER BY id
+    ''')
+    rows = cursor.fetchall()
+    conn.close()
+    
+    now = time.time()
+    by_device = {}
+    for sn, command_id, command, retry_count, sent_at in rows:
+        by_device.setdefault(sn, []).append((command_id, command))
+        try:
+            sent_time = datetime.datetime.fromisoformat(sent_at).timestamp() if sent_at else now
+        except ValueError:
+            sent_time = now
+        schedule_ack_deadline(sn, command_id, retry_count, sent_time)
+    for sn, commands in by_device.items():
+        track_inflight_commands(sn, commands)
+    
+    logger.info(f"[DeviceCMD] Loaded {len(rows)} in-flight commands for {len(by_device)} devices")
+
+def is_command_inflight(sn: str, command_id: int) -> bool:
+    with _inflight_lock:
+        return any(command_id in command_ids for command_ids in _inflight_commands.get((current_tenant(), sn), {}).values())
+
+# Ack timeouts
+# Every sent command gets a deadline in a min-heap. When a deadline passes without an
+# acknowledgement the command goes back to 'queued' with an exponentially longer
+# deadline for the next attempt, and after COMMAND_MAX_RETRIES it is marked 'timeout'.
+# Only expired commands touch the database; nothing polls device_commands.
+COMMAND_ACK_TIMEOUT = float(os.environ.get("ADMS_COMMAND_ACK_TIMEOUT", "120"))  # seconds, first attempt
+COMMAND_MAX_RETRIES = int(os.environ.get("ADMS_COMMAND_MAX_RETRIES", "3"))
+
+_ack_deadlines = []  # heap of (deadline, command_id, sn, retry_count, tenant)
+_ack_deadlines_cond = threading.Condition()
+
+def ack_timeout_for(retry_count: int) -> float:
+    return COMMAND_ACK_TIMEOUT * (2 ** retry_count)
+
+def schedule_ack_deadline(sn: str, command_id: int, retry_count: int, sent_at: float):
+    deadline = sent_at + ack_timeout_for(retry_count)
+    with _ack_deadlines_cond:
+        heapq.heappush(_ack_deadlines, (deadline, command_id, sn, retry_count, current_tenant()))
+        # Wake the scheduler if this is now the earliest deadline
+        if _ack_deadlines[0][1] == command_id:
+            _ack_deadlines_cond.notify()
+
+def expire_unacknowledged_commands(expired) -> None:
+    """Re-queue or time out commands whose ack deadline passed; expired is a list of heap entries of the current tenant"""
+    now_str = datetime.datetime.now().isoformat()
+    requeued = set()
+    conn = connect_db()
+    cursor = conn.cursor()
+    
+    try:
+        for _, command_id, sn, retry_count, _ in expired:
+            # retry_count in the WHERE clause skips entries made stale by a later re-send
+            if retry_count < COMMAND_MAX_RETRIES:
+                cursor.execute('''
+                    UPDATE device_commands 
+                    SET status = 'queued', retry_count = retry_count + 1
+                    WHERE id = ? AND status = 'sent' AND retry_count = ?
+                ''', (command_id, retry_count))
+                if cursor.rowcount:
+                    requeued.add(sn)
+                    logger.warning(f"[AckTimeout] Command ID {command_id} on device {sn} was not acknowledged; re-queued (retry {retry_count + 1}/{COMMAND_MAX_RETRIES})")
+            else:
+                cursor.execute('''
+                    UPDATE device_commands 
+                    SET status = 'timeout', executed_at = ?, response = 'No acknowledgement from device'
+                    WHERE id = ? AND status = 'sent' AND retry_count = ?
+                ''', (now_str, command_id, retry_count))
+                if cursor.rowcount:
+                    logger.warning(f"[AckTimeout] Command ID {command_id} on device {sn} timed out after {COMMAND_MAX_RETRIES} retries")
+            
+            if cursor.rowcount:
+                untrack_inflight_command(sn, command_id)
+        conn.commit()
+    finally:
+        conn.close()
+    bump_resource_versions("commands")
+    for sn in requeued:
+        notify_commands_queued(sn)
+
+def ack_timeout_worker():
+    while True:
+        with _ack_deadlines_cond:
+            while not _ack_deadlines or _ack_deadlines[0][0] > time.time():
+                timeout = _ack_deadlines[0][0] - time.time() if _ack_deadlines else None
+                _ack_deadlines_cond.wait(timeout)
+            
+            now = time.time()
+            expired = {}  # tenant -> heap entries
+            while _ack_deadlines and _ack_deadlines[0][0] <= now:
+                entry = heapq.heappop(_ack_deadlines)
+                # Acknowledged commands are dropped lazily here
+                with use_tenant(entry[4]):
+                    if is_command_inflight(entry[2], entry[1]):
+                        expired.setdefault(entry[4], []).append(entry)
+        
+        for tenant, entries in expired.items():
+            try:
+                with use_tenant(tenant):
+                    expire_unacknowledged_commands(entries)
+            except Exception as e:
+                logger.error(f"[AckTimeout] Error expiring commands: {e}", exc_info=True)
+
+def command_ack_succeeded(response: Optional[str]) -> bool:
+    """Return=0 / Response=OK (or a record count) means success, negative values are error codes"""
+    try:
+        return response is not None and (response.strip().upper() == "OK" or int(response) >= 0)
+    except ValueError:
+        return False
+
+def parse_command_acks(body: str):
+    """Parse 'ID=..&Return=..&CMD=..' acknowledgement lines from a devicecmd POST body"""
+    acks = []
+    for line in body.splitlines():
+        line = line.strip()
+        if not line.startswith("ID="):
+            # Payload lines (e.g. INFO key=value pairs) follow their ack line
+            continue
+        fields = dict(urllib.parse.parse_qsl(line, keep_blank_values=True))
+        response = fields.get("Return", fields.get("Response"))
+        acks.append({
+            "id": fields.get("ID"),
+            "cmd": fields.get("CMD"),
+            "response": response,
+            "success": command_ack_succeeded(response)
+        })
+    return acks
+
+def apply_command_acks(sn: str, acks) -> int:
+    """Apply a batch of command acknowledgements from one device in a single transaction"""
+    now_str = datetime.datetime.now().isoformat()
+    updates = []
+    
+    for ack in acks:
+        command_id = None
+        if ack["id"]:
+            try:
+                command_id = int(ack["id"])
+            except ValueError:
+                logger.error(f"[DeviceCMD] Invalid command ID format: {ack['id']}")
+                continue
+        elif ack["cmd"]:
+            # Fallback: match by command text if ID is not provided
+            command_id = match_inflight_command(sn, ack["cmd"])
+            if command_id is None:
+                logger.warning(f"[DeviceCMD] No matching in-flight command found for device {sn} with command {ack['cmd']}")
+                continue
+        else:
+            continue
+        
+        status = "completed" if ack["success"] else "failed"
+        response = ack["response"] or (None if ack["success"] else "No response")
+        updates.append((command_id, status, response, ack["cmd"]))
+    
+    if not updates:
+        return 0
+    
+    conn = connect_db()
+    cursor = conn.cursor()
+    applied = 0
+    
+    try:
+        for command_id, status, response, cmd in updates:
+            # The device_sn condition doubles as the ownership check; only a command still
+            # waiting for its ack is settled, so a late or repeated ack cannot overwrite a
+            # re-queued, timed-out or already completed one
+            cursor.execute('''
+                UPDATE device_commands 
+                SET status = ?, executed_at = ?, response = COALESCE(?, response)
+                WHERE id = ? AND device_sn = ? AND status = 'sent'
+            ''', (status, now_str, response, command_id, sn))
+            
+            if cursor.rowcount:
+                applied += 1
+                untrack_inflight_command(sn, command_id)
+                if status == "completed":
+                    logger.info(f"[DeviceCMD] Command ID {command_id} ({cmd}) completed successfully on device {sn}")
+                else:
+                    logger.warning(f"[DeviceCMD] Command ID {command_id} ({cmd}) failed on device {sn} with response: {response}")
+            else:
+                logger.warning(f"[DeviceCMD] Command ID {command_id} not found for device {sn} or not awaiting an acknowledgement")
+        conn.commit()
+    finally:
+        conn.close()
+    if applied:
+        bump_resource_versions("commands")
+    
+    return applied
+
+# Attendance shards
+# With ADMS_ATTENDANCE_SHARDS=N (N > 1) attendance_logs and daily_attendance live in N
+# shard databases under ATTENDANCE_SHARD_DIR instead of adms.db. A device's records
+# always go to the shard picked by a stable hash of its serial number; devices,
+# commands, users and webhooks stay in adms.db. Every shard has its own write lock, so
+# receive_data writes uploads from devices on different shards in parallel (in the
+# threadpool), and the attendance endpoints scatter-gather across the shards.
+# Record ids stay unique across shards: every insert reserves its ids from the
+# attendance_logs row of id_sequences in adms.db, and a plain INSERT raises if an id
+# is taken anyway. Webhook publication in id order still relies on one server
+# process owning the shard set, which the process lock enforces.
+ATTENDANCE_SHARDS = int(os.environ.get("ADMS_ATTENDANCE_SHARDS", "0"))  # 0 or 1: attendance in adms.db
+ATTENDANCE_SHARD_DIR = os.environ.get("ADMS_SHARD_DIR", "shards")
+
+# published_through: every id up to here is committed (or abandoned) and published;
+# completed: heap of (first id, count, rows) finished out of order
+_attendance_ids = {"published_through": 0, "completed": []}
+_attendance_ids_lock = threading.Lock()
+
+def attendance_sharded() -> bool:
+    return ATTENDANCE_SHARDS > 1 and not MULTI_TENANT  # tenants already split the write load
+
+def attendance_db_paths():
+    """Every database holding attendance; only adms.db unless sharded"""
+    if not attendance_sharded():
+        return [tenant_path('adms.db')]
+    return [os.path.join(ATTENDANCE_SHARD_DIR, f"attendance_{shard:02d}.db") for shard in range(ATTENDANCE_SHARDS)]
+
+def database_paths():
+    """adms.db followed by the attendance shards, if any"""
+    return [tenant_path('adms.db')] + (attendance_db_paths() if attendance_sharded() else [])
+
+def attendance_db_path(sn: str) -> str:
+    """The database holding one device's attendance"""
+    paths = attendance_db_paths()
+    if len(paths) == 1:
+        return paths[0]
+    # Python's hash() is salted per process; the shard of a device must never move
+    digest = hashlib.sha1(sn.encode()).digest()
+    return paths[int.from_bytes(digest[:4], "big") % len(paths)]
+
+def migrate_attendance_shards():
+    """Bring every shard to the current schema (shards carry the full schema; only the attendance tables are used)"""
+    if not attendance_sharded():
+        return
+    os.makedirs(ATTENDANCE_SHARD_DIR, exist_ok=True)
+    for db_path in attendance_db_paths():
+        run_migrations(db_path)
+    move_unsharded_attendance()
+    seed_attendance_ids()
+
+def move_unsharded_attendance():
+    """Move attendance recorded in adms.db before sharding was enabled into the shards.
+    
+    Rows keep their ids and go over in id-ordered chunks, each committed to the shards
+    before it is deleted from adms.db; a move interrupted between the two finds its
+    rows already in the shard on the next start and skips them.
+    """
+    conn = connect_db()
+    try:
+        total = conn.execute('SELECT COUNT(*) FROM attendance_logs').fetchone()[0]
+        if not total:
+            return
+        logger.info(f"[Shards] Moving {total} attendance records from adms.db into {ATTENDANCE_SHARDS} shards")
+        column_list = ", ".join(ATTENDANCE_LOG_COLUMNS)
+        placeholders = ", ".join("?" * len(ATTENDANCE_LOG_COLUMNS))
+        moved = 0
+        while True:
+            rows = conn.execute(f'SELECT {column_list} FROM attendance_logs ORDER BY id LIMIT ?',
+                                (MIGRATION_CHUNK_SIZE,)).fetchall()
+            if not rows:
+                break
+            by_shard = {}
+            for row in rows:
+                by_shard.setdefault(attendance_db_path(row[1]), []).append(row)
+            for db_path, shard_rows in by_shard.items():
+                shard = connect_db(db_path)
+                try:
+                    shard.executemany(f'''
+                        INSERT INTO attendance_logs ({column_list}) VALUES ({placeholders})
+                        ON CONFLICT(device_sn, user_id, timestamp) DO NOTHING
+                    ''', shard_rows)
+                    shard.commit()
+                    # Recomputed rather than folded in, so a resumed move cannot count a punch twice
+                    recompute_daily_attendance(shard, {(row[2], row[3][:10]) for row in shard_rows})
+                finally:
+                    shard.close()
+            conn.execute('DELETE FROM attendance_logs WHERE id <= ?', (rows[-1][0],))
+            conn.commit()
+            moved += len(rows)
+            logger.info(f"[Shards] Moved {moved}/{total} attendance records")
+        # The summaries now live in the shards, next to their rows
+        conn.execute('DELETE FROM daily_attendance')
+        conn.commit()
+    finally:
+        conn.close()
+
+def latest_attendance_id(include_deleted: bool = False) -> int:
+    """Highest attendance id across adms.db and the shards"""
+    latest = 0
+    for db_path in database_paths():
+        conn = connect_db(db_path)
+        latest = max(latest, conn.execute('SELECT COALESCE(MAX(id), 0) FROM attendance_logs').fetchone()[0])
+        if include_deleted:
+            # AUTOINCREMENT never reuses the ids of deleted rows
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'attendance_logs'").fetchone()
+            latest = max(latest, sequence[0] if sequence else 0)
+        conn.close()
+    return latest
+
+def seed_attendance_ids():
+    """Move the id sequence past every attendance id in use and publish from there on"""
+    latest = latest_attendance_id(include_deleted=True)
+    conn = connect_db()
+    try:
+        conn.execute('''
+            INSERT INTO id_sequences (name, next_id) VALUES ('attendance_logs', ?)
+            ON CONFLICT(name) DO UPDATE SET next_id = MAX(next_id, excluded.next_id)
+        ''', (latest + 1,))
+        next_id = conn.execute("SELECT next_id FROM id_sequences WHERE name = 'attendance_logs'").fetchone()[0]
+        conn.commit()
+    finally:
+        conn.close()
+    with _attendance_ids_lock:
+        _attendance_ids.update(published_through=next_id - 1, completed=[])
+
+def allocate_attendance_ids(count: int) -> int:
+    """Reserve count consecutive ids for a sharded insert and return the first one.
+    
+    Each reservation is a short write transaction on the sequence row in adms.db, so
+    ids handed to different threads or processes never overlap. The ids of an insert
+    that fails stay unused.
+    """
+    conn = connect_db()
+    try:
+        reserved = conn.execute('''
+            UPDATE id_sequences SET next_id = next_id + ? WHERE name = 'attendance_logs'
+            RETURNING next_id - ?
+        ''', (count, count)).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
+    if reserved is None:  # shards enabled without migrate_attendance_shards()
+        seed_attendance_ids()
+        return allocate_attendance_ids(count)
+    return reserved[0]
+
+def complete_attendance_ids(first_id: int, count: int, rows):
+    """Publish committed rows in id order once every earlier reservation has finished.
+    
+    Shard writers commit out of order; rows are held back until all lower ids are
+    committed or abandoned, so webhook subscribers still see ascending ids.
+    """
+    with _attendance_ids_lock:
+        heapq.heappush(_attendance_ids["completed"], (first_id, count, rows))
+        ready = []
+        completed = _attendance_ids["completed"]
+        while completed and completed[0][0] == _attendance_ids["published_through"] + 1:
+            _, done_count, done_rows = heapq.heappop(completed)
+            _attendance_ids["published_through"] += done_count
+            ready.extend(done_rows)
+        # Published under the lock so two writers cannot hand their rows over out of order
+        publish_attendance(ready)
+
+def commit_unsharded_attendance(conn, rows):
+    """Commit an insert into adms.db and publish its rows before any later insert can.
+    
+    Without shards SQLite assigns ids in commit order (one writer at a time); holding
+    the lock from the commit to the hand-over keeps publication in that order, so a
+    later commit cannot move a subscriber past ids that are about to be published.
+    """
+    with _attendance_ids_lock:
+        conn.commit()
+        publish_attendance(rows)
+
+def attendance_watermark(conn) -> int:
+    """Id up to which attendance has been published; later rows reach subscribers added now"""
+    if attendance_sharded():
+        return _attendance_ids["published_through"]
+    return conn.execute('SELECT COALESCE(MAX(id), 0) FROM attendance_logs').fetchone()[0]
+
+def parse_attendance_line(line: str):
+    """Parse one stripped ATTLOG line into (user_id, timestamp, verify_mode, status)
+    
+    Batch lines are "TRANS\tUSER_ID\tTIMESTAMP\tVERIFY_MODE\tSTATUS"; realtime lines are
+    whitespace separated, with the timestamp possibly split into date and time. Returns
+    None for lines with too few fields and raises ValueError for malformed ones.
+    """
+    # Check if line starts with TRANS (batch mode with TRANS prefix)
+    if line.startswith("TRANS"):
+        parts = line.split("\t")
+        if len(parts) >= 5:
+            return (parts[1], parts[2], int(parts[3]), int(parts[4]))
+    
+    # Raw realtime data, split by any whitespace
+    parts = line.split()
+    # Need at least USER_ID, TIMESTAMP, VERIFY_MODE, STATUS (4 fields minimum)
+    if len(parts) < 4:
+        return None
+    if len(parts) >= 5 and ':' in parts[2]:
+        # Format: USER_ID DATE TIME VERIFY_MODE STATUS ...
+        return (parts[0], f"{parts[1]} {parts[2]}", int(parts[3]), int(parts[4]))
+    # Format: USER_ID TIMESTAMP VERIFY_MODE STATUS ...
+    return (parts[0], parts[1], int(parts[2]), int(parts[3]))
+
+def store_attendance_records(sn: str, records):
+    """Insert parsed (user_id, timestamp, verify_mode, status) punches into the device's attendance database.
+    
+    Returns the newly inserted rows; duplicates are skipped. The rows are published to
+    the webhook forwarder once committed.
+    """
+    if not records:
+        return []
+    sharded = attendance_sharded()
+    first_id = allocate_attendance_ids(len(records)) if sharded else None
+    new_rows = []
+    committed = []
+    conn = connect_db(attendance_db_path(sn))
+    try:
+        cursor = conn.cursor()
+        for offset, (user_id, timestamp, verify_mode, status) in enumerate(records):
+            # Insert attendance log (skip duplicates based on unique constraint; an id
+            # collision raises); a NULL id is assigned by SQLite
+            cursor.execute('''
+                INSERT INTO attendance_logs (id, device_sn, user_id, timestamp, verify_mode, status)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(device_sn, user_id, timestamp) DO NOTHING
+            ''',(first_id + offset if sharded else None, sn, user_id, timestamp, verify_mode, status))
+            
+            if cursor.rowcount > 0:
+                new_rows.append({"id": cursor.lastrowid, "device_sn": sn, "user_id": user_id,
+                                 "timestamp": timestamp, "verify_mode": verify_mode, "status": status})
+                record_daily_punch(cursor, user_id, timestamp)
+                logger.info(f"[CData-ATTENDANCE] Recorded attendance: User {user_id} at {timestamp} from device {sn}")
+            else:
+                logger.debug(f"[CData-ATTENDANCE] Skipped duplicate: User {user_id} at {timestamp} from device {sn}")
+        
+        if new_rows:
+            if sharded:
+                conn.commit()
+            else:
+                commit_unsharded_attendance(conn, new_rows)
+            committed = new_rows
+    finally:
+        conn.close()
+        if sharded:
+            complete_attendance_ids(first_id, len(records), committed)
+    
+    if committed:
+        bump_resource_versions("attendance")
+        invalidate_user_timelines({row["user_id"] for row in committed})
+    return committed
+
+# Attendance retention
+# Months older than the retention window are moved out of attendance_logs into
+# one gzip-compressed, read-only file per month under ATTENDANCE_ARCHIVE_DIR.
+ATTENDANCE_RETENTION_MONTHS = int(os.environ.get("ADMS_RETENTION_MONTHS", "12"))
+ATTENDANCE_ARCHIVE_DIR = os.environ.get("ADMS_ARCHIVE_DIR", "archive")
+ATTENDANCE_ARCHIVE_INTERVAL = int(os.environ.get("ADMS_ARCHIVE_INTERVAL", "86400"))  # seconds
+
+ARCHIVE_COLUMNS = ATTENDANCE_LOG_COLUMNS
+MONTH_TIMESTAMP_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-*"
+
+_archive_lock = threading.Lock()
+
+def month_start(year: int, month: int) -> str:
+    """Return the first instant of a month as a timestamp string comparable with attendance_logs.timestamp"""
+    return f"{year:04d}-{month:02d}-01 00:00:00"
+
+def next_month(year: int, month: int):
+    return (year + 1, 1) if month == 12 else (year, month + 1)
+
+def retention_cutoff(retention_months: int) -> str:
+    """First timestamp that is still kept in the hot attendance_logs table"""
+    now = datetime.datetime.now()
+    year, month = now.year, now.month - retention_months
+    while month < 1:
+        year -= 1
+        month += 12
+    return month_start(year, month)
+
+def _archive_row_sort_key(row):
+    # Same ordering as /api/attendance: timestamp DESC, created_at DESC
+    return (row["timestamp"] or "", row["created_at"] or "")
+
+def _coerce_archive_row(row):
+    """Restore the column types lost by the TSV encoding"""
+    for column in ("id", "verify_mode", "status"):
+        value = row.get(column)
+        row[column] = int(value) if value not in (None, "") else None
+    if row.get("created_at") == "":
+        row["created_at"] = None
+    return row
+
+def read_archive_rows(file_path: str):
+    """Stream rows from an archive partition, newest first"""
+    with gzip.open(file_path, "rt", encoding="utf-8", newline="") as archive_file:
+        reader = csv.DictReader(archive_file, delimiter="\t")
+        for row in reader:
+            yield _coerce_archive_row(row)
+
+def write_archive_file(file_path: str, rows) -> int:
+    """Atomically (re)write a compressed, read-only archive partition; returns the number of rows written"""
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_path = file_path + ".tmp"
+    written = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8", newline="") as archive_file:
+        writer = csv.DictWriter(archive_file, fieldnames=ARCHIVE_COLUMNS, delimiter="\t")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            written += 1
+
+    # os.replace refuses to overwrite a read-only file on Windows
+    if os.path.exists(file_path):
+        os.chmod(file_path, 0o644)
+    os.replace(tmp_path, file_path)
+    os.chmod(file_path, 0o444)
+    return written
+
+def attendance_archive_dir(db_path: str) -> str:
+    """Archive directory of an attendance database; each shard archives into its own subdirectory"""
+    if not attendance_sharded():
+        return tenant_path(ATTENDANCE_ARCHIVE_DIR)
+    return os.path.join(ATTENDANCE_ARCHIVE_DIR, os.path.splitext(os.path.basename(db_path))[0])
+
+def merge_archive_rows(hot_rows, archived_rows):
+    """Merge two newest-first row streams; a hot row replaces an archived row with the same record key.
+
+    Duplicates share a timestamp, so only one timestamp's rows are held at a time.
+    """
+    merged = heapq.merge(((0, row) for row in hot_rows), ((1, row) for row in archived_rows),
+                         key=lambda item: _archive_row_sort_key(item[1]), reverse=True)
+    for _, group in itertools.groupby(merged, key=lambda item: item[1]["timestamp"]):
+        group = list(group)
+        hot_keys = {(row["device_sn"], row["user_id"]) for source, row in group if source == 0}
+        for source, row in group:
+            if source == 0 or (row["device_sn"], row["user_id"]) not in hot_keys:
+                yield row
+
+def archive_month(conn, year: int, month: int, archive_dir: str = ATTENDANCE_ARCHIVE_DIR) -> int:
+    """Move one month of attendance_logs into its archive partition, merging with an existing partition.
+
+    The month is streamed from the timestamp index straight into the compressed file,
+    so memory use does not grow with the size of the month. Only rows up to the
+    attendance watermark taken before the read are archived and deleted; a punch for
+    the month committed while the file is written stays for the next run.
+    """
+    cursor = conn.cursor()
+    month_key = f"{year:04d}-{month:02d}"
+    start = month_start(year, month)
+    end = month_start(*next_month(year, month))
+    through_id = attendance_watermark(conn)
+
+    hot_cursor = conn.cursor()
+    hot_cursor.execute(f'''
+        SELECT {", ".join(ARCHIVE_COLUMNS)}
+        FROM attendance_logs
+        WHERE timestamp >= ? AND timestamp < ? AND id <= ?
+        ORDER BY timestamp DESC, created_at DESC
+    ''', (start, end, through_id))
+    first = hot_cursor.fetchone()
+    if first is None:
+        return 0
+    hot_rows = (dict(zip(ARCHIVE_COLUMNS, record)) for record in itertools.chain([first], hot_cursor))
+
+    # Late-arriving records for an already archived month are merged into the existing partition
+    cursor.execute('SELECT file_path FROM attendance_archives WHERE month = ?', (month_key,))
+    existing = cursor.fetchone()
+    file_path = existing[0] if existing else os.path.join(archive_dir, f"attendance_{year:04d}_{month:02d}.tsv.gz")
+    archived_rows = read_archive_rows(file_path) if existing and os.path.exists(file_path) else ()
+
+    bounds = {}  # first (oldest) and last (newest) timestamp written
+
+    def track_bounds(rows):
+        for row in rows:
+            bounds.setdefault("last", row["timestamp"])
+            bounds["first"] = row["timestamp"]
+            yield row
+
+    record_count = write_archive_file(file_path, track_bounds(merge_archive_rows(hot_rows, archived_rows)))
+
+    cursor.execute('''
+        INSERT OR REPLACE INTO attendance_archives
+        (month, file_path, record_count, first_timestamp, last_timestamp, archived_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (month_key, file_path, record_count, bounds["first"], bounds["last"],
+          datetime.datetime.now().isoformat()))
+    conn.commit()
+
+    # The partition is durable now; rows still in the hot table after a crash are
+    # de-duplicated against it on the next run
+    moved = delete_in_chunks(conn, "attendance_logs", "timestamp >= ? AND timestamp < ?", (start, end),
+                             max_id=through_id)
+
+    logger.info(f"[Retention] Archived {moved} attendance records for {month_key} into {file_path}")
+    return moved
+
+def archive_attendance_database(db_path: str, cutoff: str):
+    """Archive every month before cutoff in one attendance database; returns (months, records moved)"""
+    conn = connect_db(db_path)
+    cursor = conn.cursor()
+    archive_dir = attendance_archive_dir(db_path)
+    archived_months = []
+    total_moved = 0
+    lower_bound = ""
+    
+    try:
+        while True:
+            # Walk the timestamp index month by month instead of scanning the table
+            cursor.execute('''
+                SELECT MIN(timestamp) FROM attendance_logs
+                WHERE timestamp >= ? AND timestamp < ? AND timestamp GLOB ?
+            ''', (lower_bound, cutoff, MONTH_TIMESTAMP_GLOB))
+            oldest = cursor.fetchone()[0]
+            if not oldest:
+                break
+            
+            year, month = int(oldest[0:4]), int(oldest[5:7])
+            total_moved += archive_month(conn, year, month, archive_dir)
+            archived_months.append(f"{year:04d}-{month:02d}")
+            lower_bound = month_start(*next_month(year, month))
+    except Exception as e:
+        logger.error(f"[Retention] Error archiving attendance logs in {db_path}: {e}", exc_info=True)
+        conn.rollback()
+    finally:
+        conn.close()
+    
+    if total_moved:
+        # Give the freed pages back to the filesystem. Never a full VACUUM here: it would
+        # rewrite the whole database under the write lock.
+        conn = connect_db(db_path)
+        reclaim_free_pages(conn)
+        conn.close()
+    
+    return archived_months, total_moved
+
+def archive_old_attendance(retention_months: Optional[int] = None):
+    """Archive every month older than the retention window and compact the database(s)"""
+    if retention_months is None:
+        retention_months = ATTENDANCE_RETENTION_MONTHS
+    cutoff = retention_cutoff(retention_months)
+    
+    with _archive_lock:
+        archived_months = set()
+        total_moved = 0
+        for db_path in attendance_db_paths():
+            months, moved = archive_attendance_database(db_path, cutoff)
+            archived_months.update(months)
+            total_moved += moved
+        
+        if total_moved:
+            logger.info(f"[Retention] Archived {total_moved} records from {len(archived_months)} month(s) older than {cutoff}")
+    
+    return {"cutoff": cutoff, "months": sorted(archived_months), "records_archived": total_moved}
+
+def get_archive_partitions(conn):
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT month, file_path, record_count, first_timestamp, last_timestamp, archived_at
+        FROM attendance_archives
+        ORDER BY month DESC
+    ''')
+    return cursor.fetchall()
+
+def iter_archived_attendance(conn):
+    """Stream archived attendance rows across all partitions, newest first"""
+    for partition in get_archive_partitions(conn):
+        file_path = partition[1]
+        if not os.path.exists(file_path):
+            logger.warning(f"[Retention] Archive partition {partition[0]} is missing: {file_path}")
+            continue
+        yield from read_archive_rows(file_path)
+
+def purge_archived_attendance(conn, device_sn: Optional[str] = None, removed_days: Optional[set] = None) -> int:
+    """Remove archived records, either all of them or only those of one device.
+
+    When removed_days is given, the (user_id, day) of every removed record is added to it.
+    """
+    removed = 0
+    with _archive_lock:
+        cursor = conn.cursor()
+        for month_key, file_path, record_count, _, _, _ in get_archive_partitions(conn):
+            if device_sn is None or not os.path.exists(file_path):
+                if os.path.exists(file_path):
+                    os.chmod(file_path, 0o644)
+                    os.remove(file_path)
+                cursor.execute('DELETE FROM attendance_archives WHERE month = ?', (month_key,))
+                removed += record_count
+                continue
+
+            if not any(row["device_sn"] == device_sn for row in read_archive_rows(file_path)):
+                continue
+
+            # Streamed from the old partition into its replacement, like archive_month
+            bounds = {}  # first (oldest) and last (newest) timestamp kept
+
+            def kept_rows():
+                for row in read_archive_rows(file_path):
+                    if row["device_sn"] != device_sn:
+                        bounds.setdefault("last", row["timestamp"])
+                        bounds["first"] = row["timestamp"]
+                        yield row
+                    elif removed_days is not None:
+                        removed_days.add((row["user_id"], row["timestamp"][:10]))
+
+            kept = write_archive_file(file_path, kept_rows())
+            removed += record_count - kept
+            if kept:
+                cursor.execute('''
+                    UPDATE attendance_archives
+                    SET record_count = ?, first_timestamp = ?, last_timestamp = ?
+                    WHERE month = ?
+                ''', (kept, bounds["first"], bounds["last"], month_key))
+            else:
+                os.chmod(file_path, 0o644)
+                os.remove(file_path)
+                cursor.execute('DELETE FROM attendance_archives WHERE month = ?', (month_key,))
+        conn.commit()
+    return removed
+
+def attendance_retention_worker():
+    while True:
+        for tenant in all_tenants():
+            try:
+                with use_tenant(tenant):
+                    archive_old_attendance()
+            except Exception as e:
+                logger.error(f"[Retention] Retention run{f' of tenant {tenant}' if tenant else ''} failed: {e}", exc_info=True)
+        time.sleep(ATTENDANCE_ARCHIVE_INTERVAL)
+
+@app.on_event("startup")
+async def load_command_state():
+    for tenant in all_tenants():
+        with use_tenant(tenant):
+            load_inflight_commands()
+    threading.Thread(target=ack_timeout_worker, name="ack-timeout", daemon=True).start()
+
+@app.on_event("startup")
+async def start_attendance_retention():
+    if ATTENDANCE_RETENTION_MONTHS > 0:
+        threading.Thread(target=attendance_retention_worker, name="attendance-retention", daemon=True).start()
+        logger.info(f"[Retention] Keeping {ATTENDANCE_RETENTION_MONTHS} month(s) of attendance in the hot table")
+
+# Background jobs
+# Bulk deletes run on a worker thread in bounded chunks, each in its own short
+# transaction, so device polls are never blocked behind one long write lock.
+PURGE_CHUNK_SIZE = int(os.environ.get("ADMS_PURGE_CHUNK_SIZE", "5000"))
+PURGE_CHUNK_PAUSE = float(os.environ.get("ADMS_PURGE_CHUNK_PAUSE", "0.05"))  # seconds between chunks
+MAX_FINISHED_JOBS = 100
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+_reclaim_disabled = set()  # database files already reported as lacking incremental auto-vacuum
+
+def database_file(conn) -> str:
+    return conn.execute('PRAGMA database_list').fetchone()[2]
+
+def reclaim_free_pages(conn, max_pages: Optional[int] = None) -> bool:
+    """Return free pages to the filesystem when the database uses incremental auto-vacuum"""
+    cursor = conn.cursor()
+    cursor.execute('PRAGMA auto_vacuum')
+    if cursor.fetchone()[0] != 2:  # 2 = INCREMENTAL
+        db_file = database_file(conn)
+        if db_file not in _reclaim_disabled:
+            _reclaim_disabled.add(db_file)
+            logger.warning(f"[Vacuum] {db_file} predates incremental auto-vacuum; deleted rows leave free pages "
+                           f"in the file until `python main.py vacuum` converts it")
+        return False
+    # Every step of the pragma frees one page; executescript runs it to completion
+    if max_pages is None:
+        conn.executescript('PRAGMA incremental_vacuum')
+    else:
+        conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)})')
+    return True
+
+def enable_incremental_vacuum(db_path: str) -> bool:
+    """Switch an existing database over to incremental auto-vacuum; False if it already uses it.
+    
+    This is a full VACUUM: it rewrites the whole file, needs as much free disk space
+    again, and blocks every writer until it finishes, so it only runs from the CLI
+    while the server is stopped.
+    """
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        started = time.time()
+        logger.info(f"[Vacuum] Converting {db_path} to incremental auto-vacuum")
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+        logger.info(f"[Vacuum] Converted {db_path} in {time.time() - started:.2f}s")
+        _reclaim_disabled.discard(database_file(conn))
+    finally:
+        conn.close()
+    # Connections opened before the conversion keep seeing the old mode
+    close_idle_connections(0)
+    return True
+
+def delete_in_chunks(conn, table: str, where: str, params=(), on_progress=None, max_id: Optional[int] = None) -> int:
+    """Delete matching rows PURGE_CHUNK_SIZE at a time, committing and yielding between chunks.
+    
+    Only rows with ids up to max_id are deleted; by default the highest id when the purge starts.
+    """
+    cursor = conn.cursor()
+
+    # Only delete rows that existed when the purge started so live inserts cannot keep it running
+    if max_id is None:
+        cursor.execute(f'SELECT MAX(id) FROM {table}')
+        max_id = cursor.fetchone()[0]
+    if max_id is None:
+        return 0
+
+    deleted = 0
+    while True:
+        cursor.execute(f'''
+            DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table} WHERE id <= ? AND ({where}) LIMIT ?
+            )
+        ''', (max_id, *params, PURGE_CHUNK_SIZE))
+        chunk = cursor.rowcount
+        conn.commit()
+        if chunk <= 0:
+            break
+
+        deleted += chunk
+        reclaim_free_pages(conn, chunk)
+        if on_progress:
+            on_progress(deleted)
+        time.sleep(PURGE_CHUNK_PAUSE)
+
+    return deleted
+
+def _job_snapshot(job):
+    return dict(job, progress=dict(job["progress"]))
+
+def find_active_job(job_type: str, target: Optional[str] = None):
+    with _jobs_lock:
+        for job in _jobs.values():
+            if (job["type"] == job_type and job["target"] == target and job["tenant"] == current_tenant()
+                    and job["status"] in ("pending", "running")):
+                return _job_snapshot(job)
+    return None
+
+def start_background_job(job_type: str, target: Optional[str], func, *args):
+    """Run func(job, *args) on a worker thread and track its progress in the job registry"""
+    job = {
+        "id": uuid.uuid4().hex,
+        "type": job_type,
+        "target": target,
+        "tenant": current_tenant(),
+        "status": "pending",
+        "progress": {},
+        "result": None,
+        "error": None,
+        "created_at": datetime.datetime.now().isoformat(),
+        "started_at": None,
+        "finished_at": None,
+    }
+
+    with _jobs_lock:
+        finished = [job_id for job_id, existing in _jobs.items() if existing["status"] in ("completed", "failed")]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS + 1)]:
+            del _jobs[job_id]
+        _jobs[job["id"]] = job
+
+    def run():
+        job["status"] = "running"
+        job["started_at"] = datetime.datetime.now().isoformat()
+        try:
+            job["result"] = func(job, *args)
+            job["status"] = "completed"
+            logger.info(f"[Jobs] {job_type} job {job['id']} completed: {job['result']}")
+        except Exception as e:
+            job["status"] = "failed"
+            job["error"] = str(e)
+            logger.error(f"[Jobs] {job_type} job {job['id']} failed: {e}", exc_info=True)
+        finally:
+            job["finished_at"] = datetime.datetime.now().isoformat()
+
+    # The worker sees the tenant of the request that started it
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), name=f"job-{job_type}", daemon=True).start()
+    return _job_snapshot(job)
+
+def remove_device_job(job, sn: str):
+    """Delete a device's attendance logs and commands in chunks, then the device itself"""
+    conn = connect_db()
+    attendance_conn = connect_db(attendance_db_path(sn))
+    progress = job["progress"]
+    progress.update({"logs_deleted": 0, "commands_deleted": 0})
+
+    try:
+        # Days whose summaries change once this device's punches are gone
+        affected_days = set(attendance_conn.execute('''
+            SELECT DISTINCT user_id, substr(timestamp, 1, 10) FROM attendance_logs WHERE device_sn = ?
+        ''', (sn,)).fetchall())
+        
+        progress["logs_deleted"] = delete_in_chunks(
+            attendance_conn, "attendance_logs", "device_sn = ?", (sn,),
+            on_progress=lambda count: progress.update(logs_deleted=count)
+        )
+        progress["logs_deleted"] += purge_archived_attendance(attendance_conn, sn, affected_days)
+        recompute_daily_attendance(attendance_conn, affected_days)
+        invalidate_user_timelines({user_id for user_id, _ in affected_days})
+
+        progress["commands_deleted"] = delete_in_chunks(
+            conn, "device_commands", "device_sn = ?", (sn,),
+            on_progress=lambda count: progress.update(commands_deleted=count)
+        )
+        
+        # Blob files stay; they may be shared with other devices
+        progress["uploads_deleted"] = delete_in_chunks(conn, "device_uploads", "device_sn = ?", (sn,))
+
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM devices WHERE serial_number = ?", (sn,))
+        devices_count = cursor.rowcount
+        conn.commit()
+    finally:
+        attendance_conn.close()
+        conn.close()
+        bump_resource_versions("devices", "commands", "attendance")
+        bump_delta_generations("devices", "commands", "attendance")
+
+    return {
+        "message": f"Successfully removed device {sn}",
+        "devices_deleted": devices_count,
+        "commands_deleted": progress["commands_deleted"],
+        "logs_deleted": progress["logs_deleted"],
+        "uploads_deleted": progress["uploads_deleted"]
+    }
+
+def clear_attendance_job(job):
+    """Delete every attendance log in chunks, including the archived months, in every shard"""
+    progress = job["progress"]
+    progress["logs_deleted"] = 0
+    count = 0
+
+    try:
+        for db_path in attendance_db_paths():
+            conn = connect_db(db_path)
+            try:
+                count += delete_in_chunks(
+                    conn, "attendance_logs", "1 = 1",
+                    on_progress=lambda deleted, done=count: progress.update(logs_deleted=done + deleted)
+                )
+                count += purge_archived_attendance(conn)
+                progress["logs_deleted"] = count
+                conn.execute('DELETE FROM daily_attendance')
+                conn.commit()
+            finally:
+                conn.close()
+    finally:
+        invalidate_user_timelines()
+        bump_resource_versions("attendance")
+        bump_delta_generations("attendance")
+
+    return {"message": f"Successfully cleared {count} attendance logs"}
+
+# Attendance import
+# ATTLOG .dat files exported from a terminal over USB (or pulled after an outage) are
+# loaded without replaying them through /iclock/cdata. The file is memory-mapped and
+# read line by line with parse_attendance_line; every IMPORT_BATCH_SIZE records go in
+# with one executemany in one transaction, duplicates skipped on the UNIQUE
+# constraint, and the rows that were new are read back to update the daily summaries
+# and reach webhook subscribers. POST /api/attendance/import?sn= streams the file to
+# IMPORT_DIR and runs it as a background job. `python main.py import FILE SN` runs it
+# from the shell, or hands it to the server at ADMS_SERVER_URL when a server holds
+# the process lock, so ids are never allocated by two processes.
+IMPORT_DIR = os.environ.get("ADMS_IMPORT_DIR", "imports")
+IMPORT_BATCH_SIZE = int(os.environ.get("ADMS_IMPORT_BATCH_SIZE", "50000"))  # records per transaction
+IMPORT_CACHE_KB = int(os.environ.get("ADMS_IMPORT_CACHE_KB", "131072"))  # page cache of the importing connection
+IMPORT_SKIPPED_SAMPLE = 20  # unparsed lines quoted in the import summary
+SERVER_URL = os.environ.get("ADMS_SERVER_URL", "http://127.0.0.1:8080")  # where the import CLI finds a running server
+
+def iter_attlog_lines(mapped):
+    """Decoded, stripped non-empty lines of a memory-mapped ATTLOG export"""
+    for raw in iter(mapped.readline, b""):
+        line = raw.decode("utf-8", errors="replace").strip().lstrip("\ufeff")
+        if line:
+            yield line
+
+def bulk_store_attendance_records(sn: str, records) -> int:
+    """Insert parsed punches in one transaction and return how many were new.
+    
+    Unlike store_attendance_records this does not log every punch, and the daily
+    summaries are updated with one upsert per user-day.
+    """
+    if not records:
+        return 0
+    sharded = attendance_sharded()
+    first_id = allocate_attendance_ids(len(records)) if sharded else None
+    committed = []
+    conn = connect_db(attendance_db_path(sn))
+    try:
+        conn.execute(f'PRAGMA cache_size = -{IMPORT_CACHE_KB}')
+        # Take the write lock first, so every id past the watermark is one of ours
+        conn.execute('BEGIN IMMEDIATE')
+        if sharded:
+            id_range = (first_id, first_id + len(records) - 1)
+        else:
+            # AUTOINCREMENT hands out ids above the recorded sequence
+            sequence = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'attendance_logs'").fetchone()
+            id_range = ((sequence[0] if sequence else 0) + 1, sys.maxsize)
+        cursor = conn.cursor()
+        # Sorted by user and time, the inserts into the UNIQUE and user timeline indexes hit neighbouring pages
+        records = sorted(records)
+        changes_before = conn.total_changes
+        # Duplicate punches are skipped; an id taken by another writer raises
+        cursor.executemany('''
+            INSERT INTO attendance_logs (id, device_sn, user_id, timestamp, verify_mode, status)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(device_sn, user_id, timestamp) DO NOTHING
+        ''', ((first_id + offset if sharded else None, sn, user_id, timestamp, verify_mode, status)
+              for offset, (user_id, timestamp, verify_mode, status) in enumerate(records)))
+        inserted = conn.total_changes - changes_before
+        if inserted > 0:
+            cursor.execute('''
+                SELECT id, user_id, timestamp, verify_mode, status FROM attendance_logs
+                WHERE id BETWEEN ? AND ? ORDER BY id
+            ''', id_range)
+            new_rows = [{"id": row[0], "device_sn": sn, "user_id": row[1], "timestamp": row[2],
+                         "verify_mode": row[3], "status": row[4]} for row in cursor.fetchall()]
+            if len(new_rows) != inserted:
+                raise RuntimeError(f"Inserted {inserted} attendance records but found {len(new_rows)} in ids {id_range}")
+            record_daily_punches(cursor, ((row["user_id"], row["timestamp"]) for row in new_rows))
+            if sharded:
+                conn.commit()
+            else:
+                commit_unsharded_attendance(conn, new_rows)
+            committed = new_rows
+        else:
+            conn.rollback()
+    finally:
+        conn.execute('PRAGMA cache_size = -2000')
+        conn.close()
+        if sharded:
+            complete_attendance_ids(first_id, len(records), committed)
+    
+    if committed:
+        bump_resource_versions("attendance")
+        invalidate_user_timelines({row["user_id"] for row in committed})
+    return len(committed)
+
+def import_attlog_file(file_path: str, sn: str, progress: Optional[dict] = None, on_progress=None):
+    """Load an ATTLOG .dat export into a device's attendance, IMPORT_BATCH_SIZE records per transaction"""
+    progress = progress if progress is not None else {}
+    size = os.path.getsize(file_path)
+    progress.update({"bytes_total": size, "bytes_read": 0, "lines": 0, "records": 0, "inserted": 0,
+                     "duplicates": 0, "invalid": 0, "records_per_second": 0})
+    skipped_lines = []  # (line number, text) of the first unparsed lines
+    started = time.monotonic()
+    
+    def flush(records, bytes_read):
+        inserted = bulk_store_attendance_records(sn, records)
+        elapsed = time.monotonic() - started
+        progress.update({
+            "bytes_read": bytes_read,
+            "records": progress["records"] + len(records),
+            "inserted": progress["inserted"] + inserted,
+            "duplicates": progress["duplicates"] + len(records) - inserted,
+        })
+        progress["records_per_second"] = round(progress["records"] / elapsed) if elapsed > 0 else 0
+        logger.info(f"[Import] {sn}: {progress['records']} records ({100 * bytes_read // max(size, 1)}%), "
+                    f"{progress['inserted']} new, {progress['duplicates']} duplicates, "
+                    f"{progress['records_per_second']} records/s")
+        if on_progress:
+            on_progress(progress)
+    
+    if size:
+        with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_SEQUENTIAL)
+            records = []
+            for line in iter_attlog_lines(mapped):
+                progress["lines"] += 1
+                try:
+                    record = parse_attendance_line(line)
+                except (ValueError, IndexError):
+                    record = None
+                if not record:
+                    progress["invalid"] += 1
+                    if len(skipped_lines) < IMPORT_SKIPPED_SAMPLE:
+                        skipped_lines.append((progress["lines"], line[:200]))
+                    continue
+                records.append(record)
+                if len(records) >= IMPORT_BATCH_SIZE:
+                    flush(records, mapped.tell())
+                    records = []
+            flush(records, size)
+    
+    elapsed = time.monotonic() - started
+    if progress["duplicates"] or progress["invalid"]:
+        logger.warning(f"[Import] {sn}: skipped {progress['duplicates']} records already stored and "
+                       f"{progress['invalid']} unparsed lines")
+    return {
+        "message": f"Imported {progress['inserted']} new attendance records for device {sn}",
+        "records": progress["records"],
+        "inserted": progress["inserted"],
+        "duplicates": progress["duplicates"],
+        "invalid": progress["invalid"],
+        "skipped": progress["duplicates"] + progress["invalid"],
+        "skipped_lines": skipped_lines,
+        "seconds": round(elapsed, 3),
+        "records_per_second": progress["records_per_second"],
+    }
+
+def import_attlog_job(job, file_path: str, sn: str):
+    """Run import_attlog_file for an uploaded file, then delete the file"""
+    try:
+        return import_attlog_file(file_path, sn, job["progress"])
+    finally:
+        os.remove(file_path)
+
+def import_through_server(file_path: str, sn: str, on_progress=None, poll_interval: float = 1.0):
+    """Upload an export to the running server's import endpoint and wait for its job to finish"""
+    url = f"{SERVER_URL}{tenant_url('/api/attendance/import')}?sn={urllib.parse.quote(sn)}"
+    with open(file_path, "rb") as f:
+        request = urllib.request.Request(url, data=f, method="POST", headers={
+            "Content-Type": "application/octet-stream",
+            "Content-Length": str(os.path.getsize(file_path)),
+        })
+        with urllib.request.urlopen(request) as response:
+            job = json.loads(response.read())
+    
+    reported = None
+    while True:
+        time.sleep(poll_interval)
+        with urllib.request.urlopen(f"{SERVER_URL}{job['status_url']}") as response:
+            snapshot = json.loads(response.read())
+        if on_progress and snapshot["progress"] and snapshot["progress"] != reported:
+            reported = snapshot["progress"]
+            on_progress(reported)
+        if snapshot["status"] == "completed":
+            return snapshot["result"]
+        if snapshot["status"] == "failed":
+            raise RuntimeError(f"Import job {job['job_id']} failed: {snapshot['error']}")
+
+# Online backups
+# Snapshots are taken with the SQLite backup API while the server keeps running.
+# The copy reads one pinned snapshot of each database; without that, every commit
+# from another connection would restart it from the first page. In WAL mode that
+# pinned reader does not block writers. BACKUP_PAGES_PER_STEP pages are copied per
+# step with BACKUP_STEP_SLEEP between steps, so the copy never monopolizes the disk.
+# A snapshot is a directory under BACKUP_DIR holding adms.db and the attendance
+# shards. It is written under a .partial name and renamed once complete. Only the
+# newest BACKUP_KEEP snapshots are kept.
+BACKUP_DIR = os.environ.get("ADMS_BACKUP_DIR", "backups")
+BACKUP_INTERVAL = int(os.environ.get("ADMS_BACKUP_INTERVAL", "86400"))  # seconds, 0 disables scheduled backups
+BACKUP_KEEP = int(os.environ.get("ADMS_BACKUP_KEEP", "7"))
+BACKUP_PAGES_PER_STEP = int(os.environ.get("ADMS_BACKUP_PAGES_PER_STEP", "1024"))
+BACKUP_STEP_SLEEP = float(os.environ.get("ADMS_BACKUP_STEP_SLEEP", "0.005"))  # seconds between steps
+BACKUP_PREFIX = "adms-"
+BACKUP_PARTIAL_SUFFIX = ".partial"
+
+def backup_database(src_path: str, dst_path: str, on_progress=None) -> int:
+    """Copy one live database to dst_path page-step by page-step and return its page count"""
+    source = sqlite3.connect(src_path, isolation_level=None)
+    target = sqlite3.connect(dst_path)
+    pages = [0]
+    
+    def step(status, remaining, total):
+        pages[0] = total
+        if on_progress:
+            on_progress(total - remaining, total)
+        time.sleep(BACKUP_STEP_SLEEP)
+    
+    try:
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()  # pins the read snapshot
+        source.backup(target, pages=BACKUP_PAGES_PER_STEP, progress=step)
+        source.execute('COMMIT')
+    finally:
+        target.close()
+        source.close()
+    return pages[0]
+
+def backup_dir() -> str:
+    return tenant_path(BACKUP_DIR)
+
+def list_backups():
+    """Completed snapshots, newest first"""
+    if not os.path.isdir(backup_dir()):
+        return []
+    names = [name for name in os.listdir(backup_dir())
+             if name.startswith(BACKUP_PREFIX) and not name.endswith(BACKUP_PARTIAL_SUFFIX)]
+    return sorted(names, reverse=True)
+
+def backup_size(directory: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+def rotate_backups(keep: int):
+    """Delete all but the newest keep snapshots, plus leftovers of interrupted runs"""
+    removed = list_backups()[keep:]
+    for name in removed:
+        shutil.rmtree(os.path.join(backup_dir(), name), ignore_errors=True)
+    for name in os.listdir(backup_dir()):
+        if name.endswith(BACKUP_PARTIAL_SUFFIX):
+            shutil.rmtree(os.path.join(backup_dir(), name), ignore_errors=True)
+    return removed
+
+def backup_job(job):
+    """Snapshot adms.db and the attendance shards into a new directory under BACKUP_DIR"""
+    progress = job["progress"]
+    now = datetime.datetime.now()
+    name = f"{BACKUP_PREFIX}{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}"
+    partial_dir = os.path.join(backup_dir(), name + BACKUP_PARTIAL_SUFFIX)
+    os.makedirs(partial_dir)
+    
+    databases = []
+    for db_path in database_paths():
+        relative = 'adms.db' if db_path == tenant_path('adms.db') else os.path.join("shards", os.path.basename(db_path))
+        conn = connect_db(db_path)
+        page_size, page_count = (conn.execute(f'PRAGMA {pragma}').fetchone()[0] for pragma in ("page_size", "page_count"))
+        conn.close()
+        databases.append((db_path, relative, page_size * page_count))
+    
+    bytes_total = sum(size for *_, size in databases)
+    progress.update({"backup": name, "databases": len(databases), "bytes_total": bytes_total,
+                     "bytes_copied": 0, "percent": 0.0, "elapsed_seconds": 0.0})
+    started = time.monotonic()
+    bytes_done = 0
+    
+    try:
+        for db_path, relative, size in databases:
+            dst_path = os.path.join(partial_dir, relative)
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            
+            def on_progress(copied, total, done=bytes_done, size=size):
+                copied_bytes = done + (size * copied // total if total else 0)
+                progress.update({"database": db_path, "bytes_copied": copied_bytes,
+                                 "percent": round(100 * copied_bytes / bytes_total, 1) if bytes_total else 100.0,
+                                 "elapsed_seconds": round(time.monotonic() - started, 1)})
+            
+            backup_database(db_path, dst_path, on_progress)
+            bytes_done += size
+    except Exception:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        raise
+    
+    final_dir = os.path.join(backup_dir(), name)
+    os.replace(partial_dir, final_dir)
+    duration = time.monotonic() - started
+    size = backup_size(final_dir)
+    removed = rotate_backups(BACKUP_KEEP)
+    progress.update({"bytes_copied": bytes_total, "percent": 100.0, "elapsed_seconds": round(duration, 1)})
+    logger.info(f"[Backup] Wrote {final_dir} ({size / 1e6:.1f} MB) in {duration:.1f}s; rotated out {len(removed)}")
+    
+    return {
+        "backup": name,
+        "path": final_dir,
+        "databases": len(databases),
+        "size_bytes": size,
+        "duration_seconds": round(duration, 2),
+        "mb_per_second": round(size / 1e6 / duration, 1) if duration else None,
+        "rotated_out": removed
+    }
+
+def start_backup():
+    return find_active_job("backup") or start_background_job("backup", None, backup_job)
+
+def backup_worker():
+    while True:
+        time.sleep(BACKUP_INTERVAL)
+        for tenant in all_tenants():
+            try:
+                with use_tenant(tenant):
+                    start_backup()
+            except Exception as e:
+                logger.error(f"[Backup] Scheduled backup{f' of tenant {tenant}' if tenant else ''} failed to start: {e}", exc_info=True)
+
+@app.on_event("startup")
+async def start_backup_schedule():
+    if BACKUP_INTERVAL > 0:
+        threading.Thread(target=backup_worker, name="backup-schedule", daemon=True).start()
+        logger.info(f"[Backup] Snapshotting every {BACKUP_INTERVAL}s into {BACKUP_DIR}, keeping {BACKUP_KEEP}")
+
+# Blob store
+# Upload bodies are streamed straight to disk while being hashed, then moved into
+# place under their SHA-256, so identical uploads from any device share one file
+# and nothing is buffered in memory.
+BLOB_STORE_DIR = os.environ.get("ADMS_BLOB_DIR", "blobs")
+BLOB_HEADER_BYTES = 1024  # leading bytes kept to read the upload's PIN= header
+
+def blob_path(sha256: str) -> str:
+    return tenant_path(os.path.join(BLOB_STORE_DIR, sha256[0:2], sha256[2:4], sha256))
+
+def parse_upload_pin(header: bytes) -> Optional[str]:
+    """Read PIN= from the text header that precedes ATTPHOTO and template payloads"""
+    text = header.split(b"\0", 1)[0].decode("utf-8", errors="ignore")
+    for line in text.replace("\t", "\n").splitlines():
+        if line.upper().startswith("PIN="):
+            return line[4:].strip() or None
+    return None
+
+async def store_upload(request: Request, sn: str, table_name: str):
+    """Stream a request body into the blob store and index it for the device"""
+    tmp_dir = tenant_path(os.path.join(BLOB_STORE_DIR, "tmp"))
+    os.makedirs(tmp_dir, exist_ok=True)
+    
+    digest = hashlib.sha256()
+    size = 0
+    header = b""
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                digest.update(chunk)
+                size += len(chunk)
+                if len(header) < BLOB_HEADER_BYTES:
+                    header += chunk[:BLOB_HEADER_BYTES - len(header)]
+                tmp_file.write(chunk)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        
+        sha256 = digest.hexdigest()
+        final_path = blob_path(sha256)
+        is_new = not os.path.exists(final_path)
+        if is_new:
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(tmp_path, final_path)
+        else:
+            os.remove(tmp_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    pin = parse_upload_pin(header)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        INSERT OR IGNORE INTO blobs (sha256, size, file_path, created_at)
+        VALUES (?, ?, ?, ?)
+    ''', (sha256, size, final_path, datetime.datetime.now().isoformat()))
+    cursor.execute('''
+        INSERT INTO device_uploads (device_sn, table_name, pin, sha256, uploaded_at)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (sn, table_name, pin, sha256, datetime.datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+    
+    logger.info(f"[BlobStore] Stored {table_name} upload from device {sn}: {sha256} ({size} bytes, PIN={pin}, {'new' if is_new else 'duplicate'})")
+    return {"sha256": sha256, "size": size, "pin": pin, "new": is_new}
+
+# User directory
+# USERINFO/OPERLOG uploads fill the users table. Lookups go through a bounded
+# in-process LRU ((tenant, user_id) -> name, None for unknown users) so attendance pages can be
+# enriched without a join; upserts invalidate the affected entries.
+USER_DIRECTORY_SIZE = int(os.environ.get("ADMS_USER_DIRECTORY_SIZE", "100000"))
+SQLITE_MAX_VARIABLES = 900
+
+_user_directory = OrderedDict()
+_user_directory_lock = threading.Lock()
+
+def parse_user_record(line: str):
+    """Parse a 'USER PIN=..\tName=..' (OPERLOG) or 'PIN=..\tName=..' (USERINFO) line"""
+    line = line.strip()
+    if line.startswith("USER "):
+        line = line[5:]
+    elif not line.startswith("PIN="):
+        # FP, OPLOG and other OPERLOG records are not user records
+        return None
+    
+    fields = {}
+    for field in line.split("\t"):
+        key, sep, value = field.partition("=")
+        if sep:
+            fields[key.strip()] = value.strip()
+    
+    user_id = fields.get("PIN")
+    if not user_id:
+        return None
+    
+    try:
+        privilege = int(fields["Pri"]) if fields.get("Pri") else None
+    except ValueError:
+        privilege = None
+    
+    return {
+        "user_id": user_id,
+        "name": fields.get("Name") or None,
+        "privilege": privilege,
+        "card": fields.get("Card") or None,
+        "group_id": fields.get("Grp") or None
+    }
+
+def upsert_users(sn: str, users) -> int:
+    """Insert or update users reported by a device and invalidate their directory entries"""
+    if not users:
+        return 0
+    
+    now_str = datetime.datetime.now().isoformat()
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.executemany('''
+        INSERT INTO users (user_id, name, privilege, card, group_id, device_sn, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            name = COALESCE(excluded.name, users.name),
+            privilege = COALESCE(excluded.privilege, users.privilege),
+            card = COALESCE(excluded.card, users.card),
+            group_id = COALESCE(excluded.group_id, users.group_id),
+            device_sn = excluded.device_sn,
+            updated_at = excluded.updated_at
+    ''', [(user["user_id"], user["name"], user["privilege"], user["card"], user["group_id"], sn, now_str) for user in users])
+    conn.commit()
     conn.close()
+    bump_resource_versions("users")
     
-    logger.info(f"Cleared {len(command_ids)} commands from queue for device {sn}")
+    invalidate_users(user["user_id"] for user in users)
+    invalidate_user_timelines({user["user_id"] for user in users})
+    return len(users)
 
-# Add middleware to log all requests
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    start_time = time.time()
+def invalidate_users(user_ids=None):
+    """Drop directory entries for the given users, or all of them"""
+    with _user_directory_lock:
+        if user_ids is None:
+            _user_directory.clear()
+            return
+        tenant = current_tenant()
+        for user_id in user_ids:
+            _user_directory.pop((tenant, user_id), None)
+
+def lookup_user_names(user_ids, conn=None):
+    """Resolve user names through the LRU directory, loading misses in batched IN queries"""
+    names = {}
+    misses = []
+    tenant = current_tenant()
+    with _user_directory_lock:
+        for user_id in set(user_ids):
+            if (tenant, user_id) in _user_directory:
+                _user_directory.move_to_end((tenant, user_id))
+                names[user_id] = _user_directory[tenant, user_id]
+            else:
+                misses.append(user_id)
+    
+    if not misses:
+        return names
+    
+    own_conn = conn is None
+    if own_conn:
+        conn = connect_db()
+    cursor = conn.cursor()
+    loaded = dict.fromkeys(misses)
+    for start in range(0, len(misses), SQLITE_MAX_VARIABLES):
+        batch = misses[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ','.join('?' * len(batch))
+        cursor.execute(f'SELECT user_id, name FROM users WHERE user_id IN ({placeholders})', batch)
+        loaded.update(cursor.fetchall())
+    if own_conn:
+        conn.close()
+    
+    with _user_directory_lock:
+        for user_id, name in loaded.items():
+            _user_directory[tenant, user_id] = name
+            _user_directory.move_to_end((tenant, user_id))
+        while len(_user_directory) > USER_DIRECTORY_SIZE:
+            _user_directory.popitem(last=False)
+    
+    names.update(loaded)
+    return names
+
+# Daily attendance summaries
+# daily_attendance keeps first punch, last punch and punch count per user per day.
+# Ingestion updates it in the same transaction as the raw insert, so late-arriving
+# backlog records simply widen the day's range.
+
+def record_daily_punch(cursor, user_id: str, timestamp: str):
+    """Fold one newly inserted punch into its user's daily summary"""
+    if len(timestamp) < 10 or not timestamp[:4].isdigit() or timestamp[4] != "-":
+        return
+    cursor.execute('''
+        INSERT INTO daily_attendance (user_id, day, first_in, last_out, punch_count)
+        VALUES (?, ?, ?, ?, 1)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            first_in = MIN(first_in, excluded.first_in),
+            last_out = MAX(last_out, excluded.last_out),
+            punch_count = punch_count + 1
+    ''', (user_id, timestamp[:10], timestamp, timestamp))
+
+def record_daily_punches(cursor, punches):
+    """Fold many newly inserted (user_id, timestamp) punches into the daily summaries with one upsert per user-day"""
+    days = {}
+    for user_id, timestamp in punches:
+        if len(timestamp) < 10 or not timestamp[:4].isdigit() or timestamp[4] != "-":
+            continue
+        day = days.get((user_id, timestamp[:10]))
+        if day:
+            day[0] = min(day[0], timestamp)
+            day[1] = max(day[1], timestamp)
+            day[2] += 1
+        else:
+            days[(user_id, timestamp[:10])] = [timestamp, timestamp, 1]
+    cursor.executemany('''
+        INSERT INTO daily_attendance (user_id, day, first_in, last_out, punch_count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(user_id, day) DO UPDATE SET
+            first_in = MIN(first_in, excluded.first_in),
+            last_out = MAX(last_out, excluded.last_out),
+            punch_count = punch_count + excluded.punch_count
+    ''', [(user_id, day, first_in, last_out, count) for (user_id, day), (first_in, last_out, count) in days.items()])
+
+def recompute_daily_attendance(conn, days) -> int:
+    """Rebuild the summaries of the given (user_id, day) pairs from the hot table and the archives"""
+    days = set(days)
+    if not days:
+        return 0
+    
+    cursor = conn.cursor()
+    summaries = {}
+    for user_id, day in days:
+        cursor.execute('''
+            SELECT MIN(timestamp), MAX(timestamp), COUNT(*) FROM attendance_logs
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+        ''', (user_id, day, day + "~"))
+        first_in, last_out, count = cursor.fetchone()
+        if count:
+            summaries[(user_id, day)] = [first_in, last_out, count]
+    
+    # Archived months contribute too; read each affected partition once
+    archived = {month: file_path for month, file_path, *_ in get_archive_partitions(conn)}
+    for month in {day[:7] for _, day in days} & set(archived):
+        if not os.path.exists(archived[month]):
+            continue
+        for row in read_archive_rows(archived[month]):
+            key = (row["user_id"], row["timestamp"][:10])
+            if key not in days:
+                continue
+            summary = summaries.setdefault(key, [row["timestamp"], row["timestamp"], 0])
+            summary[0] = min(summary[0], row["timestamp"])
+            summary[1] = max(summary[1], row["timestamp"])
+            summary[2] += 1
+    
+    for user_id, day in days:
+        summary = summaries.get((user_id, day))
+        if summary:
+            cursor.execute('''
+                INSERT OR REPLACE INTO daily_attendance (user_id, day, first_in, last_out, punch_count)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (user_id, day, *summary))
+        else:
+            cursor.execute('DELETE FROM daily_attendance WHERE user_id = ? AND day = ?', (user_id, day))
+    conn.commit()
+    return len(days)
+
+# User attendance timelines
+# /api/users/{user_id}/attendance answers "this employee's punches today / this week"
+# from idx_attendance_user_timeline alone, which covers every column it returns.
+# Encoded responses are kept in a small LRU for USER_TIMELINE_TTL seconds, so a hit
+# skips SQLite and FastAPI's response encoding. Ingestion, user upserts and the
+# attendance delete jobs drop the entries of the users they touch.
+USER_TIMELINE_CACHE_SIZE = int(os.environ.get("ADMS_USER_TIMELINE_CACHE_SIZE", "4096"))
+USER_TIMELINE_TTL = float(os.environ.get("ADMS_USER_TIMELINE_TTL", "30"))  # seconds
+USER_TIMELINE_DEFAULT_DAYS = 7
+USER_TIMELINE_FIELDS = ("timestamp", "device_sn", "verify_mode", "status")
+
+_user_timelines = OrderedDict()  # (tenant, user_id, start, end, limit) -> (expires_at, JSON body)
+_user_timeline_keys = {}  # (tenant, user_id) -> cache keys of that user
+# Bumped on invalidation so a lookup that raced an insert does not cache its stale result
+_user_timeline_versions = {"*": 0}
+_user_timelines_lock = threading.Lock()
+
+def read_user_timeline(user_id: str, start: str, end: str, limit: int):
+    """Punches of one user from start to end (inclusive days), newest first, across every shard"""
+    lower, upper = start, end + "~"
+    pages = []
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        cursor = conn.execute('''
+            SELECT timestamp, device_sn, verify_mode, status FROM attendance_logs
+            WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            ORDER BY timestamp DESC
+            LIMIT ?
+        ''', (user_id, lower, upper, limit))
+        page = [dict(zip(USER_TIMELINE_FIELDS, row)) for row in cursor.fetchall()]
+        
+        # Months past the retention window only exist in the archives
+        archived = False
+        for _, file_path, _, first_timestamp, last_timestamp, _ in get_archive_partitions(conn):
+            if (last_timestamp or "") < lower or (first_timestamp or "") >= upper or not os.path.exists(file_path):
+                continue
+            archived = True
+            page.extend(
+                {field: row[field] for field in USER_TIMELINE_FIELDS} for row in read_archive_rows(file_path)
+                if row["user_id"] == user_id and lower <= row["timestamp"] < upper
+            )
+        conn.close()
+        if archived:
+            page.sort(key=lambda punch: punch["timestamp"], reverse=True)
+        pages.append(page)
+    
+    merged = heapq.merge(*pages, key=lambda punch: punch["timestamp"], reverse=True)
+    return [punch for _, punch in zip(range(limit), merged)]
+
+def _user_timeline_version(user: tuple):
+    return (_user_timeline_versions["*"], _user_timeline_versions.get(user, 0))
+
+def get_user_timeline_json(user_id: str, start: str, end: str, limit: int) -> bytes:
+    """The encoded /api/users/{user_id}/attendance response, from the cache when fresh"""
+    user = (current_tenant(), user_id)
+    key = (*user, start, end, limit)
+    now = time.monotonic()
+    with _user_timelines_lock:
+        entry = _user_timelines.get(key)
+        if entry and entry[0] > now:
+            _user_timelines.move_to_end(key)
+            return entry[1]
+        version = _user_timeline_version(user)
+    
+    body = json.dumps({
+        "user_id": user_id,
+        "user_name": lookup_user_names([user_id]).get(user_id),
+        "start": start,
+        "end": end,
+        "punches": read_user_timeline(user_id, start, end, limit)
+    }).encode()
+    
+    with _user_timelines_lock:
+        if _user_timeline_version(user) == version and USER_TIMELINE_CACHE_SIZE > 0:
+            _user_timelines[key] = (now + USER_TIMELINE_TTL, body)
+            _user_timelines.move_to_end(key)
+            _user_timeline_keys.setdefault(user, set()).add(key)
+            while len(_user_timelines) > USER_TIMELINE_CACHE_SIZE:
+                evicted, _ = _user_timelines.popitem(last=False)
+                keys = _user_timeline_keys[evicted[:2]]
+                keys.discard(evicted)
+                if not keys:
+                    del _user_timeline_keys[evicted[:2]]
+    return body
+
+def invalidate_user_timelines(user_ids=None):
+    """Drop cached timelines of the given users, or all of them"""
+    with _user_timelines_lock:
+        if user_ids is None:
+            _user_timelines.clear()
+            _user_timeline_keys.clear()
+            _user_timeline_versions["*"] += 1
+            return
+        tenant = current_tenant()
+        for user_id in user_ids:
+            user = (tenant, user_id)
+            _user_timeline_versions[user] = _user_timeline_versions.get(user, 0) + 1
+            for key in _user_timeline_keys.pop(user, ()):
+                _user_timelines.pop(key, None)
+
+# Webhook forwarding
+# New attendance rows are published in id order as they are committed (by receive_data
+# and the bulk import) and forwarded to every subscriber in batches of up to
+# WEBHOOK_BATCH_SIZE rows, at least every WEBHOOK_BATCH_INTERVAL seconds. A batch
+# that cannot be delivered is written to the subscriber's spool directory and retried
+# with exponential backoff; later batches queue behind it on disk, so delivery stays
+# in id order. The cursor (last delivered attendance_logs.id) is stored per
+# subscriber; at startup rows past the cursor that were neither delivered nor
+# spooled are re-read from attendance_logs.
+WEBHOOK_BATCH_SIZE = int(os.environ.get("ADMS_WEBHOOK_BATCH_SIZE", "500"))
+WEBHOOK_BATCH_INTERVAL = float(os.environ.get("ADMS_WEBHOOK_BATCH_INTERVAL", "2"))  # seconds
+WEBHOOK_TIMEOUT = float(os.environ.get("ADMS_WEBHOOK_TIMEOUT", "10"))  # seconds
+WEBHOOK_RETRY_DELAY = float(os.environ.get("ADMS_WEBHOOK_RETRY_DELAY", "5"))  # seconds, first retry
+WEBHOOK_MAX_BACKOFF = float(os.environ.get("ADMS_WEBHOOK_MAX_BACKOFF", "300"))  # seconds
+WEBHOOK_SPOOL_DIR = os.environ.get("ADMS_WEBHOOK_SPOOL_DIR", "spool")
+WEBHOOK_FIELDS = ("id", "device_sn", "user_id", "timestamp", "verify_mode", "status")
+
+_webhooks = {}  # (tenant, subscriber id) -> delivery state
+_webhooks_cond = threading.Condition()
+
+def webhook_spool_dir(subscriber_id: int) -> str:
+    return tenant_path(os.path.join(WEBHOOK_SPOOL_DIR, str(subscriber_id)))
+
+def webhook_spool_files(subscriber_id: int):
+    """Spooled batches in delivery order (file names are the zero-padded first id)"""
+    directory = webhook_spool_dir(subscriber_id)
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if name.endswith(".json")]
+
+def spool_webhook_batch(subscriber_id: int, rows):
+    directory = webhook_spool_dir(subscriber_id)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(rows, f)
+    os.replace(tmp_path, os.path.join(directory, f"{rows[0]['id']:020d}.json"))
+
+def webhook_state(subscriber_id: int, name: str, url: str, cursor: int):
+    return {
+        "id": subscriber_id, "tenant": current_tenant(), "name": name, "url": url, "cursor": cursor,
+        "enqueued_through": cursor, "queue": [],
+        "failures": 0, "next_attempt": 0.0, "last_error": None, "delivered": 0
+    }
+
+def publish_attendance(rows):
+    """Hand newly committed attendance rows to every subscriber's queue"""
+    if not rows:
+        return
+    tenant = current_tenant()
+    with _webhooks_cond:
+        for state in _webhooks.values():
+            if state["tenant"] != tenant:
+                continue
+            fresh = [row for row in rows if row["id"] > state["enqueued_through"]]
+            if fresh:
+                state["queue"].extend(fresh)
+                state["enqueued_through"] = fresh[-1]["id"]
+                if len(state["queue"]) >= WEBHOOK_BATCH_SIZE:
+                    _webhooks_cond.notify()
+
+def post_webhook_batch(state, rows) -> bool:
+    payload = json.dumps({
+        "subscriber": state["name"],
+        "first_id": rows[0]["id"],
+        "last_id": rows[-1]["id"],
+        "records": rows
+    }).encode()
+    request = urllib.request.Request(state["url"], data=payload, method="POST", headers={
+        "Content-Type": "application/json",
+        # Receivers can drop a re-delivered batch by this id
+        "X-ADMS-Batch": f"{rows[0]['id']}-{rows[-1]['id']}"
+    })
+    try:
+        with urllib.request.urlopen(request, timeout=WEBHOOK_TIMEOUT) as response:
+            response.read()
+        return True
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        state["last_error"] = str(getattr(e, "reason", e))
+        return False
+
+def record_webhook_delivery(state, last_id: int, count: int):
+    state["cursor"] = last_id
+    state["delivered"] += count
+    state["failures"] = 0
+    state["last_error"] = None
+    conn = connect_db()
+    conn.execute('''
+        UPDATE webhook_subscribers SET cursor = ?, last_delivery_at = ?, last_error = NULL WHERE id = ?
+    ''', (last_id, datetime.datetime.now().isoformat(), state["id"]))
+    conn.commit()
+    conn.close()
+
+def record_webhook_failure(state):
+    state["failures"] += 1
+    delay = min(WEBHOOK_MAX_BACKOFF, WEBHOOK_RETRY_DELAY * 2 ** (state["failures"] - 1))
+    state["next_attempt"] = time.monotonic() + delay
+    logger.warning(f"[Webhook] Delivery to {state['name']} failed ({state['last_error']}); retrying in {delay:g}s")
+    conn = connect_db()
+    conn.execute('UPDATE webhook_subscribers SET last_error = ? WHERE id = ?', (state["last_error"], state["id"]))
+    conn.commit()
+    conn.close()
+
+def flush_webhook(state, rows):
+    """Deliver spooled batches, then the queued rows; whatever cannot go out now is spooled"""
+    batches = [rows[start:start + WEBHOOK_BATCH_SIZE] for start in range(0, len(rows), WEBHOOK_BATCH_SIZE)]
+    spooled = webhook_spool_files(state["id"])
+    
+    if time.monotonic() >= state["next_attempt"]:
+        while spooled:
+            with open(spooled[0]) as f:
+                batch = json.load(f)
+            if not post_webhook_batch(state, batch):
+                record_webhook_failure(state)
+                break
+            record_webhook_delivery(state, batch[-1]["id"], len(batch))
+            os.remove(spooled.pop(0))
+        
+        # New batches go out only behind an empty spool, to keep id order
+        while batches and not spooled:
+            if not post_webhook_batch(state, batches[0]):
+                record_webhook_failure(state)
+                break
+            record_webhook_delivery(state, batches[0][-1]["id"], len(batches[0]))
+            batches.pop(0)
+    
+    for batch in batches:
+        spool_webhook_batch(state["id"], batch)
+
+def webhook_forwarder_worker():
+    while True:
+        with _webhooks_cond:
+            _webhooks_cond.wait(timeout=WEBHOOK_BATCH_INTERVAL)
+            work = []
+            for state in _webhooks.values():
+                work.append((state, state["queue"]))
+                state["queue"] = []
+        
+        for state, rows in work:
+            try:
+                with use_tenant(state["tenant"]):
+                    flush_webhook(state, rows)
+            except Exception as e:
+                logger.error(f"[Webhook] Forwarding to {state['name']} failed: {e}", exc_info=True)
+
+def read_attendance_after(after_id: int, limit: int):
+    """Up to limit attendance rows with ids above after_id, in id order, across every shard"""
+    shard_rows = []
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        cursor = conn.execute(f'''
+            SELECT {", ".join(WEBHOOK_FIELDS)} FROM attendance_logs WHERE id > ? ORDER BY id LIMIT ?
+        ''', (after_id, limit))
+        shard_rows.append([dict(zip(WEBHOOK_FIELDS, row)) for row in cursor.fetchall()])
+        conn.close()
+    merged = heapq.merge(*shard_rows, key=lambda row: row["id"])
+    return [row for _, row in zip(range(limit), merged)]
+
+def catch_up_webhook(state):
+    """Spool rows past the cursor that were neither delivered nor spooled before a restart"""
+    spooled = webhook_spool_files(state["id"])
+    if spooled:
+        with open(spooled[-1]) as f:
+            state["enqueued_through"] = max(state["cursor"], json.load(f)[-1]["id"])
+    
+    while True:
+        rows = read_attendance_after(state["enqueued_through"], WEBHOOK_BATCH_SIZE)
+        if not rows:
+            break
+        spool_webhook_batch(state["id"], rows)
+        state["enqueued_through"] = rows[-1]["id"]
+        logger.info(f"[Webhook] Spooled {len(rows)} undelivered records for {state['name']}")
+
+def load_webhooks() -> int:
+    conn = connect_db()
+    try:
+        subscribers = conn.execute('SELECT id, name, url, cursor FROM webhook_subscribers WHERE enabled = 1').fetchall()
+        for subscriber_id, name, url, cursor in subscribers:
+            state = webhook_state(subscriber_id, name, url, cursor)
+            catch_up_webhook(state)
+            with _webhooks_cond:
+                _webhooks[state["tenant"], subscriber_id] = state
+    finally:
+        conn.close()
+    return len(subscribers)
+
+def add_webhook(name: str, url: str):
+    """Register a subscriber that receives rows committed from now on"""
+    conn = connect_db()
+    try:
+        # Registered under the lock so no row committed after MAX(id) is read can be missed
+        with _webhooks_cond:
+            start_id = attendance_watermark(conn)
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO webhook_subscribers (name, url, cursor) VALUES (?, ?, ?)
+            ''', (name, url, start_id))
+            conn.commit()
+            state = webhook_state(cursor.lastrowid, name, url, start_id)
+            _webhooks[state["tenant"], state["id"]] = state
+    finally:
+        conn.close()
+    return state
+
+def remove_webhook(subscriber_id: int) -> bool:
+    with _webhooks_cond:
+        _webhooks.pop((current_tenant(), subscriber_id), None)
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('DELETE FROM webhook_subscribers WHERE id = ?', (subscriber_id,))
+    deleted = cursor.rowcount
+    conn.commit()
+    conn.close()
+    for file_path in webhook_spool_files(subscriber_id):
+        os.remove(file_path)
+    return deleted > 0
+
+@app.on_event("startup")
+async def start_webhook_forwarder():
+    count = 0
+    for tenant in all_tenants():
+        with use_tenant(tenant):
+            count += load_webhooks()
+    threading.Thread(target=webhook_forwarder_worker, name="webhook-forwarder", daemon=True).start()
+    if count:
+        logger.info(f"[Webhook] Forwarding attendance to {count} subscriber(s)")
+
+# Report engine
+# Reports load the punches of a date range as columns (dictionary-encoded user ids,
+# epoch seconds) and compute per user-day first/last punches with one sort and
+# segment reductions, instead of looping over sqlite rows in Python.
+REPORT_TIMESTAMP_GLOB = "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]*"
+REPORT_WEEKEND_DAYS = os.environ.get("ADMS_WEEKEND_DAYS", "4")  # Python weekday numbers; 4 = Friday
+SECONDS_PER_DAY = 86400
+REPORT_FETCH_SIZE = 50000  # punches converted to arrays at a time
+REPORT_DURATION_COLUMNS = {"hours_worked", "late_minutes"}  # everything else is a count
+
+def report_value(column: str, value):
+    return round(float(value), 2) if column in REPORT_DURATION_COLUMNS else int(round(float(value)))
+
+def parse_report_date(value: str, name: str) -> datetime.date:
+    try:
+        return datetime.datetime.strptime(value, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be a date in YYYY-MM-DD format")
+
+def timestamps_to_epoch(timestamps):
+    """Vectorized 'YYYY-MM-DD HH:MM:SS' -> epoch seconds (the naive local time read as UTC)"""
+    digits = np.array(timestamps, dtype="S19").view(np.uint8).reshape(-1, 19).astype(np.int64) - 48
+    years = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    months = digits[:, 5] * 10 + digits[:, 6]
+    days = digits[:, 8] * 10 + digits[:, 9]
+    epoch_days = (
+        ((years - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (months - 1))
+        .astype("datetime64[D]").astype(np.int64) + days - 1
+    )
+    seconds = (digits[:, 11] * 10 + digits[:, 12]) * 3600 + (digits[:, 14] * 10 + digits[:, 15]) * 60 \
+        + digits[:, 17] * 10 + digits[:, 18]
+    return epoch_days * SECONDS_PER_DAY + seconds
+
+def fetch_punch_rows(conn, lower: str, upper: str):
+    """Yield blocks of (user_id, timestamp) for the punches in [lower, upper) in one attendance database, hot and archived"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT user_id, timestamp FROM attendance_logs
+        WHERE timestamp >= ? AND timestamp < ? AND timestamp GLOB ?
+    ''', (lower, upper, REPORT_TIMESTAMP_GLOB))
+    while True:
+        rows = cursor.fetchmany(REPORT_FETCH_SIZE)
+        if not rows:
+            break
+        yield rows
+    
+    for month, file_path, _, first_timestamp, last_timestamp, _ in get_archive_partitions(conn):
+        if (last_timestamp or "") < lower or (first_timestamp or "") >= upper or not os.path.exists(file_path):
+            continue
+        rows = (
+            (row["user_id"], row["timestamp"]) for row in read_archive_rows(file_path)
+            if lower <= row["timestamp"] < upper and fnmatch.fnmatchcase(row["timestamp"], REPORT_TIMESTAMP_GLOB)
+        )
+        while True:
+            block = list(itertools.islice(rows, REPORT_FETCH_SIZE))
+            if not block:
+                break
+            yield block
+
+def load_punch_columns(start: datetime.date, end: datetime.date):
+    """Load user ids and timestamps of the punches from start to end (inclusive), across every shard"""
+    lower, upper = start.isoformat(), (end + datetime.timedelta(days=1)).isoformat()
+    # Each block is turned into arrays right away, so only the arrays grow with the range
+    # Factorize user ids through a dict; np.unique on object arrays sorts Python strings
+    codes = {}
+    code_blocks, epoch_blocks = [], []
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        try:
+            for rows in fetch_punch_rows(conn, lower, upper):
+                user_ids, timestamps = zip(*rows)
+                code_blocks.append(np.fromiter((codes.setdefault(user_id, len(codes)) for user_id in user_ids),
+                                               dtype=np.int64, count=len(user_ids)))
+                epoch_blocks.append(timestamps_to_epoch(timestamps))
+        finally:
+            conn.close()
+    
+    if not code_blocks:
+        return np.array([], dtype=object), np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    
+    user_index = np.empty(len(codes), dtype=object)
+    user_index[:] = list(codes)
+    return user_index, np.concatenate(code_blocks), np.concatenate(epoch_blocks)
+
+def user_day_segments(user_codes, epochs):
+    """Collapse punches into one segment per user per day: (user code, day, first, last, punches)"""
+    days = epochs // SECONDS_PER_DAY
+    order = np.lexsort((epochs, days, user_codes))
+    user_codes, days, epochs = user_codes[order], days[order], epochs[order]
+    
+    boundaries = np.flatnonzero((np.diff(user_codes) != 0) | (np.diff(days) != 0)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(epochs)]))
+    return user_codes[starts], days[starts], epochs[starts], epochs[ends - 1], ends - starts
+
+def load_user_groups(conn, user_ids):
+    """Map user ids to their department (group) from the users table"""
+    groups = {}
+    user_ids = list(user_ids)
+    cursor = conn.cursor()
+    for start in range(0, len(user_ids), SQLITE_MAX_VARIABLES):
+        batch = user_ids[start:start + SQLITE_MAX_VARIABLES]
+        placeholders = ','.join('?' * len(batch))
+        cursor.execute(f'SELECT user_id, group_id, name FROM users WHERE user_id IN ({placeholders})', batch)
+        for user_id, group_id, name in cursor.fetchall():
+            groups[user_id] = (group_id, name)
+    return groups
+
+def summarize_by_department(user_index, groups, columns):
+    """Sum per-user columns into per-department totals; columns maps name -> per-user array"""
+    departments = np.array([groups.get(user_id, (None, None))[0] or "" for user_id in user_index], dtype=object)
+    department_index, department_codes = np.unique(departments, return_inverse=True)
+    result = []
+    totals = {name: np.bincount(department_codes, weights=values, minlength=len(department_index))
+              for name, values in columns.items()}
+    headcount = np.bincount(department_codes, minlength=len(department_index))
+    for i, department in enumerate(department_index):
+        entry = {"group_id": department or None, "users": int(headcount[i])}
+        for name in columns:
+            entry[name] = report_value(name, totals[name][i])
+        result.append(entry)
+    return result
+
+def build_report(kind: str, start: datetime.date, end: datetime.date, shift_start: str = "08:00",
+                 grace_minutes: int = 0, weekend_days: str = REPORT_WEEKEND_DAYS):
+    """Compute an hours, late or absences report over the punches from start to end"""
+    started = time.perf_counter()
+    conn = connect_db()
+    try:
+        user_index, user_codes, epochs = load_punch_columns(start, end)
+        if kind == "absences":
+            # Everybody known to the terminals is expected, not only users who punched
+            known_users = [row[0] for row in conn.execute('SELECT user_id FROM users').fetchall()]
+            if known_users:
+                all_users = np.union1d(user_index, np.array(known_users, dtype=object))
+                # Re-point the punch codes at the widened (sorted) user index
+                user_codes = np.searchsorted(all_users, user_index)[user_codes] if len(user_codes) else user_codes
+                user_index = all_users
+        groups = load_user_groups(conn, user_index)
+    finally:
+        conn.close()
+    
+    rows_processed = len(epochs)
+    num_users = len(user_index)
+    if rows_processed:
+        seg_users, seg_days, seg_first, seg_last, seg_punches = user_day_segments(user_codes, epochs)
+    else:
+        seg_users = seg_days = seg_first = seg_last = seg_punches = np.array([], dtype=np.int64)
+    days_present = np.bincount(seg_users, minlength=num_users)
+    
+    if kind == "hours":
+        hours = (seg_last - seg_first) / 3600.0
+        per_user = {"days_present": days_present, "hours_worked": np.bincount(seg_users, weights=hours, minlength=num_users)}
+    elif kind == "late":
+        shift = datetime.datetime.strptime(shift_start, "%H:%M")
+        threshold = shift.hour * 3600 + shift.minute * 60 + grace_minutes * 60
+        late_seconds = np.maximum(seg_first % SECONDS_PER_DAY - threshold, 0)
+        is_late = late_seconds > 0
+        per_user = {
+            "days_present": days_present,
+            "late_days": np.bincount(seg_users, weights=is_late, minlength=num_users),
+            "late_minutes": np.bincount(seg_users, weights=late_seconds / 60.0, minlength=num_users)
+        }
+    elif kind == "absences":
+        weekend = {int(day) for day in weekend_days.split(",") if day.strip() != ""}
+        weekmask = [0 if day in weekend else 1 for day in range(7)]
+        expected = int(np.busday_count(start, end + datetime.timedelta(days=1), weekmask=weekmask))
+        # Python weekday of an epoch day: 1970-01-01 was a Thursday (3)
+        on_workday = np.array(weekmask, dtype=bool)[(seg_days + 3) % 7]
+        worked = np.bincount(seg_users[on_workday], minlength=num_users)
+        per_user = {
+            "days_present": days_present,
+            "expected_days": np.full(num_users, expected),
+            "absent_days": np.maximum(expected - worked, 0)
+        }
+    else:
+        raise ValueError(f"Unknown report: {kind}")
+    
+    users = []
+    for i, user_id in enumerate(user_index):
+        group_id, name = groups.get(user_id, (None, None))
+        entry = {"user_id": user_id, "user_name": name, "group_id": group_id}
+        for column, values in per_user.items():
+            entry[column] = report_value(column, values[i])
+        users.append(entry)
+    users.sort(key=lambda entry: entry["user_id"])
+    
+    return {
+        "report": kind,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "rows_processed": rows_processed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+        "departments": summarize_by_department(user_index, groups, per_user),
+        "users": users
+    }
+
+# Static assets
+# The dashboard is read and compressed once, then served from memory with a strong
+# ETag per encoding. The file is stat()ed at most once per STATIC_ASSET_CHECK_INTERVAL
+# and reloaded only when its size or mtime changes.
+DASHBOARD_FILE = "dashboard.html"
+DASHBOARD_MAX_AGE = int(os.environ.get("ADMS_DASHBOARD_MAX_AGE", "3600"))  # seconds
+STATIC_ASSET_CHECK_INTERVAL = 1.0  # seconds
+
+_static_assets = {}
+_static_assets_lock = threading.Lock()
+
+def load_static_asset(file_path: str, media_type: str):
+    """Read a file and build its identity, gzip and (when available) brotli variants"""
+    stat = os.stat(file_path)
+    with open(file_path, "rb") as f:
+        content = f.read()
+    
+    digest = hashlib.sha256(content).hexdigest()[:16]
+    variants = {"identity": content, "gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(content, quality=11)
+    
+    logger.info(f"[Static] Loaded {file_path}: {len(content)} bytes, " +
+                ", ".join(f"{encoding} {len(body)}" for encoding, body in variants.items() if encoding != "identity"))
+    return {
+        "media_type": media_type,
+        "signature": (stat.st_mtime_ns, stat.st_size),
+        "checked_at": time.monotonic(),
+        "variants": {
+            encoding: (body, f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"')
+            for encoding, body in variants.items()
+        }
+    }
+
+def get_static_asset(file_path: str, media_type: str):
+    with _static_assets_lock:
+        asset = _static_assets.get(file_path)
+        now = time.monotonic()
+        if asset is not None and now - asset["checked_at"] < STATIC_ASSET_CHECK_INTERVAL:
+            return asset
+        
+        stat = os.stat(file_path)
+        if asset is None or asset["signature"] != (stat.st_mtime_ns, stat.st_size):
+            asset = load_static_asset(file_path, media_type)
+            _static_assets[file_path] = asset
+        asset["checked_at"] = now
+        return asset
+
+def choose_content_encoding(accept_encoding: Optional[str], available) -> str:
+    """Pick br, then gzip, from an Accept-Encoding header; identity otherwise"""
+    accepted = set()
+    for token in (accept_encoding or "").split(","):
+        coding, _, params = token.strip().partition(";")
+        if params.replace(" ", "").lower() in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip().lower())
+    for encoding in ("br", "gzip"):
+        if encoding in available and (encoding in accepted or "*" in accepted):
+            return encoding
+    return "identity"
+
+def static_asset_response(request: Request, file_path: str, media_type: str, max_age: int) -> Response:
+    asset = get_static_asset(file_path, media_type)
+    encoding = choose_content_encoding(request.headers.get("accept-encoding"), asset["variants"])
+    body, etag = asset["variants"][encoding]
+    
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}", "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=asset["media_type"], headers=headers)
+
+@app.on_event("startup")
+async def load_dashboard():
+    if os.path.exists(DASHBOARD_FILE):
+        get_static_asset(DASHBOARD_FILE, "text/html; charset=utf-8")
+
+# Admission control
+# Device polling is paced from the server side through the ADMS options sent with
+# GET OPTION: Delay (seconds between polls), ErrorDelay (retry after a failed
+# connection), TransInterval/TransTimes (when buffered records are uploaded).
+# Load is sampled from event-loop lag, device requests in progress (each one holds
+# a SQLite connection) and device requests/sec; under pressure every interval is
+# stretched, and each device gets a stable offset so a fleet reconnecting at once
+# spreads out instead of returning in lockstep.
+POLL_DELAY = int(os.environ.get("ADMS_POLL_DELAY", "10"))  # seconds
+POLL_ERROR_DELAY = int(os.environ.get("ADMS_ERROR_DELAY", "30"))  # seconds
+TRANS_INTERVAL = int(os.environ.get("ADMS_TRANS_INTERVAL", "1"))  # minutes
+TRANS_TIMES = os.environ.get("ADMS_TRANS_TIMES", "00:00;14:05")
+TRANS_TIMES_STAGGER = int(os.environ.get("ADMS_TRANS_TIMES_STAGGER", "30"))  # minutes
+POLL_STAGGER = float(os.environ.get("ADMS_POLL_STAGGER", "0.5"))  # fraction of Delay
+MAX_POLL_BACKOFF = float(os.environ.get("ADMS_MAX_POLL_BACKOFF", "8"))  # largest interval multiplier
+
+# Load at which the intervals start to stretch (pressure 1.0)
+TARGET_LOOP_LAG = float(os.environ.get("ADMS_TARGET_LOOP_LAG", "0.1"))  # seconds
+TARGET_DEVICE_INFLIGHT = int(os.environ.get("ADMS_TARGET_DEVICE_INFLIGHT", "32"))
+TARGET_DEVICE_RPS = float(os.environ.get("ADMS_TARGET_DEVICE_RPS", "200"))
+
+LOAD_SAMPLE_INTERVAL = 0.5  # seconds
+LOAD_SMOOTHING = 0.3  # EWMA weight of the newest sample
+
+_load_stats = {
+    "loop_lag": 0.0, "device_inflight": 0.0, "device_rps": 0.0, "pressure": 0.0, "backoff": 1.0,
+    "inflight_now": 0, "requests_total": 0
+}
+_load_stats_lock = threading.Lock()
+
+def begin_device_request():
+    with _load_stats_lock:
+        _load_stats["inflight_now"] += 1
+        _load_stats["requests_total"] += 1
+
+def end_device_request():
+    with _load_stats_lock:
+        _load_stats["inflight_now"] -= 1
+
+def suspend_device_request():
+    """A device request that is parked (a held poll) no longer counts as in progress"""
+    with _load_stats_lock:
+        _load_stats["inflight_now"] -= 1
+
+def resume_device_request():
+    with _load_stats_lock:
+        _load_stats["inflight_now"] += 1
+
+def poll_backoff(pressure: float) -> float:
+    """Interval multiplier for a load pressure, in half steps so options do not flap"""
+    return min(max(1.0, round(pressure * 2) / 2), MAX_POLL_BACKOFF)
+
+def record_load_sample(loop_lag: float, elapsed: float, requests_total: int, last_requests_total: int):
+    with _load_stats_lock:
+        samples = {
+            "loop_lag": loop_lag,
+            "device_inflight": _load_stats["inflight_now"],
+            "device_rps": (requests_total - last_requests_total) / elapsed if elapsed > 0 else 0.0
+        }
+        for key, value in samples.items():
+            _load_stats[key] += LOAD_SMOOTHING * (value - _load_stats[key])
+        _load_stats["pressure"] = max(
+            _load_stats["loop_lag"] / TARGET_LOOP_LAG,
+            _load_stats["device_inflight"] / TARGET_DEVICE_INFLIGHT,
+            _load_stats["device_rps"] / TARGET_DEVICE_RPS
+        )
+        _load_stats["backoff"] = poll_backoff(_load_stats["pressure"])
+
+async def load_monitor():
+    """Sample event-loop lag and device request rate every LOAD_SAMPLE_INTERVAL"""
+    loop = asyncio.get_running_loop()
+    last_sample = loop.time()
+    last_requests_total = 0
+    while True:
+        await asyncio.sleep(LOAD_SAMPLE_INTERVAL)
+        now = loop.time()
+        # How late the loop woke us up is how long a device request waits to be picked up
+        loop_lag = max(0.0, now - last_sample - LOAD_SAMPLE_INTERVAL)
+        with _load_stats_lock:
+            requests_total = _load_stats["requests_total"]
+        record_load_sample(loop_lag, now - last_sample, requests_total, last_requests_total)
+        last_sample, last_requests_total = now, requests_total
+
+def get_load_stats():
+    with _load_stats_lock:
+        return dict(_load_stats)
+
+def device_stagger(sn: str) -> float:
+    """Stable per-device offset in [0, 1)"""
+    return int.from_bytes(hashlib.sha1(sn.encode()).digest()[:4], "big") / 2 ** 32
+
+def stagger_trans_times(trans_times: str, offset_minutes: int) -> str:
+    staggered = []
+    for entry in trans_times.split(";"):
+        try:
+            moment = datetime.datetime.strptime(entry.strip(), "%H:%M")
+        except ValueError:
+            continue
+        staggered.append((moment + datetime.timedelta(minutes=offset_minutes)).strftime("%H:%M"))
+    return ";".join(staggered)
+
+def admission_options(sn: str) -> str:
+    """ADMS option lines pacing this device at the current load"""
+    backoff = get_load_stats()["backoff"]
+    stagger = device_stagger(sn)
+    
+    delay = max(1, round(POLL_DELAY * backoff * (1 + POLL_STAGGER * stagger)))
+    # Reconnects after an outage are spread over a full extra ErrorDelay
+    error_delay = max(1, round(POLL_ERROR_DELAY * backoff * (1 + stagger)))
+    trans_interval = max(1, round(TRANS_INTERVAL * backoff))
+    trans_times = stagger_trans_times(TRANS_TIMES, int(TRANS_TIMES_STAGGER * stagger))
+    
+    return (f"ErrorDelay={error_delay}\nDelay={delay}\n"
+            f"TransTimes={trans_times}\nTransInterval={trans_interval}\n")
+
+@app.on_event("startup")
+async def start_load_monitor():
+    app.state.load_monitor = asyncio.get_running_loop().create_task(load_monitor())
+
+# Long-poll command delivery
+# With ADMS_LONG_POLL_TIMEOUT > 0 a getrequest that finds no queued command is held
+# open for up to that many seconds on a per-device asyncio event, and answered as
+# soon as a command is queued for the device. A held poll has no SQLite connection
+# and is not counted as a device request in progress. Past LONG_POLL_MAX_HELD held
+# polls, further polls are answered at once as before.
+LONG_POLL_TIMEOUT = float(os.environ.get("ADMS_LONG_POLL_TIMEOUT", "0"))  # seconds, 0 disables holding
+LONG_POLL_MAX_HELD = int(os.environ.get("ADMS_LONG_POLL_MAX_HELD", "10000"))
+
+# (tenant, sn) -> [event, polls watching]; only touched on the event loop
+_command_waiters = {}
+_command_waiters_loop = None
+_long_poll_stats = {"held": 0, "woken": 0, "timed_out": 0}
+
+def watch_device_commands(sn: str):
+    """Start watching for commands queued for sn; call before reading the queue so none is missed"""
+    global _command_waiters_loop
+    if LONG_POLL_TIMEOUT <= 0 or _long_poll_stats["held"] >= LONG_POLL_MAX_HELD:
+        return None
+    _command_waiters_loop = asyncio.get_running_loop()
+    key = (current_tenant(), sn)
+    waiter = _command_waiters.get(key)
+    if waiter is None:
+        waiter = _command_waiters[key] = [asyncio.Event(), 0]
+    waiter[1] += 1
+    return key
+
+def unwatch_device_commands(key):
+    if key is None:
+        return
+    waiter = _command_waiters[key]
+    waiter[1] -= 1
+    if not waiter[1]:
+        del _command_waiters[key]
+
+async def wait_for_device_commands(key, timeout: float) -> bool:
+    """Hold the poll until a command is queued for the watched device; False on timeout"""
+    event = _command_waiters[key][0]
+    _long_poll_stats["held"] += 1
+    suspend_device_request()
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        _long_poll_stats["woken"] += 1
+        return True
+    except asyncio.TimeoutError:
+        _long_poll_stats["timed_out"] += 1
+        return False
+    finally:
+        resume_device_request()
+        _long_poll_stats["held"] -= 1
+
+def _wake_device(key):
+    waiter = _command_waiters.get(key)
+    if waiter is not None:
+        waiter[0].set()
+
+def notify_commands_queued(sn: str):
+    """Answer the held polls of a device that just got a command; safe from any thread"""
+    key = (current_tenant(), sn)
+    loop = _command_waiters_loop
+    if loop is None or key not in _command_waiters:
+        return
+    try:
+        on_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        on_loop = False
+    if on_loop:
+        _wake_device(key)
+    else:
+        loop.call_soon_threadsafe(_wake_device, key)
+
+def get_long_poll_stats():
+    return dict(_long_poll_stats, devices=len(_command_waiters))
+
+class ConditionalGetMiddleware:
+    """Answer If-None-Match from the in-memory resource versions, before any database work"""
     
-    # Log all incoming requests
-    logger.info(f"[Request] {request.method} {request.url} from {request.client.host}")
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        resources = CONDITIONAL_GET_RESOURCES.get(scope["path"]) if scope["type"] == "http" else None
+        if resources is None or scope["method"] != "GET":
+            await self.app(scope, receive, send)
+            return
+        
+        # Taken before the handler runs: a write racing the read only makes the ETag older
+        request = Request(scope)
+        etag = resource_etag(resources, request.url.query)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            await Response(status_code=304, headers=headers)(scope, receive, send)
+            return
+        
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = MutableHeaders(scope=message)
+                response_headers.update(headers)
+            await send(message)
+        
+        await self.app(scope, receive, send_with_etag)
+
+app.add_middleware(ConditionalGetMiddleware)
+
+class ApiGZipMiddleware:
+    """gzip large /api responses; device (/iclock) traffic and blob downloads are left alone"""
     
-    response = await call_next(request)
-    process_time = time.time() - start_time
+    def __init__(self, app, minimum_size: int = API_GZIP_MIN_SIZE):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
     
-    logger.info(f"[Response] {request.method} {request.url.path} - Status: {response.status_code} - Time: {process_time:.4f}s")
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "") if scope["type"] == "http" else ""
+        if path.startswith("/api/") and not path.startswith("/api/blobs/"):
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+app.add_middleware(ApiGZipMiddleware, minimum_size=API_GZIP_MIN_SIZE)
+
+# Add middleware to log all requests
+class RequestLoggingMiddleware:
+    def __init__(self, app):
+        self.app = app
     
-    return response
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        start_time = time.time()
+        request = Request(scope)
+        
+        # Log all incoming requests
+        logger.info(f"[Request] {request.method} {request.url} from {request.client.host}")
+        
+        status = []
+        
+        async def send_and_record(message):
+            if message["type"] == "http.response.start":
+                status.append(message["status"])
+            await send(message)
+        
+        await self.app(scope, receive, send_and_record)
+        process_time = time.time() - start_time
+        
+        logger.info(f"[Response] {request.method} {request.url.path} - Status: {status[0] if status else None} - Time: {process_time:.4f}s")
+
+app.add_middleware(RequestLoggingMiddleware)
 
 # ADMS Endpoints
+# Most device replies are plain text with the same two headers; DeviceTextResponse
+# builds its header list from these pre-encoded pairs instead of a headers dict, so
+# the /iclock fast path can hand it to the ASGI send as is.
+_DEVICE_TEXT_HEADERS = ((b"content-type", b"text/plain; charset=utf-8"), (b"cache-control", b"no-store"))
+
+class DeviceTextResponse(Response):
+    """A PlainTextResponse with the device headers (and the Stamp header when given), without header rendering"""
+    
+    media_type = "text/plain"
+    
+    def __init__(self, content: str, stamp: Optional[int] = None):
+        self.status_code = 200
+        self.background = None
+        self.body = content.encode("utf-8")
+        self.raw_headers = [*_DEVICE_TEXT_HEADERS, (b"content-length", str(len(self.body)).encode("latin-1"))]
+        if stamp is not None:
+            self.raw_headers.append((b"stamp", str(stamp).encode("latin-1")))
+
 @app.get("/iclock/getrequest", response_class=PlainTextResponse)
 async def get_request(request: Request):
     sn = request.query_params.get("SN")
@@ -340,8 +3866,14 @@ async def get_request(request: Request):
     # Register or update device
     register_or_update_device(sn, ip)
     
-    # Get pending commands
-    commands = get_pending_commands(sn)
+    # Get pending commands; with long polling, wait for one if there is none yet
+    watched = watch_device_commands(sn)
+    try:
+        commands = get_pending_commands(sn)
+        if not commands and watched is not None and await wait_for_device_commands(watched, LONG_POLL_TIMEOUT):
+            commands = get_pending_commands(sn)
+    finally:
+        unwatch_device_commands(watched)
     
     if commands:
         # Format commands with proper ZKTeco ADMS protocol format: C:{id}:{command}
@@ -352,20 +3884,15 @@ async def get_request(request: Request):
         synctime_command_id = None
         other_commands = []
         
-        for command_id, command in commands:
-            # Check if this is a time sync command (timestamp only, no prefix)
+        for command_id, command, command_type in commands:
             # Time sync commands are stored as just the timestamp: "2025-11-02 11:27:30"
-            if command.strip() and ' ' in command.strip() and ':' in command.strip():
-                # Check if it looks like a timestamp (YYYY-MM-DD HH:MM:SS format)
-                parts = command.strip().split()
-                if len(parts) == 2 and len(parts[0]) == 10 and '-' in parts[0]:
-                    # This is a time sync command
-                    has_synctime = True
-                    synctime_value = command.strip()
-                    synctime_command_id = command_id
-                    command_ids.append(command_id)
-                    logger.info(f"[GetRequest] Detected time sync command: {synctime_value}")
-                    continue
+            if command_type == COMMAND_TYPE_SYNCTIME:
+                has_synctime = True
+                synctime_value = command.strip()
+                synctime_command_id = command_id
+                command_ids.append(command_id)
+                logger.info(f"[GetRequest] Detected time sync command: {synctime_value}")
+                continue
             
             # Store other commands
             other_commands.append((command_id, command))
@@ -376,9 +3903,7 @@ async def get_request(request: Request):
         if has_synctime and synctime_value and synctime_command_id is not None:
             # Convert the datetime string to unix timestamp
             try:
-                from datetime import datetime
-                dt = datetime.strptime(synctime_value, "%Y-%m-%d %H:%M:%S")
-                unix_timestamp = int(dt.timestamp())
+                unix_timestamp = parse_synctime_command(synctime_value)
                 
                 # Just respond with OK and the Stamp header
                 # The device will read the timestamp from the Stamp header
@@ -395,19 +3920,8 @@ async def get_request(request: Request):
                 if other_commands:
                     logger.info(f"[GetRequest] {len(other_commands)} other commands will be sent in next poll")
                 
-                # Prepare response headers with time information
                 # The device reads time from the Stamp header in the response
-                response_headers = {
-                    "Content-Type": "text/plain; charset=utf-8",
-                    "Cache-Control": "no-store",
-                    "Stamp": str(unix_timestamp)
-                }
-                
-                # Return plain text with proper content-type header and charset
-                return PlainTextResponse(
-                    response_text, 
-                    headers=response_headers
-                )
+                return DeviceTextResponse(response_text, stamp=unix_timestamp)
             except Exception as e:
                 logger.error(f"[GetRequest] Error converting time sync timestamp: {e}")
                 # Fall through to send other commands
@@ -415,16 +3929,9 @@ async def get_request(request: Request):
         
         # Send other commands in standard C: format
         if other_commands or not has_synctime:
-            for command_id, command in other_commands:
-                # Convert to uppercase and format according to ZKTeco standards with proper line endings
-                # Remove any existing C: prefix and whitespace
-                clean_command = command.upper().strip()
-                if clean_command.startswith("C:"):
-                    clean_command = clean_command[2:].strip()
-                
-                # Format as C:{id}:{command} per ZKTeco ADMS protocol
-                response_text += f"C:{command_id}:{clean_command}\r\n"
-                command_ids.append(command_id)
+            text, ids = format_device_commands(other_commands)
+            response_text += text
+            command_ids.extend(ids)
         
         # Clear commands from queue (only the ones we're sending)
         if command_ids:
@@ -435,17 +3942,8 @@ async def get_request(request: Request):
             logger.info(f"[GetRequest] Command content: {response_text.strip()}")
             logger.info(f"[GetRequest] Command IDs: {command_ids}")
             
-            # Prepare response headers
-            response_headers = {
-                "Content-Type": "text/plain; charset=utf-8",
-                "Cache-Control": "no-store"
-            }
-            
             # Return plain text with proper content-type header and charset
-            return PlainTextResponse(
-                response_text, 
-                headers=response_headers
-            )
+            return DeviceTextResponse(response_text)
         else:
             # No commands to send (shouldn't happen but just in case)
             logger.info(f"[GetRequest] No valid commands to send for device {sn} from {ip}")
@@ -460,15 +3958,10 @@ async def get_request(request: Request):
     
     # Enable realtime attendance reporting and include server timestamp
     # ZKTeco devices sync time using the Stamp parameter
-    response_text = f"GET OPTION FROM: Stamp={timestamp}\nRealtime=1\n"
+    # The pacing options tell the device how soon to poll again at the current load
+    response_text = f"GET OPTION FROM: Stamp={timestamp}\nRealtime=1\n" + admission_options(sn)
     
-    return PlainTextResponse(
-        response_text, 
-        headers={
-            "Content-Type": "text/plain; charset=utf-8",
-            "Cache-Control": "no-store"
-        }
-    )
+    return DeviceTextResponse(response_text)
 
 @app.get("/iclock/devicecmd", response_class=PlainTextResponse)
 @app.post("/iclock/devicecmd", response_class=PlainTextResponse)
@@ -484,14 +3977,16 @@ async def device_cmd(request: Request):
     # Log all query parameters and body for debugging
     logger.info(f"[DeviceCMD] Received request from {ip} with params: SN={sn}, CMD={cmd}, Response={response_param}, ID={cmd_id_param}, Method={request.method}")
     
-    # Try to read the request body for additional debugging
+    # Devices that executed several commands report every result as a line of the POST body
+    body_str = ""
     if request.method == "POST":
         try:
             body = await request.body()
             if body:
-                logger.info(f"[DeviceCMD] POST body: {body.decode('utf-8', errors='ignore')}")
-        except:
-            pass
+                body_str = body.decode('utf-8', errors='ignore')
+                logger.info(f"[DeviceCMD] POST body: {body_str}")
+        except Exception as e:
+            logger.warning(f"[DeviceCMD] Could not read POST body: {e}")
     
     if not sn:
         logger.warning("[DeviceCMD] SN parameter missing")
@@ -500,128 +3995,29 @@ async def device_cmd(request: Request):
     # Register or update device
     register_or_update_device(sn, ip)
     
-    # Update command status if ID is provided (this is the command acknowledgment from device)
-    if cmd_id_param:
-        try:
-            command_id = int(cmd_id_param)
-            
-            # Verify this command belongs to this device
-            conn = sqlite3.connect('adms.db')
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, command FROM device_commands 
-                WHERE id = ? AND device_sn = ?
-            ''', (command_id, sn))
-            
-            command_record = cursor.fetchone()
-            conn.close()
-            
-            if command_record:
-                # Update command status based on response
-                if response_param and response_param.upper() == "OK":
-                    update_command_status(command_id, "completed", response_param)
-                    logger.info(f"[DeviceCMD] Command ID {command_id} ({command_record[1]}) completed successfully on device {sn}")
-                else:
-                    update_command_status(command_id, "failed", response_param or "No response")
-                    logger.warning(f"[DeviceCMD] Command ID {command_id} ({command_record[1]}) failed on device {sn} with response: {response_param}")
-            else:
-                logger.warning(f"[DeviceCMD] Command ID {command_id} not found for device {sn}")
-        except ValueError:
-            logger.error(f"[DeviceCMD] Invalid command ID format: {cmd_id_param}")
-        except Exception as e:
-            logger.error(f"[DeviceCMD] Error updating command status: {e}", exc_info=True)
-    elif cmd:
-        # Fallback: Try to match by command text if ID is not provided
-        logger.info(f"[DeviceCMD] No ID provided, attempting to match by command text: {cmd}")
-        try:
-            # Find the command in the database by command text and device SN
-            conn = sqlite3.connect('adms.db')
-            cursor = conn.cursor()
-            
-            # Look for the most recent command with this text that was sent
-            cursor.execute('''
-                SELECT id, command FROM device_commands 
-                WHERE device_sn = ? AND status = 'sent'
-                ORDER BY created_at DESC
-                LIMIT 10
-            ''', (sn,))
-            
-            command_records = cursor.fetchall()
-            conn.close()
-            
-            matched_command = None
-            matched_command_id = None
-            
-            # Try to find an exact match first
-            for record in command_records:
-                record_id, record_command = record
-                # Normalize both commands for comparison
-                normalized_record = record_command.strip().upper()
-                normalized_cmd = cmd.strip().upper()
-                
-                # Handle different command formats
-                if normalized_record == normalized_cmd:
-                    matched_command = normalized_cmd
-                    matched_command_id = record_id
-                    break
-                # Also check if the command is contained in the record
-                elif normalized_cmd in normalized_record or normalized_record in normalized_cmd:
-                    matched_command = normalized_cmd
-                    matched_command_id = record_id
-                    break
-            
-            if matched_command and matched_command_id:
-                # Update command status based on response
-                if response_param and response_param.upper() == "OK":
-                    update_command_status(matched_command_id, "completed", response_param)
-                    logger.info(f"[DeviceCMD] Command {matched_command} completed successfully on device {sn}")
-                else:
-                    update_command_status(matched_command_id, "failed", response_param or "No response")
-                    logger.info(f"[DeviceCMD] Command {matched_command} failed on device {sn} with response: {response_param}")
-            else:
-                logger.warning(f"[DeviceCMD] No matching command found for device {sn} with command {cmd}")
-                # Log all recent commands for debugging
-                if command_records:
-                    recent_commands = [f"{record[0]}: {record[1]}" for record in command_records]
-                    logger.info(f"[DeviceCMD] Recent commands for device {sn}: {', '.join(recent_commands)}")
-                else:
-                    logger.info(f"[DeviceCMD] No recent commands found for device {sn}")
+    acks = parse_command_acks(body_str)
+    if cmd_id_param or cmd:
+        # Acknowledgement carried in the query string
+        acks.append({
+            "id": cmd_id_param,
+            "cmd": cmd,
+            "response": response_param,
+            "success": command_ack_succeeded(response_param)
+        })
+    
+    if acks:
+        try:
+            apply_command_acks(sn, acks)
         except Exception as e:
             logger.error(f"[DeviceCMD] Error updating command status: {e}", exc_info=True)
     else:
         logger.warning(f"[DeviceCMD] No command or ID specified in device response from {sn}")
     
     # CRITICAL: UFace 800 Plus reads time from Stamp header in responses
-    # Check if there's a pending time sync command for this device
-    timestamp = None
-    try:
-        conn = sqlite3.connect('adms.db')
-        cursor = conn.cursor()
-        # Look for any recent SYNCTIME command (stored as datetime string) for this device
-        # Check both completed and pending commands in last 60 seconds
-        cursor.execute('''
-            SELECT command FROM device_commands 
-            WHERE device_sn = ? 
-            AND command LIKE '____-__-__ __:__:__'
-            AND created_at >= datetime('now', '-60 seconds')
-            ORDER BY created_at DESC
-            LIMIT 1
-        ''', (sn,))
-        cmd_record = cursor.fetchone()
-        conn.close()
-        
-        if cmd_record and cmd_record[0]:
-            # Parse the datetime from the command
-            try:
-                from datetime import datetime
-                dt = datetime.strptime(cmd_record[0].strip(), "%Y-%m-%d %H:%M:%S")
-                timestamp = int(dt.timestamp())
-                logger.info(f"[DeviceCMD] Using time sync timestamp: {timestamp} ({cmd_record[0].strip()})")
-            except Exception as e:
-                logger.warning(f"[DeviceCMD] Failed to parse time sync command: {e}")
-    except Exception as e:
-        logger.error(f"[DeviceCMD] Error checking for time sync command: {e}")
+    # Use the pending time sync for this device, if one was queued recently
+    timestamp = get_pending_time_sync(sn)
+    if timestamp is not None:
+        logger.info(f"[DeviceCMD] Using time sync timestamp: {timestamp}")
     
     # Fallback to current Kabul time if no recent time sync command found
     if timestamp is None:
@@ -655,8 +4051,13 @@ async def receive_fdata(request: Request):
     # Register or update device
     register_or_update_device(sn, ip)
     
-    # Log the request
-    logger.info(f"[ZKTeco-FData] Device {sn} sent fingerprint data from {ip}")
+    # Store the template/photo payload in the blob store
+    table_name = (request.query_params.get("table") or "fdata").upper()
+    try:
+        await store_upload(request, sn, table_name)
+    except Exception as e:
+        logger.error(f"[ZKTeco-FData] Error storing data from device {sn}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to store upload")
     
     return PlainTextResponse("OK", headers={"Content-Type": "text/plain"})
 
@@ -689,18 +4090,7 @@ async def receive_data(request: Request):
         
         if commands:
             # Format commands with proper ZKTeco ADMS protocol format: C:{id}:{command}
-            response_text = ""
-            command_ids = []
-            for command_id, command in commands:
-                # Convert to uppercase and format according to ZKTeco standards with proper line endings
-                # Remove any existing C: prefix and whitespace
-                clean_command = command.upper().strip()
-                if clean_command.startswith("C:"):
-                    clean_command = clean_command[2:].strip()
-                
-                # Format as C:{id}:{command} per ZKTeco ADMS protocol
-                response_text += f"C:{command_id}:{clean_command}\r\n"
-                command_ids.append(command_id)
+            response_text, command_ids = format_device_commands(commands)
             
             # Clear commands from queue
             clear_commands_from_queue(sn, command_ids)
@@ -711,22 +4101,24 @@ async def receive_data(request: Request):
             logger.info(f"[CData-GET] Command IDs: {command_ids}")
             
             # Return plain text with proper content-type header and charset
-            return PlainTextResponse(
-                response_text, 
-                headers={
-                    "Content-Type": "text/plain; charset=utf-8",
-                    "Cache-Control": "no-store"
-                }
-            )
+            return DeviceTextResponse(response_text)
+        elif request.query_params.get("options") == "all":
+            # Handshake: hand out the pacing options (no Stamp, which would skip the device's backlog)
+            logger.info(f"[CData-GET] Sending options to device {sn} from {ip}")
+            return DeviceTextResponse(f"GET OPTION FROM: {sn}\n" + admission_options(sn) + "Realtime=1\n")
         else:
             logger.info(f"[CData-GET] No pending commands for device {sn} from {ip}")
-            return PlainTextResponse(
-                "OK", 
-                headers={
-                    "Content-Type": "text/plain; charset=utf-8",
-                    "Cache-Control": "no-store"
-                }
-            )
+            return DeviceTextResponse("OK")
+    
+    # Attendance photos are binary; stream them to the blob store instead of parsing them
+    table_name = (request.query_params.get("table") or "").upper()
+    if table_name == "ATTPHOTO":
+        try:
+            await store_upload(request, sn, table_name)
+        except Exception as e:
+            logger.error(f"[CData-ATTPHOTO] Error storing photo from device {sn}: {e}", exc_info=True)
+            raise HTTPException(status_code=500, detail="Failed to store upload")
+        return DeviceTextResponse("OK")
     
     # Parse attendance data if present (for POST requests)
     body = await request.body()
@@ -734,6 +4126,16 @@ async def receive_data(request: Request):
     
     logger.info(f"[CData-POST] Received data from device {sn}: {body_str[:200]}...")  # Log first 200 chars
     
+    # User records are synced into the users table instead of being parsed as attendance
+    if table_name in ("OPERLOG", "USERINFO") and not body_str.startswith("GET OPTION FROM:"):
+        users = [user for user in (parse_user_record(line) for line in body_str.split("\n")) if user]
+        try:
+            count = upsert_users(sn, users)
+            logger.info(f"[CData-{table_name}] Synced {count} users from device {sn}")
+        except Exception as e:
+            logger.error(f"[CData-{table_name}] Error syncing users from device {sn}: {e}", exc_info=True)
+        return DeviceTextResponse("OK")
+    
     if body_str.startswith("GET OPTION FROM:"):
         # This is an option request, not attendance data
         # Check for commands even in option requests
@@ -741,18 +4143,7 @@ async def receive_data(request: Request):
         
         if commands:
             # Format commands with proper ZKTeco ADMS protocol format: C:{id}:{command}
-            response_text = ""
-            command_ids = []
-            for command_id, command in commands:
-                # Convert to uppercase and format according to ZKTeco standards with proper line endings
-                # Remove any existing C: prefix and whitespace
-                clean_command = command.upper().strip()
-                if clean_command.startswith("C:"):
-                    clean_command = clean_command[2:].strip()
-                
-                # Format as C:{id}:{command} per ZKTeco ADMS protocol
-                response_text += f"C:{command_id}:{clean_command}\r\n"
-                command_ids.append(command_id)
+            response_text, command_ids = format_device_commands(commands)
             
             # Clear commands from queue
             clear_commands_from_queue(sn, command_ids)
@@ -763,122 +4154,50 @@ async def receive_data(request: Request):
             logger.info(f"[CData-OPTION] Command IDs: {command_ids}")
             
             # Return plain text with proper content-type header and charset
-            return PlainTextResponse(
-                response_text, 
-                headers={
-                    "Content-Type": "text/plain; charset=utf-8",
-                    "Cache-Control": "no-store"
-                }
-            )
+            return DeviceTextResponse(response_text)
         else:
             logger.info(f"[CData-OPTION] No pending commands for device {sn} from {ip}")
-            return PlainTextResponse(
-                "OK", 
-                headers={
-                    "Content-Type": "text/plain; charset=utf-8",
-                    "Cache-Control": "no-store"
-                }
-            )
+            return DeviceTextResponse("OK")
     
     # Process attendance logs
     # Handle both batch mode (with "TRANS RECORDS" header) and realtime mode (individual records)
     if body_str:
         lines = body_str.split("\n")
-        conn = sqlite3.connect('adms.db')
-        cursor = conn.cursor()
-        
-        records_processed = 0
+        records = []  # (user_id, timestamp, verify_mode, status)
         
         for line in lines:
             line = line.strip()
             if not line:  # Skip empty lines
                 continue
             
-            # Check if line starts with TRANS (batch mode with TRANS prefix)
-            if line.startswith("TRANS") and len(line.split("\t")) >= 5:
-                parts = line.split("\t")
-                try:
-                    # TRANS format: TRANS\tUSER_ID\tTIMESTAMP\tVERIFY_MODE\tSTATUS
-                    user_id = parts[1]
-                    timestamp = parts[2]
-                    verify_mode = int(parts[3])
-                    status = int(parts[4])
-                    
-                    # Insert attendance log (ignore duplicates based on unique constraint)
-                    cursor.execute('''
-                        INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status)
-                        VALUES (?, ?, ?, ?, ?)
-                    ''', (sn, user_id, timestamp, verify_mode, status))
-                    
-                    if cursor.rowcount > 0:
-                        records_processed += 1
-                        logger.info(f"[CData-ATTENDANCE] Recorded attendance: User {user_id} at {timestamp} from device {sn}")
-                    else:
-                        logger.debug(f"[CData-ATTENDANCE] Skipped duplicate: User {user_id} at {timestamp} from device {sn}")
-                except Exception as e:
-                    logger.error(f"[CData-ATTENDANCE] Error parsing TRANS record '{line}': {e}")
-            else:
-                # Try to parse as raw realtime data (tab or whitespace separated)
-                # Format: USER_ID\tTIMESTAMP\tVERIFY_MODE\tSTATUS\t...
-                # Split by both tabs and multiple spaces
-                parts = line.split()  # Split by any whitespace
-                
-                # Need at least USER_ID, TIMESTAMP, VERIFY_MODE, STATUS (4 fields minimum)
-                if len(parts) >= 4:
-                    try:
-                        user_id = parts[0]
-                        # Timestamp could be split into date and time (parts[1] and parts[2])
-                        if len(parts) >= 5 and ':' in parts[2]:
-                            # Format: USER_ID DATE TIME VERIFY_MODE STATUS ...
-                            timestamp = f"{parts[1]} {parts[2]}"
-                            verify_mode = int(parts[3])
-                            status = int(parts[4])
-                        else:
-                            # Format: USER_ID TIMESTAMP VERIFY_MODE STATUS ...
-                            timestamp = parts[1]
-                            verify_mode = int(parts[2])
-                            status = int(parts[3])
-                        
-                        # Insert attendance log (ignore duplicates based on unique constraint)
-                        cursor.execute('''
-                            INSERT OR IGNORE INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status)
-                            VALUES (?, ?, ?, ?, ?)
-                        ''', (sn, user_id, timestamp, verify_mode, status))
-                        
-                        if cursor.rowcount > 0:
-                            records_processed += 1
-                            logger.info(f"[CData-ATTENDANCE] Recorded realtime attendance: User {user_id} at {timestamp} from device {sn}")
-                        else:
-                            logger.debug(f"[CData-ATTENDANCE] Skipped duplicate realtime: User {user_id} at {timestamp} from device {sn}")
-                    except Exception as e:
-                        logger.error(f"[CData-ATTENDANCE] Error parsing realtime record '{line}': {e}")
-                        logger.error(f"[CData-ATTENDANCE] Parts: {parts}")
+            try:
+                record = parse_attendance_line(line)
+            except (ValueError, IndexError) as e:
+                kind = "TRANS" if line.startswith("TRANS") and len(line.split("\t")) >= 5 else "realtime"
+                logger.error(f"[CData-ATTENDANCE] Error parsing {kind} record '{line}': {e}")
+                if kind == "realtime":
+                    logger.error(f"[CData-ATTENDANCE] Parts: {line.split()}")
+                continue
+            if record:
+                records.append(record)
         
-        if records_processed > 0:
-            conn.commit()
-            logger.info(f"[CData-ATTENDANCE] Successfully processed {records_processed} attendance records from device {sn}")
+        if attendance_sharded():
+            # Shard writers lock only their own file; let uploads to different shards overlap
+            new_rows = await run_in_threadpool(store_attendance_records, sn, records)
         else:
-            logger.warning(f"[CData-ATTENDANCE] No valid attendance records found in data from device {sn}")
+            new_rows = store_attendance_records(sn, records)
         
-        conn.close()
+        if new_rows:
+            logger.info(f"[CData-ATTENDANCE] Successfully processed {len(new_rows)} attendance records from device {sn}")
+        else:
+            logger.warning(f"[CData-ATTENDANCE] No valid attendance records found in data from device {sn}")
     
     # After processing attendance, check for more commands to send
     commands = get_pending_commands(sn)
     
     if commands:
         # Format commands with proper ZKTeco ADMS protocol format: C:{id}:{command}
-        response_text = ""
-        command_ids = []
-        for command_id, command in commands:
-            # Convert to uppercase and format according to ZKTeco standards with proper line endings
-            # Remove any existing C: prefix and whitespace
-            clean_command = command.upper().strip()
-            if clean_command.startswith("C:"):
-                clean_command = clean_command[2:].strip()
-            
-            # Format as C:{id}:{command} per ZKTeco ADMS protocol
-            response_text += f"C:{command_id}:{clean_command}\r\n"
-            command_ids.append(command_id)
+        response_text, command_ids = format_device_commands(commands)
         
         # Clear commands from queue
         clear_commands_from_queue(sn, command_ids)
@@ -889,22 +4208,10 @@ async def receive_data(request: Request):
         logger.info(f"[CData-POST] Command IDs: {command_ids}")
         
         # Return plain text with proper content-type header and charset
-        return PlainTextResponse(
-            response_text, 
-            headers={
-                "Content-Type": "text/plain; charset=utf-8",
-                "Cache-Control": "no-store"
-            }
-        )
+        return DeviceTextResponse(response_text)
     else:
         logger.info(f"[CData-POST] No pending commands for device {sn} from {ip} after attendance processing")
-        return PlainTextResponse(
-            "OK", 
-            headers={
-                "Content-Type": "text/plain; charset=utf-8",
-                "Cache-Control": "no-store"
-            }
-        )
+        return DeviceTextResponse("OK")
 
 # Catch-all endpoint for any other iclock requests
 @app.api_route("/iclock/{path:path}", methods=["GET", "POST"], response_class=PlainTextResponse)
@@ -925,14 +4232,185 @@ async def catch_iclock_requests(request: Request, path: str):
     
     return PlainTextResponse("OK", headers={"Content-Type": "text/plain; charset=utf-8"})
 
+# /iclock fast path
+# Devices only ever hit a few fixed plain-text endpoints, thousands of times a minute.
+# This outermost middleware hands /iclock/* straight to the handlers above with a
+# minimal request object: no routing, CORS, logging/ETag/gzip middleware or
+# parameter solving. The handlers' responses go to the ASGI send with their raw
+# header lists (pre-encoded for DeviceTextResponse). /api/* and / keep the full FastAPI stack. ADMS_ICLOCK_FAST_PATH=0
+# routes devices through FastAPI as well (the device load counters run either way).
+ICLOCK_FAST_PATH = os.environ.get("ADMS_ICLOCK_FAST_PATH", "1") != "0"
+
+# path -> (handler, methods); anything else under /iclock/ goes to the catch-all
+ICLOCK_ROUTES = {
+    "/iclock/getrequest": (get_request, ("GET",)),
+    "/iclock/devicecmd": (device_cmd, ("GET", "POST")),
+    "/iclock/fdata": (receive_fdata, ("POST",)),
+    "/iclock/cdata": (receive_data, ("GET", "POST")),
+}
+ICLOCK_PREFIX = "/iclock/"
+
+_METHOD_NOT_ALLOWED_HEADERS = [(b"content-type", b"application/json"), (b"content-length", b"31")]
+_METHOD_NOT_ALLOWED_BODY = b'{"detail":"Method Not Allowed"}'
+
+class IclockRequest:
+    """The part of starlette's Request the /iclock handlers use, read straight from the ASGI scope"""
+    
+    __slots__ = ("method", "query_params", "client", "_receive", "_body")
+    
+    def __init__(self, scope, receive):
+        self.method = scope["method"]
+        # Starlette's own parsing, so a repeated key means the same through both stacks
+        self.query_params = QueryParams(scope["query_string"])
+        self.client = Address(*scope["client"]) if scope.get("client") else None
+        self._receive = receive
+        self._body = None
+    
+    async def stream(self):
+        if self._body is not None:
+            yield self._body
+            return
+        while True:
+            message = await self._receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunk = message.get("body", b"")
+            if chunk:
+                yield chunk
+            if not message.get("more_body", False):
+                return
+    
+    async def body(self) -> bytes:
+        if self._body is None:
+            self._body = b"".join([chunk async for chunk in self.stream()])
+        return self._body
+
+async def send_plain_response(send, response: Response):
+    await send({"type": "http.response.start", "status": response.status_code, "headers": response.raw_headers})
+    await send({"type": "http.response.body", "body": response.body})
+
+async def dispatch_iclock(scope, receive, send):
+    path = scope["path"]
+    request = IclockRequest(scope, receive)
+    route = ICLOCK_ROUTES.get(path)
+    try:
+        if route is not None and request.method in route[1]:
+            response = await route[0](request)
+        elif request.method in ("GET", "POST"):
+            response = await catch_iclock_requests(request, path[len(ICLOCK_PREFIX):])
+        else:
+            await send({"type": "http.response.start", "status": 405, "headers": _METHOD_NOT_ALLOWED_HEADERS})
+            await send({"type": "http.response.body", "body": _METHOD_NOT_ALLOWED_BODY})
+            return
+    except HTTPException as e:
+        response = JSONResponse({"detail": e.detail}, status_code=e.status_code, headers=e.headers)
+    await send_plain_response(send, response)
+
+class IclockFastPath:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(ICLOCK_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        
+        begin_device_request()
+        try:
+            if ICLOCK_FAST_PATH:
+                await dispatch_iclock(scope, receive, send)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            end_device_request()
+
+# Added after the others, so it runs before them
+app.add_middleware(IclockFastPath)
+
+class TenantRoutingMiddleware:
+    """Pick the tenant of a request from its /t/<name> prefix or its device's registration"""
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if not MULTI_TENANT or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        path = scope["path"]
+        tenant = DEFAULT_TENANT
+        if path.startswith(TENANT_URL_PREFIX):
+            tenant, _, rest = path[len(TENANT_URL_PREFIX):].partition("/")
+            if tenant not in _tenants:
+                await JSONResponse({"detail": "Tenant not found"}, status_code=404)(scope, receive, send)
+                return
+            # The rest of the stack routes on the path without the prefix
+            raw_path = scope.get("raw_path") or path.encode()
+            scope = dict(scope, path="/" + rest, raw_path=raw_path[len(TENANT_URL_PREFIX) + len(tenant):] or b"/")
+        elif path.startswith(ICLOCK_PREFIX) and _tenant_devices:
+            sn = urllib.parse.parse_qs(scope.get("query_string", b"").decode("latin-1")).get("SN")
+            tenant = tenant_for_device(sn[0] if sn else None)
+        
+        with use_tenant(tenant):
+            await self.app(scope, receive, send)
+
+# Outermost: every other middleware and handler runs with the tenant already chosen
+app.add_middleware(TenantRoutingMiddleware)
+
 # API Endpoints for Web UI
+def device_changes(since: str):
+    """Devices seen or gone offline after the since cursor (all devices if it cannot be continued)"""
+    generation, position = parse_delta_cursor("devices", since)
+    now = datetime.datetime.now()
+    offline_before = (now - datetime.timedelta(minutes=DEVICE_OFFLINE_MINUTES)).isoformat()
+    try:
+        previous = datetime.datetime.fromisoformat(position) if position else None
+    except ValueError:
+        previous = None
+    
+    conn = connect_db()
+    cursor = conn.cursor()
+    # Status is derived here instead of written back, so a dashboard read never takes the write lock
+    if previous is None:
+        cursor.execute('''
+            SELECT serial_number, ip_address, model, last_seen,
+                   CASE WHEN last_seen > ? THEN 'online' ELSE 'offline' END, firmware_version
+            FROM devices
+            ORDER BY last_seen DESC
+        ''', (offline_before,))
+    else:
+        # Seen since the last read, or online then and offline now
+        cursor.execute('''
+            SELECT serial_number, ip_address, model, last_seen,
+                   CASE WHEN last_seen > ? THEN 'online' ELSE 'offline' END, firmware_version
+            FROM devices
+            WHERE last_seen > ? OR (last_seen > ? AND last_seen <= ?)
+            ORDER BY last_seen DESC
+        ''', (offline_before, (previous - datetime.timedelta(seconds=DELTA_OVERLAP_SECONDS)).isoformat(),
+              (previous - datetime.timedelta(minutes=DEVICE_OFFLINE_MINUTES)).isoformat(), offline_before))
+    devices = cursor.fetchall()
+    conn.close()
+    
+    return {
+        "cursor": delta_cursor(generation, now.isoformat()),
+        "full": previous is None,
+        "devices": [
+            {"serial_number": device[0], "ip_address": device[1], "model": device[2],
+             "last_seen": device[3], "status": device[4], "firmware_version": device[5]}
+            for device in devices
+        ]
+    }
+
 @app.get("/api/devices")
-async def get_devices():
-    conn = sqlite3.connect('adms.db')
+async def get_devices(since: Optional[str] = None):
+    if since is not None:
+        return device_changes(since)
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Update device status based on last seen time (offline if not seen in last 5 minutes)
-    five_minutes_ago = datetime.datetime.now() - datetime.timedelta(minutes=5)
+    five_minutes_ago = datetime.datetime.now() - datetime.timedelta(minutes=DEVICE_OFFLINE_MINUTES)
     five_minutes_ago_str = five_minutes_ago.isoformat()
     
     cursor.execute('''
@@ -968,7 +4446,7 @@ async def get_devices():
 
 @app.post("/api/devices/{sn}/command")
 async def queue_command(sn: str, command_req: CommandRequest):
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Check if device exists
@@ -982,38 +4460,52 @@ async def queue_command(sn: str, command_req: CommandRequest):
     # Convert command to uppercase for proper ZKTeco format
     formatted_command = command_req.command.upper().strip()
     
+    command_type = COMMAND_TYPE_RAW
+    synctime_stamp = None
+    
     # Special handling for SYNCTIME command
     if formatted_command == "SYNCTIME":
+        command_type = COMMAND_TYPE_SYNCTIME
         # If datetime is provided, use it; otherwise use current Kabul time
         if command_req.datetime:
             # User provided a specific datetime
-            formatted_command = command_req.datetime
+            formatted_command = command_req.datetime.strip()
             logger.info(f"[Command] SYNCTIME command with user-specified time: {formatted_command}")
         else:
             # Use current Kabul time
             kabul_time = get_kabul_time()
             formatted_command = format_synctime_command(kabul_time)
             logger.info(f"[Command] SYNCTIME command formatted with Kabul time: {formatted_command}")
+        
+        try:
+            synctime_stamp = parse_synctime_command(formatted_command)
+        except ValueError:
+            conn.close()
+            raise HTTPException(status_code=400, detail="datetime must be in YYYY-MM-DD HH:MM:SS format")
     
     # Insert command
     cursor.execute('''
-        INSERT INTO device_commands (device_sn, command, status)
-        VALUES (?, ?, 'queued')
-    ''', (sn, formatted_command))
+        INSERT INTO device_commands (device_sn, command, status, command_type)
+        VALUES (?, ?, 'queued', ?)
+    ''', (sn, formatted_command, command_type))
     
     command_id = cursor.lastrowid
     conn.commit()
     conn.close()
+    bump_resource_versions("commands")
     
     if command_id is None:
         raise HTTPException(status_code=500, detail="Failed to create command")
     
+    if synctime_stamp is not None:
+        record_time_sync(sn, int(command_id), synctime_stamp)
+    notify_commands_queued(sn)
+    
     # Just return the queued command without trying to notify the device
     return CommandResponse(id=int(command_id), command=formatted_command, status="queued")
 
-@app.get("/api/attendance")
-async def get_attendance_logs(limit: int = 100):
-    conn = sqlite3.connect('adms.db')
+def recent_attendance(conn, limit: int):
+    """Newest attendance rows of one attendance database, hot and archived"""
     cursor = conn.cursor()
     
     cursor.execute('''
@@ -1024,7 +4516,6 @@ async def get_attendance_logs(limit: int = 100):
     ''', (limit,))
     
     logs = cursor.fetchall()
-    conn.close()
     
     # Convert to list of dictionaries
     result = []
@@ -1038,26 +4529,243 @@ async def get_attendance_logs(limit: int = 100):
             "created_at": log[5]
         })
     
+    # Fall through to the archived months when the hot table cannot fill the page
+    # on its own, or when late-arriving rows in the hot table are older than the newest archive
+    partitions = get_archive_partitions(conn)
+    if partitions and (len(result) < limit or result[-1]["timestamp"] < (partitions[0][4] or "")):
+        archived = (
+            {key: row[key] for key in ("device_sn", "user_id", "timestamp", "verify_mode", "status", "created_at")}
+            for row in iter_archived_attendance(conn)
+        )
+        merged = heapq.merge(result, archived, key=_archive_row_sort_key, reverse=True)
+        result = [row for _, row in zip(range(limit), merged)]
+    
+    return result
+
+def attendance_after(conn, after_id: int, through_id: int, limit: int):
+    """The first limit rows (by id) of one attendance database with ids in (after_id, through_id]"""
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, device_sn, user_id, timestamp, verify_mode, status, created_at
+        FROM attendance_logs
+        WHERE id > ? AND id <= ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, through_id, limit))
+    return [
+        {"id": log[0], "device_sn": log[1], "user_id": log[2], "timestamp": log[3],
+         "verify_mode": log[4], "status": log[5], "created_at": log[6]}
+        for log in cursor.fetchall()
+    ]
+
+@app.get("/api/attendance")
+async def get_attendance_logs(limit: int = 100, since: Optional[str] = None):
+    if since is not None:
+        generation, position = parse_delta_cursor("attendance", since)
+        after = int(position) if position and position.isdigit() else None
+        conn = connect_db(attendance_db_paths()[0])
+        # Rows past the watermark may not be visible everywhere yet; they come next time
+        watermark = attendance_watermark(conn)
+        conn.close()
+    else:
+        after = None
+    
+    # Scatter: each shard returns its own newest page; gather: merge them in the same order.
+    # A delta is paged by id instead, one row past the limit telling whether more are left;
+    # the cursor then stops at the last id returned rather than at the watermark.
+    pages = []
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        pages.append(recent_attendance(conn, limit) if after is None else attendance_after(conn, after, watermark, limit + 1))
+        conn.close()
+    if after is None:
+        merged = heapq.merge(*pages, key=_archive_row_sort_key, reverse=True)
+        result = [row for _, row in zip(range(limit), merged)]
+        more = False
+    else:
+        result = [row for _, row in zip(range(limit + 1), heapq.merge(*pages, key=lambda row: row["id"]))]
+        more = len(result) > limit
+        if more:
+            del result[limit:]
+            watermark = result[-1]["id"] if result else after
+        for row in result:
+            del row["id"]
+        result.sort(key=_archive_row_sort_key, reverse=True)
+    
+    # Add user names from the in-process directory
+    names = lookup_user_names([row["user_id"] for row in result])
+    for row in result:
+        row["user_name"] = names.get(row["user_id"])
+    
+    if since is not None:
+        return {"cursor": delta_cursor(generation, watermark), "full": after is None, "more": more, "logs": result}
+    return result
+
+@app.get("/api/users")
+async def get_users(limit: int = 1000, offset: int = 0):
+    """List users synced from the devices"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT user_id, name, privilege, card, group_id, device_sn, updated_at
+        FROM users
+        ORDER BY user_id
+        LIMIT ? OFFSET ?
+    ''', (limit, offset))
+    
+    users = cursor.fetchall()
+    conn.close()
+    
+    result = []
+    for user in users:
+        result.append({
+            "user_id": user[0],
+            "name": user[1],
+            "privilege": user[2],
+            "card": user[3],
+            "group_id": user[4],
+            "device_sn": user[5],
+            "updated_at": user[6]
+        })
+    
+    return result
+
+@app.get("/api/users/{user_id}/attendance")
+async def get_user_attendance(user_id: str, start: Optional[str] = None, end: Optional[str] = None,
+                              limit: int = 500):
+    """One user's punches from start to end (YYYY-MM-DD, inclusive; default the last 7 days), newest first"""
+    today = datetime.date.today()
+    end = end or today.isoformat()
+    start = start or (today - datetime.timedelta(days=USER_TIMELINE_DEFAULT_DAYS - 1)).isoformat()
+    for value in (start, end):
+        try:
+            datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="start and end must be dates in YYYY-MM-DD format")
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    
+    return Response(get_user_timeline_json(user_id, start, end, limit), media_type="application/json")
+
+@app.post("/api/attendance/archive")
+async def run_attendance_archive(retention_months: Optional[int] = None):
+    """Archive attendance months older than the retention window right away"""
+    if retention_months is not None and retention_months < 1:
+        raise HTTPException(status_code=400, detail="retention_months must be at least 1")
+    return archive_old_attendance(retention_months)
+
+@app.get("/api/attendance/daily")
+async def get_daily_attendance(start: str, end: Optional[str] = None, user_id: Optional[str] = None,
+                               limit: int = 200000):
+    """First-in / last-out per user per day for the days from start to end (YYYY-MM-DD, inclusive)"""
+    end = end or start
+    for value in (start, end):
+        try:
+            datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="start and end must be dates in YYYY-MM-DD format")
+    
+    # A user punching on devices in different shards has a partial summary in each; merge them
+    merged = {}
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        cursor = conn.cursor()
+        if user_id:
+            cursor.execute('''
+                SELECT user_id, day, first_in, last_out, punch_count
+                FROM daily_attendance
+                WHERE user_id = ? AND day >= ? AND day <= ?
+                ORDER BY day
+                LIMIT ?
+            ''', (user_id, start, end, limit))
+        else:
+            cursor.execute('''
+                SELECT user_id, day, first_in, last_out, punch_count
+                FROM daily_attendance
+                WHERE day >= ? AND day <= ?
+                ORDER BY day, user_id
+                LIMIT ?
+            ''', (start, end, limit))
+        for summary_user, day, first_in, last_out, punch_count in cursor.fetchall():
+            current = merged.get((day, summary_user))
+            if current:
+                first_in, last_out = min(current[2], first_in), max(current[3], last_out)
+                punch_count += current[4]
+            merged[(day, summary_user)] = (summary_user, day, first_in, last_out, punch_count)
+        conn.close()
+    
+    summaries = [merged[key] for key in sorted(merged)[:limit]]
+    names = lookup_user_names([summary[0] for summary in summaries])
+    
+    result = []
+    for summary in summaries:
+        result.append({
+            "user_id": summary[0],
+            "user_name": names.get(summary[0]),
+            "day": summary[1],
+            "first_in": summary[2],
+            "last_out": summary[3],
+            "punch_count": summary[4]
+        })
+    
+    return result
+
+@app.get("/api/attendance/archives")
+async def get_attendance_archives():
+    """List the archived month partitions of every shard"""
+    partitions = []
+    for db_path in attendance_db_paths():
+        conn = connect_db(db_path)
+        partitions.extend(get_archive_partitions(conn))
+        conn.close()
+    partitions.sort(key=lambda partition: partition[0], reverse=True)
+    
+    result = []
+    for partition in partitions:
+        file_path = partition[1]
+        result.append({
+            "month": partition[0],
+            "file_path": file_path,
+            "record_count": partition[2],
+            "first_timestamp": partition[3],
+            "last_timestamp": partition[4],
+            "archived_at": partition[5],
+            "size_bytes": os.path.getsize(file_path) if os.path.exists(file_path) else None
+        })
+    
     return result
 
 @app.get("/api/commands")
-async def get_commands(device_sn: Optional[str] = None):
-    conn = sqlite3.connect('adms.db')
+async def get_commands(device_sn: Optional[str] = None, since: Optional[str] = None, limit: Optional[int] = None):
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
+    conn = connect_db()
     cursor = conn.cursor()
     
-    if device_sn:
-        cursor.execute('''
-            SELECT id, device_sn, command, status, created_at, executed_at, response
-            FROM device_commands
-            WHERE device_sn = ?
-            ORDER BY created_at DESC
-        ''', (device_sn,))
+    if since is not None:
+        generation, position = parse_delta_cursor("commands", since)
+        # Read first: a command changed while the rows are read is sent again next time
+        latest = cursor.execute('SELECT COALESCE(MAX(change_seq), 0) FROM device_commands').fetchone()[0]
+        after = int(position) if position and position.isdigit() else None
     else:
-        cursor.execute('''
-            SELECT id, device_sn, command, status, created_at, executed_at, response
-            FROM device_commands
-            ORDER BY created_at DESC
-        ''')
+        after = None
+    
+    conditions, params = [], []
+    if device_sn:
+        conditions.append("device_sn = ?")
+        params.append(device_sn)
+    if after is not None:
+        # Every change since the cursor; limit only applies to full listings
+        conditions.append("change_seq > ?")
+        params.append(after)
+    cursor.execute(f'''
+        SELECT id, device_sn, command, status, created_at, executed_at, response, command_type, retry_count
+        FROM device_commands
+        {"WHERE " + " AND ".join(conditions) if conditions else ""}
+        ORDER BY created_at DESC
+        LIMIT ?
+    ''', (*params, limit if limit is not None and after is None else -1))
     
     commands = cursor.fetchall()
     conn.close()
@@ -1072,15 +4780,19 @@ async def get_commands(device_sn: Optional[str] = None):
             "status": cmd[3],
             "created_at": cmd[4],
             "executed_at": cmd[5],
-            "response": cmd[6]
+            "response": cmd[6],
+            "command_type": cmd[7],
+            "retry_count": cmd[8]
         })
     
+    if since is not None:
+        return {"cursor": delta_cursor(generation, latest), "full": after is None, "commands": result}
     return result
 
 @app.delete("/api/commands/queued")
 async def clear_queued_commands():
     """Clear all queued commands from the database"""
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     cursor.execute("DELETE FROM device_commands WHERE status = 'queued'")
@@ -1088,63 +4800,266 @@ async def clear_queued_commands():
     
     conn.commit()
     conn.close()
+    bump_resource_versions("commands")
+    bump_delta_generations("commands")
     
     return {"message": f"Successfully cleared {count} queued commands"}
 
-@app.delete("/api/devices/{sn}")
+@app.delete("/api/devices/{sn}", status_code=202)
 async def remove_device(sn: str):
-    """Remove a device and all its related commands and attendance logs"""
-    conn = sqlite3.connect('adms.db')
+    """Remove a device and all its related commands and attendance logs in a background job"""
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Check if device exists
     cursor.execute('SELECT id FROM devices WHERE serial_number = ?', (sn,))
     device = cursor.fetchone()
+    conn.close()
     
     if not device:
-        conn.close()
         raise HTTPException(status_code=404, detail="Device not found")
     
-    # Delete related attendance logs
-    cursor.execute("DELETE FROM attendance_logs WHERE device_sn = ?", (sn,))
-    logs_count = cursor.rowcount
+    job = find_active_job("remove_device", sn) or start_background_job("remove_device", sn, remove_device_job, sn)
     
-    # Delete related commands
-    cursor.execute("DELETE FROM device_commands WHERE device_sn = ?", (sn,))
-    commands_count = cursor.rowcount
+    return {
+        "message": f"Removing device {sn} in the background",
+        "job_id": job["id"],
+        "status_url": tenant_url(f"/api/jobs/{job['id']}")
+    }
+
+@app.delete("/api/attendance", status_code=202)
+async def clear_attendance_logs():
+    """Clear all attendance logs from the database in a background job"""
+    job = find_active_job("clear_attendance") or start_background_job("clear_attendance", None, clear_attendance_job)
     
-    # Delete the device
-    cursor.execute("DELETE FROM devices WHERE serial_number = ?", (sn,))
-    devices_count = cursor.rowcount
+    return {
+        "message": "Clearing attendance logs in the background",
+        "job_id": job["id"],
+        "status_url": tenant_url(f"/api/jobs/{job['id']}")
+    }
+
+@app.post("/api/attendance/import", status_code=202)
+async def import_attendance(request: Request, sn: str):
+    """Import an ATTLOG .dat export (the raw request body) for device sn in a background job"""
+    if not sn.strip():
+        raise HTTPException(status_code=400, detail="sn is required")
+    import_dir = tenant_path(IMPORT_DIR)
+    os.makedirs(import_dir, exist_ok=True)
     
-    conn.commit()
-    conn.close()
+    fd, file_path = tempfile.mkstemp(dir=import_dir, suffix=".dat")
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as import_file:
+            async for chunk in request.stream():
+                size += len(chunk)
+                import_file.write(chunk)
+    except BaseException:
+        os.remove(file_path)
+        raise
+    
+    logger.info(f"[Import] Received {size} byte ATTLOG export for device {sn}")
+    job = start_background_job("import_attendance", sn, import_attlog_job, file_path, sn)
     
     return {
-        "message": f"Successfully removed device {sn}",
-        "devices_deleted": devices_count,
-        "commands_deleted": commands_count,
-        "logs_deleted": logs_count
+        "message": f"Importing attendance for device {sn} in the background",
+        "job_id": job["id"],
+        "status_url": tenant_url(f"/api/jobs/{job['id']}")
     }
 
-@app.delete("/api/attendance")
-async def clear_attendance_logs():
-    """Clear all attendance logs from the database"""
-    conn = sqlite3.connect('adms.db')
-    cursor = conn.cursor()
+@app.get("/api/admin/load")
+async def get_admission_load(sn: Optional[str] = None):
+    """Current load signals, the interval multiplier and (for sn) the options a device would get"""
+    stats = get_load_stats()
+    result = {
+        "loop_lag_ms": round(stats["loop_lag"] * 1000, 1),
+        "device_inflight": round(stats["device_inflight"], 1),
+        "device_rps": round(stats["device_rps"], 1),
+        "pressure": round(stats["pressure"], 2),
+        "backoff": stats["backoff"],
+        "long_poll": get_long_poll_stats(),
+    }
+    if sn:
+        result["options"] = dict(line.split("=", 1) for line in admission_options(sn).splitlines())
+    return result
+
+@app.get("/api/admin/queries")
+async def get_queries(limit: int = 20, sort: str = "total"):
+    """Statement families ranked by total (or max, calls, rows, slow) time, with their plans"""
+    if sort not in ("total", "max", "calls", "rows", "slow"):
+        raise HTTPException(status_code=400, detail="sort must be one of total, max, calls, rows, slow")
+    return {
+        "tracing": QUERY_TRACE,
+        "slow_query_ms": SLOW_QUERY_MS,
+        "queries": query_report(max(1, limit), sort)
+    }
+
+@app.delete("/api/admin/queries")
+async def delete_queries():
+    """Reset the query counters"""
+    reset_query_stats()
+    return {"message": "Query statistics reset"}
+
+def require_tenant_admin():
+    """Tenant administration is only served without a tenant prefix"""
+    if not MULTI_TENANT or current_tenant():
+        raise HTTPException(status_code=404, detail="Not Found")
+
+@app.get("/api/admin/tenants")
+async def get_tenants():
+    """List tenants with their routed devices and the database handle pool"""
+    require_tenant_admin()
+    with _tenants_lock:
+        devices = {}
+        for sn, tenant in sorted(_tenant_devices.items()):
+            devices.setdefault(tenant, []).append(sn)
+        tenants = sorted(_tenants)
+    return {
+        "tenants": [{"name": name, "url": f"{TENANT_URL_PREFIX}{name}/", "devices": devices.get(name, [])} for name in tenants],
+        "pool": db_pool_stats()
+    }
+
+@app.post("/api/admin/tenants", status_code=201)
+async def post_tenant(tenant: TenantRequest):
+    """Create a tenant and its database"""
+    require_tenant_admin()
+    if not TENANT_NAME_PATTERN.fullmatch(tenant.name):
+        raise HTTPException(status_code=400, detail="Tenant names are 1-63 lowercase letters, digits, '-' or '_'")
+    if not await run_in_threadpool(create_tenant, tenant.name):
+        raise HTTPException(status_code=409, detail="Tenant already exists")
+    logger.info(f"[Tenants] Created tenant {tenant.name}")
+    return {"name": tenant.name, "url": f"{TENANT_URL_PREFIX}{tenant.name}/"}
+
+@app.put("/api/admin/tenants/{name}/devices/{sn}")
+async def put_tenant_device(name: str, sn: str):
+    """Route a device's /iclock requests to a tenant"""
+    require_tenant_admin()
+    if name not in _tenants:
+        raise HTTPException(status_code=404, detail="Tenant not found")
+    assign_device_tenant(sn, name)
+    logger.info(f"[Tenants] Device {sn} routed to tenant {name}")
+    return {"serial_number": sn, "tenant": name}
+
+@app.delete("/api/admin/tenants/{name}/devices/{sn}")
+async def delete_tenant_device(name: str, sn: str):
+    """Route a device back to the default database"""
+    require_tenant_admin()
+    if _tenant_devices.get(sn) != name:
+        raise HTTPException(status_code=404, detail="Device is not routed to this tenant")
+    assign_device_tenant(sn, None)
+    logger.info(f"[Tenants] Device {sn} routed back to the default database")
+    return {"serial_number": sn, "tenant": None}
+
+@app.get("/api/admin/backups")
+async def get_backups():
+    """List snapshots and the progress of the running (or last) backup"""
+    with _jobs_lock:
+        jobs = [_job_snapshot(job) for job in _jobs.values() if job["type"] == "backup" and job["tenant"] == current_tenant()]
+    latest = max(jobs, key=lambda job: job["created_at"]) if jobs else None
     
-    cursor.execute("DELETE FROM attendance_logs")
-    count = cursor.rowcount
+    backups = []
+    for name in list_backups():
+        directory = os.path.join(backup_dir(), name)
+        backups.append({
+            "backup": name,
+            "path": directory,
+            "size_bytes": backup_size(directory),
+            "created_at": datetime.datetime.fromtimestamp(os.path.getmtime(directory)).isoformat()
+        })
     
-    conn.commit()
+    return {
+        "interval_seconds": BACKUP_INTERVAL,
+        "keep": BACKUP_KEEP,
+        "job": latest,
+        "backups": backups
+    }
+
+@app.post("/api/admin/backups", status_code=202)
+async def create_backup():
+    """Take an online snapshot now in a background job"""
+    job = start_backup()
+    
+    return {
+        "message": "Backing up the database in the background",
+        "job_id": job["id"],
+        "status_url": tenant_url(f"/api/jobs/{job['id']}")
+    }
+
+@app.get("/api/webhooks")
+async def get_webhooks():
+    """List webhook subscribers with their delivery cursor and backlog"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, name, url, cursor, enabled, created_at, last_delivery_at, last_error
+        FROM webhook_subscribers
+        ORDER BY id
+    ''')
+    subscribers = cursor.fetchall()
     conn.close()
+    latest_id = latest_attendance_id()
     
-    return {"message": f"Successfully cleared {count} attendance logs"}
+    result = []
+    for subscriber in subscribers:
+        with _webhooks_cond:
+            state = _webhooks.get((current_tenant(), subscriber[0]))
+            queued = len(state["queue"]) if state else 0
+            retry_in = max(0.0, state["next_attempt"] - time.monotonic()) if state else 0.0
+            delivered = state["delivered"] if state else 0
+        result.append({
+            "id": subscriber[0],
+            "name": subscriber[1],
+            "url": subscriber[2],
+            "cursor": subscriber[3],
+            "enabled": bool(subscriber[4]),
+            "created_at": subscriber[5],
+            "last_delivery_at": subscriber[6],
+            "last_error": subscriber[7],
+            "lag_records": max(0, latest_id - subscriber[3]),
+            "queued_records": queued,
+            "delivered_since_start": delivered,
+            "spooled_batches": len(webhook_spool_files(subscriber[0])),
+            "retry_in_seconds": round(retry_in, 1)
+        })
+    
+    return result
+
+@app.post("/api/webhooks", status_code=201)
+async def create_webhook(webhook_req: WebhookRequest):
+    """Subscribe a URL to attendance records committed from now on"""
+    if urllib.parse.urlparse(webhook_req.url).scheme not in ("http", "https"):
+        raise HTTPException(status_code=400, detail="url must be an http(s) URL")
+    
+    state = add_webhook(webhook_req.name.strip() or webhook_req.url, webhook_req.url)
+    logger.info(f"[Webhook] Subscribed {state['name']} ({state['url']}) from attendance id {state['cursor']}")
+    return {"id": state["id"], "name": state["name"], "url": state["url"], "cursor": state["cursor"]}
+
+@app.delete("/api/webhooks/{subscriber_id}")
+async def delete_webhook(subscriber_id: int):
+    """Unsubscribe a webhook and drop its spooled batches"""
+    if not remove_webhook(subscriber_id):
+        raise HTTPException(status_code=404, detail="Webhook not found")
+    return {"message": f"Webhook {subscriber_id} removed"}
+
+@app.get("/api/jobs")
+async def get_jobs():
+    """List recent background jobs, newest first"""
+    with _jobs_lock:
+        jobs = [_job_snapshot(job) for job in _jobs.values() if job["tenant"] == current_tenant()]
+    return sorted(jobs, key=lambda job: job["created_at"], reverse=True)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get the status and progress of a background job"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if not job or job["tenant"] != current_tenant():
+            raise HTTPException(status_code=404, detail="Job not found")
+        return _job_snapshot(job)
 
 @app.get("/api/devices/{sn}/info")
 async def get_device_info(sn: str):
     """Get detailed device information and request fresh data from device"""
-    conn = sqlite3.connect('adms.db')
+    conn = connect_db()
     cursor = conn.cursor()
     
     # Get device from database
@@ -1168,10 +5083,14 @@ async def get_device_info(sn: str):
     ''', (sn, 'INFO', 'queued', datetime.datetime.now().isoformat()))
     
     conn.commit()
+    bump_resource_versions("commands")
+    notify_commands_queued(sn)
     
     # Get device statistics
-    cursor.execute('SELECT COUNT(*) FROM attendance_logs WHERE device_sn = ?', (sn,))
-    attendance_count = cursor.fetchone()[0]
+    attendance_conn = connect_db(attendance_db_path(sn))
+    attendance_cursor = attendance_conn.cursor()
+    attendance_cursor.execute('SELECT COUNT(*) FROM attendance_logs WHERE device_sn = ?', (sn,))
+    attendance_count = attendance_cursor.fetchone()[0]
     
     cursor.execute('SELECT COUNT(*) FROM device_commands WHERE device_sn = ?', (sn,))
     total_commands = cursor.fetchone()[0]
@@ -1183,15 +5102,16 @@ async def get_device_info(sn: str):
     queued_commands = cursor.fetchone()[0]
     
     # Get last attendance record
-    cursor.execute('''
+    attendance_cursor.execute('''
         SELECT timestamp, user_id 
         FROM attendance_logs 
         WHERE device_sn = ? 
         ORDER BY timestamp DESC 
         LIMIT 1
     ''', (sn,))
-    last_attendance = cursor.fetchone()
+    last_attendance = attendance_cursor.fetchone()
     
+    attendance_conn.close()
     conn.close()
     
     return {
@@ -1213,15 +5133,153 @@ async def get_device_info(sn: str):
         }
     }
 
-@app.get("/")
-async def root():
-    # Serve the dashboard HTML file
-    return FileResponse('dashboard.html')
+def run_report(kind: str, start: str, end: Optional[str], **options):
+    if np is None:
+        raise HTTPException(status_code=503, detail="Reports require NumPy (pip install numpy)")
+    start_date = parse_report_date(start, "start")
+    end_date = parse_report_date(end, "end") if end else start_date
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    return build_report(kind, start_date, end_date, **options)
+
+@app.get("/api/reports/hours")
+async def report_hours(start: str, end: Optional[str] = None):
+    """Hours worked (first to last punch) and days present per user and department"""
+    return await run_in_threadpool(run_report, "hours", start, end)
+
+@app.get("/api/reports/late")
+async def report_late(start: str, end: Optional[str] = None, shift_start: str = "08:00", grace_minutes: int = 0):
+    """Late arrivals (first punch after shift_start plus grace) per user and department"""
+    try:
+        datetime.datetime.strptime(shift_start, "%H:%M")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="shift_start must be in HH:MM format")
+    return await run_in_threadpool(run_report, "late", start, end, shift_start=shift_start, grace_minutes=grace_minutes)
+
+@app.get("/api/reports/absences")
+async def report_absences(start: str, end: Optional[str] = None, weekend: str = REPORT_WEEKEND_DAYS):
+    """Working days without any punch per user and department"""
+    try:
+        if any(not 0 <= int(day) <= 6 for day in weekend.split(",") if day.strip() != ""):
+            raise ValueError(weekend)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="weekend must be comma-separated weekday numbers (0=Monday)")
+    return await run_in_threadpool(run_report, "absences", start, end, weekend_days=weekend)
+
+@app.get("/api/devices/{sn}/uploads")
+async def get_device_uploads(sn: str, limit: int = 100):
+    """List fingerprint template and photo uploads received from a device"""
+    conn = connect_db()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        SELECT u.id, u.table_name, u.pin, u.sha256, b.size, u.uploaded_at
+        FROM device_uploads u
+        JOIN blobs b ON b.sha256 = u.sha256
+        WHERE u.device_sn = ?
+        ORDER BY u.uploaded_at DESC
+        LIMIT ?
+    ''', (sn, limit))
+    
+    uploads = cursor.fetchall()
+    conn.close()
+    
+    result = []
+    for upload in uploads:
+        result.append({
+            "id": upload[0],
+            "table": upload[1],
+            "pin": upload[2],
+            "sha256": upload[3],
+            "size": upload[4],
+            "uploaded_at": upload[5],
+            "url": tenant_url(f"/api/blobs/{upload[3]}")
+        })
+    
+    return result
+
+@app.get("/api/blobs/{sha256}")
+async def get_blob(sha256: str):
+    """Download a stored upload by its content hash"""
+    if len(sha256) != 64 or any(c not in "0123456789abcdef" for c in sha256):
+        raise HTTPException(status_code=400, detail="Invalid blob hash")
+    
+    file_path = blob_path(sha256)
+    if not os.path.exists(file_path):
+        raise HTTPException(status_code=404, detail="Blob not found")
+    
+    return FileResponse(file_path, media_type="application/octet-stream", filename=sha256)
 
-# Initialize database on startup
-migrate_database()
-init_db()
+@app.get("/")
+async def root(request: Request):
+    # Serve the dashboard HTML file from memory, precompressed
+    return static_asset_response(request, DASHBOARD_FILE, "text/html; charset=utf-8", DASHBOARD_MAX_AGE)
 
 if __name__ == "__main__":
+    import sys
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "migrate":
+        print(f"Database schema is at version {run_migrations()}")
+        migrate_attendance_shards()
+        if MULTI_TENANT:
+            load_tenant_registry()
+            migrate_tenants()
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "vacuum":
+        # One-time conversion of databases created before incremental auto-vacuum
+        if not acquire_process_lock():
+            print(f"Server (pid {process_lock_owner()}) is running; stop it first, VACUUM blocks all writes until done")
+            sys.exit(1)
+        run_migrations()
+        migrate_attendance_shards()
+        if MULTI_TENANT:
+            load_tenant_registry()
+            migrate_tenants()
+        for tenant in all_tenants():
+            with use_tenant(tenant):
+                for db_path in database_paths():
+                    converted = enable_incremental_vacuum(db_path)
+                    print(f"{db_path}: {'converted to' if converted else 'already uses'} incremental auto-vacuum")
+        sys.exit(0)
+    
+    if len(sys.argv) > 1 and sys.argv[1] == "import":
+        if len(sys.argv) < 4:
+            print("usage: python main.py import FILE SN [TENANT]")
+            sys.exit(2)
+        tenant = sys.argv[4] if len(sys.argv) > 4 else DEFAULT_TENANT
+        
+        def print_progress(progress):
+            print(f"{progress['bytes_read'] * 100 // max(progress['bytes_total'], 1):3d}%  {progress['records']} records, "
+                  f"{progress['inserted']} new, {progress['duplicates']} duplicates, {progress['records_per_second']} records/s")
+        
+        if acquire_process_lock():
+            run_migrations()
+            if MULTI_TENANT:
+                load_tenant_registry()
+                migrate_tenants()
+            else:
+                migrate_attendance_shards()
+            if tenant not in all_tenants():
+                print(f"Unknown tenant {tenant!r}")
+                sys.exit(2)
+            with use_tenant(tenant):
+                result = import_attlog_file(sys.argv[2], sys.argv[3], on_progress=print_progress)
+        else:
+            # A running server owns the databases; it runs the import as a background job
+            print(f"Server (pid {process_lock_owner()}) is running; importing through {SERVER_URL}")
+            with use_tenant(tenant):
+                try:
+                    result = import_through_server(sys.argv[2], sys.argv[3], on_progress=print_progress)
+                except (urllib.error.URLError, RuntimeError) as e:
+                    print(f"Import failed: {e}")
+                    sys.exit(1)
+        print(f"{result['message']} ({result['duplicates']} duplicates, {result['invalid']} unparsed lines) "
+              f"in {result['seconds']} s, {result['records_per_second']} records/s")
+        for line_number, line in result['skipped_lines']:
+            print(f"  skipped line {line_number}: {line}")
+        sys.exit(0)
+    
     import uvicorn
+    run_migrations()
     uvicorn.run(app, host="0.0.0.0", port=8080)
\ No newline at end of file
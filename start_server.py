@@ -6,5 +6,9 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 if __name__ == "__main__":
+    # Bring the database schema up to date once, before any worker starts
+    from main import run_migrations
+    run_migrations()
+    
     # Run the FastAPI application
     uvicorn.run("main:app", host="0.0.0.0", port=8080, reload=True)
\ No newline at end of file
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ADMS_BACKUP_INTERVAL", "0")
+
+import main  # noqa: E402
+
+
+def reset_state():
+    """Forget everything the module caches about the previous test's databases"""
+    main.close_idle_connections(0)
+    for conn in main._database_anchors:
+        conn.close()
+    main._database_anchors.clear()
+    main._tenants.clear()
+    main._tenant_devices.clear()
+    main._pending_time_syncs.clear()
+    main._delta_generations.clear()
+    main._inflight_commands.clear()
+    main._ack_deadlines.clear()
+    main._attendance_ids.update(published_through=0, completed=[])
+    main._jobs.clear()
+    main._user_directory.clear()
+    main._user_timelines.clear()
+    main._user_timeline_keys.clear()
+    main._webhooks.clear()
+    main._reclaim_disabled.clear()
+    main._command_waiters.clear()
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """A fresh, migrated adms.db in an empty working directory"""
+    monkeypatch.chdir(tmp_path)
+    reset_state()
+    main.run_migrations()
+    yield tmp_path
+    reset_state()
+
+
+@pytest.fixture
+def client(workdir):
+    """Test client that talks to the app as a device on the LAN; startup hooks are not run"""
+    async def app(scope, receive, send):
+        if scope["type"] == "http":
+            scope["client"] = ("192.168.1.201", 4370)
+        await main.app(scope, receive, send)
+    return TestClient(app)
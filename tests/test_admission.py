@@ -0,0 +1,70 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def idle(client, monkeypatch):
+    """A server with no load history, and the default pacing settings"""
+    monkeypatch.setattr(main, "_load_stats", {
+        "loop_lag": 0.0, "device_inflight": 0.0, "device_rps": 0.0, "pressure": 0.0, "backoff": 1.0,
+        "inflight_now": 0, "requests_total": 0
+    })
+    for name, value in (("POLL_DELAY", 10), ("POLL_ERROR_DELAY", 30), ("TRANS_INTERVAL", 1),
+                        ("TRANS_TIMES", "00:00;14:05"), ("TRANS_TIMES_STAGGER", 30), ("POLL_STAGGER", 0.5),
+                        ("MAX_POLL_BACKOFF", 8.0)):
+        monkeypatch.setattr(main, name, value)
+    return client
+
+
+def options(client, sn: str):
+    return client.get("/api/admin/load", params={"sn": sn}).json()["options"]
+
+
+def overload(samples: int = 20):
+    # One second of event-loop lag is ten times TARGET_LOOP_LAG
+    for _ in range(samples):
+        main.record_load_sample(loop_lag=1.0, elapsed=main.LOAD_SAMPLE_INTERVAL, requests_total=0, last_requests_total=0)
+
+
+def test_idle_server_hands_out_the_configured_intervals(idle):
+    stagger = main.device_stagger("DEV1")
+    assert options(idle, "DEV1") == {
+        "ErrorDelay": str(round(30 * (1 + stagger))),
+        "Delay": str(round(10 * (1 + 0.5 * stagger))),
+        "TransTimes": main.stagger_trans_times("00:00;14:05", int(30 * stagger)),
+        "TransInterval": "1",
+    }
+    assert "Delay=" in idle.get("/iclock/getrequest?SN=DEV1").text
+
+
+def test_intervals_stretch_with_load_up_to_the_cap(idle):
+    base = options(idle, "DEV1")
+    overload()
+
+    load = idle.get("/api/admin/load").json()
+    assert load["pressure"] > main.MAX_POLL_BACKOFF
+    assert load["backoff"] == main.MAX_POLL_BACKOFF
+    loaded = options(idle, "DEV1")
+    for name in ("Delay", "ErrorDelay", "TransInterval"):
+        assert int(loaded[name]) == pytest.approx(int(base[name]) * 8, abs=4)
+    # The upload windows are staggered, not stretched
+    assert loaded["TransTimes"] == base["TransTimes"]
+
+    # Load going away brings the intervals back
+    for _ in range(40):
+        main.record_load_sample(0.0, main.LOAD_SAMPLE_INTERVAL, 0, 0)
+    assert options(idle, "DEV1") == base
+
+
+def test_backoff_moves_in_half_steps():
+    assert [main.poll_backoff(pressure) for pressure in (0.0, 0.9, 1.2, 1.3, 2.6, 100.0)] == [1.0, 1.0, 1.0, 1.5, 2.5, main.MAX_POLL_BACKOFF]
+
+
+def test_devices_get_stable_distinct_offsets(idle):
+    fleet = [f"DEV{n}" for n in range(200)]
+    delays = [int(options(idle, sn)["Delay"]) for sn in fleet]
+    assert delays == [int(options(idle, sn)["Delay"]) for sn in fleet]
+    # Spread over the whole stagger window rather than returning in lockstep
+    assert min(delays) == 10 and max(delays) == 15
+    assert len(set(delays)) == 6
@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def backups(client, monkeypatch):
+    monkeypatch.setattr(main, "BACKUP_KEEP", 2)
+    monkeypatch.setattr(main, "BACKUP_STEP_SLEEP", 0)
+    return client
+
+
+def backup(client):
+    response = client.post("/api/admin/backups")
+    assert response.status_code == 202
+    for _ in range(200):
+        job = client.get(response.json()["status_url"]).json()
+        if job["status"] in ("completed", "failed"):
+            assert job["status"] == "completed", job["error"]
+            return job["result"]
+        time.sleep(0.05)
+    raise AssertionError("backup did not finish")
+
+
+def test_snapshot_holds_the_data_at_the_time(backups):
+    backups.post("/iclock/cdata?SN=DEV1&table=ATTLOG", content="1\t2026-03-02 08:00:00\t1\t0\n")
+    result = backup(backups)
+    backups.post("/iclock/cdata?SN=DEV1&table=ATTLOG", content="2\t2026-03-02 08:01:00\t1\t0\n")
+
+    conn = sqlite3.connect(os.path.join(result["path"], "adms.db"))
+    assert conn.execute("PRAGMA integrity_check").fetchone() == ("ok",)
+    assert conn.execute("SELECT user_id FROM attendance_logs").fetchall() == [("1",)]
+    conn.close()
+    assert result["databases"] == 1 and result["size_bytes"] > 0
+
+
+def test_only_the_newest_snapshots_are_kept(backups):
+    results = [backup(backups) for _ in range(3)]
+    names = [result["backup"] for result in results]
+    assert [result["rotated_out"] for result in results] == [[], [], names[:1]]
+    # An interrupted run leaves a partial directory behind
+    os.makedirs(os.path.join(main.backup_dir(), "adms-00000000-000000-000.partial"))
+
+    result = backup(backups)
+
+    assert result["rotated_out"] == names[1:2]
+    assert sorted(os.listdir(main.backup_dir())) == [names[2], result["backup"]]
+    listed = backups.get("/api/admin/backups").json()
+    assert [entry["backup"] for entry in listed["backups"]] == [result["backup"], names[2]]
@@ -0,0 +1,58 @@
+import hashlib
+import os
+
+import main
+
+
+PHOTO = b"PIN=7\tSN=DEV1\tsize=9\tCMD=uploadphoto\0" + bytes(range(256)) * 40
+
+
+def upload(client, sn: str, body: bytes, table: str = "ATTPHOTO"):
+    response = client.post(f"/iclock/cdata?SN={sn}&table={table}", content=body)
+    assert response.status_code == 200
+
+
+def stored_files():
+    return sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(main.BLOB_STORE_DIR) for name in names
+    )
+
+
+def test_identical_uploads_share_one_blob(client):
+    upload(client, "DEV1", PHOTO)
+    upload(client, "DEV2", PHOTO)
+    upload(client, "DEV2", PHOTO + b"\0")
+
+    sha256 = hashlib.sha256(PHOTO).hexdigest()
+    assert stored_files() == sorted([main.blob_path(sha256), main.blob_path(hashlib.sha256(PHOTO + b"\0").hexdigest())])
+    first, = client.get("/api/devices/DEV1/uploads").json()
+    assert (first["table"], first["pin"], first["sha256"], first["size"]) == ("ATTPHOTO", "7", sha256, len(PHOTO))
+    assert [entry["sha256"] for entry in client.get("/api/devices/DEV2/uploads").json()].count(sha256) == 1
+    assert client.get(first["url"]).content == PHOTO
+
+
+def test_blob_is_synced_before_it_is_moved_into_place(client, monkeypatch):
+    events = []
+    fsync, replace = os.fsync, os.replace
+    monkeypatch.setattr(os, "fsync", lambda fd: (events.append("fsync"), fsync(fd))[1])
+    monkeypatch.setattr(os, "replace", lambda src, dst: (events.append(("replace", dst)), replace(src, dst))[1])
+
+    upload(client, "DEV1", PHOTO)
+    upload(client, "DEV1", PHOTO)
+
+    # The duplicate is synced too, but never replaces the blob already in place
+    assert events == ["fsync", ("replace", main.blob_path(hashlib.sha256(PHOTO).hexdigest())), "fsync"]
+    assert os.listdir(os.path.join(main.BLOB_STORE_DIR, "tmp")) == []
+
+
+def test_failed_upload_leaves_no_temporary_file(client, monkeypatch):
+    def broken_fsync(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "fsync", broken_fsync)
+    response = client.post("/iclock/fdata?SN=DEV1&table=FINGERTMP", content=PHOTO)
+
+    assert response.status_code == 500
+    assert stored_files() == []
+    assert client.get("/api/devices/DEV1/uploads").json() == []
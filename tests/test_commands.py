@@ -0,0 +1,151 @@
+import heapq
+import time
+
+import main
+
+
+def command_statuses(client):
+    return {command["id"]: command["status"] for command in client.get("/api/commands").json()}
+
+
+def expire_deadlines(later: float):
+    """What ack_timeout_worker does once `later` seconds have passed"""
+    expired = []
+    with main._ack_deadlines_cond:
+        while main._ack_deadlines and main._ack_deadlines[0][0] <= time.time() + later:
+            entry = heapq.heappop(main._ack_deadlines)
+            if main.is_command_inflight(entry[2], entry[1]):
+                expired.append(entry)
+    if expired:
+        main.expire_unacknowledged_commands(expired)
+    return expired
+
+
+def queue(client, sn: str, command: str, **extra) -> int:
+    response = client.post(f"/api/devices/{sn}/command", json={"command": command, **extra})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_queued_commands_are_sent_in_protocol_format(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "info")
+
+    assert client.get("/iclock/getrequest?SN=DEV1").text == f"C:{command_id}:INFO\r\n"
+    assert command_statuses(client)[command_id] == "sent"
+    assert client.get("/iclock/getrequest?SN=DEV1").text.startswith("GET OPTION FROM:")
+
+
+def test_ack_by_id_completes_command(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "info")
+    client.get("/iclock/getrequest?SN=DEV1")
+
+    client.get(f"/iclock/devicecmd?SN=DEV1&ID={command_id}&Response=OK")
+
+    assert command_statuses(client)[command_id] == "completed"
+    assert not main.is_command_inflight("DEV1", command_id)
+    assert expire_deadlines(later=3600) == []
+
+
+def test_ack_lines_in_post_body(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    ok_id = queue(client, "DEV1", "info")
+    failed_id = queue(client, "DEV1", "reboot")
+    client.get("/iclock/getrequest?SN=DEV1")
+
+    client.post("/iclock/devicecmd?SN=DEV1",
+                content=f"ID={ok_id}&Return=0&CMD=INFO\nID={failed_id}&Return=-1&CMD=REBOOT\n")
+
+    statuses = command_statuses(client)
+    assert statuses[ok_id] == "completed"
+    assert statuses[failed_id] == "failed"
+
+
+def test_ack_without_id_matches_inflight_command_text(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "info")
+    client.get("/iclock/getrequest?SN=DEV1")
+
+    client.get("/iclock/devicecmd?SN=DEV1&CMD=INFO&Response=OK")
+
+    assert command_statuses(client)[command_id] == "completed"
+
+
+def test_ack_from_another_device_is_ignored(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    client.get("/iclock/getrequest?SN=DEV2")
+    command_id = queue(client, "DEV1", "info")
+    client.get("/iclock/getrequest?SN=DEV1")
+
+    client.get(f"/iclock/devicecmd?SN=DEV2&ID={command_id}&Response=OK")
+
+    assert command_statuses(client)[command_id] == "sent"
+
+
+def test_unacknowledged_command_is_requeued_then_times_out(client, monkeypatch):
+    monkeypatch.setattr(main, "COMMAND_MAX_RETRIES", 2)
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "info")
+
+    for retry in range(2):
+        assert client.get("/iclock/getrequest?SN=DEV1").text == f"C:{command_id}:INFO\r\n"
+        # Each attempt waits twice as long as the previous one
+        assert expire_deadlines(later=main.ack_timeout_for(retry) - 1) == []
+        assert len(expire_deadlines(later=main.ack_timeout_for(retry) + 1)) == 1
+        assert command_statuses(client)[command_id] == "queued"
+
+    client.get("/iclock/getrequest?SN=DEV1")
+    expire_deadlines(later=main.ack_timeout_for(2) + 1)
+
+    assert command_statuses(client)[command_id] == "timeout"
+    assert client.get("/iclock/getrequest?SN=DEV1").text.startswith("GET OPTION FROM:")
+
+
+def test_synctime_is_completed_when_sent_and_never_requeued(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "SYNCTIME", datetime="2026-03-01 08:00:00")
+
+    response = client.get("/iclock/getrequest?SN=DEV1")
+
+    assert response.headers["Stamp"] == str(main.parse_synctime_command("2026-03-01 08:00:00"))
+    assert command_statuses(client)[command_id] == "completed"
+    assert not main.is_command_inflight("DEV1", command_id)
+    assert expire_deadlines(later=main.ack_timeout_for(main.COMMAND_MAX_RETRIES) + 1) == []
+    assert command_statuses(client)[command_id] == "completed"
+    assert client.get("/iclock/getrequest?SN=DEV1").text.startswith("GET OPTION FROM:")
+
+
+def test_synctime_left_sent_by_previous_run_is_completed_on_load(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "SYNCTIME")
+    conn = main.connect_db()
+    conn.execute("UPDATE device_commands SET status = 'sent', sent_at = ? WHERE id = ?",
+                 ("2026-03-01T08:00:00", command_id))
+    conn.commit()
+    conn.close()
+
+    main.load_inflight_commands()
+
+    assert command_statuses(client)[command_id] == "completed"
+    assert not main.is_command_inflight("DEV1", command_id)
+
+
+def test_acks_only_settle_commands_waiting_for_one(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = queue(client, "DEV1", "info")
+    client.get("/iclock/getrequest?SN=DEV1")
+    assert len(expire_deadlines(later=3600)) == 1
+    assert command_statuses(client)[command_id] == "queued"
+
+    # A late ack for the re-queued command leaves it for the re-send
+    client.get(f"/iclock/devicecmd?SN=DEV1&ID={command_id}&Response=OK")
+    assert command_statuses(client)[command_id] == "queued"
+
+    client.get("/iclock/getrequest?SN=DEV1")
+    # Query-string acks follow the body rule: 0 or a record count is success
+    client.get(f"/iclock/devicecmd?SN=DEV1&ID={command_id}&Response=0")
+    assert command_statuses(client)[command_id] == "completed"
+
+    client.post("/iclock/devicecmd?SN=DEV1", content=f"ID={command_id}&Return=-1&CMD=INFO\n")
+    assert command_statuses(client)[command_id] == "completed"
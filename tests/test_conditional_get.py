@@ -0,0 +1,75 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import main
+
+
+def test_unchanged_resource_answers_304(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    first = client.get("/api/devices")
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = client.get("/api/devices", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+    # Weak comparison: the strong form of the tag matches too
+    assert client.get("/api/devices", headers={"If-None-Match": etag.removeprefix("W/")}).status_code == 304
+
+
+def test_writes_change_the_etag(client):
+    client.post("/iclock/cdata?SN=DEV1&table=ATTLOG", content="1\t2026-03-02 08:00:00\t1\t0\n")
+    etag = client.get("/api/attendance").headers["ETag"]
+    commands_etag = client.get("/api/commands").headers["ETag"]
+
+    client.post("/iclock/cdata?SN=DEV1&table=ATTLOG", content="2\t2026-03-02 08:01:00\t1\t0\n")
+
+    changed = client.get("/api/attendance", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert len(changed.json()) == 2
+    assert changed.headers["ETag"] != etag
+    # Other resources keep theirs
+    assert client.get("/api/commands", headers={"If-None-Match": commands_etag}).status_code == 304
+
+
+def test_etag_depends_on_the_query(client):
+    short = client.get("/api/attendance?limit=5").headers["ETag"]
+    long = client.get("/api/attendance?limit=10").headers["ETag"]
+    assert short != long
+    assert client.get("/api/attendance?limit=10", headers={"If-None-Match": short}).status_code == 200
+
+
+def test_large_responses_are_gzipped(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    for n in range(40):
+        client.post("/api/devices/DEV1/command", json={"command": "info"})
+
+    response = client.get("/api/commands", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 40
+    assert "ETag" in response.headers
+
+    small = client.get("/api/users", headers={"Accept-Encoding": "gzip"})
+    assert len(small.content) < main.API_GZIP_MIN_SIZE
+    assert "Content-Encoding" not in small.headers
+
+
+def test_a_second_worker_refuses_to_start(workdir, monkeypatch):
+    # Versions are per process; a second worker on the same directory would serve stale 304s
+    monkeypatch.setattr(main, "_process_lock", None)  # released again after the test
+    asyncio.run(main.lock_data_directory())
+    try:
+        second = subprocess.run(
+            [sys.executable, "-c", "import asyncio, main; asyncio.run(main.lock_data_directory())"],
+            cwd=workdir, env=dict(os.environ, PYTHONPATH=os.path.dirname(main.__file__)),
+            capture_output=True, text=True, timeout=60
+        )
+        assert second.returncode != 0
+        assert "is locked by another process" in second.stderr
+        assert main.process_lock_owner() == str(os.getpid())
+    finally:
+        main._process_lock.close()
@@ -0,0 +1,54 @@
+import time
+
+import main
+
+
+def punch(client, sn: str, *punches):
+    body = "".join(f"{user}\t{stamp}\t1\t0\n" for user, stamp in punches)
+    assert client.post(f"/iclock/cdata?SN={sn}&table=ATTLOG", content=body).status_code == 200
+
+
+def daily(client, **params):
+    response = client.get("/api/attendance/daily", params={"start": "2026-03-02", "end": "2026-03-03", **params})
+    assert response.status_code == 200
+    return [(day["user_id"], day["day"], day["first_in"], day["last_out"], day["punch_count"]) for day in response.json()]
+
+
+def test_late_records_widen_the_day(client):
+    punch(client, "DEV1", ("1", "2026-03-02 08:00:00"), ("1", "2026-03-02 17:00:00"), ("2", "2026-03-02 09:00:00"))
+    assert daily(client) == [
+        ("1", "2026-03-02", "2026-03-02 08:00:00", "2026-03-02 17:00:00", 2),
+        ("2", "2026-03-02", "2026-03-02 09:00:00", "2026-03-02 09:00:00", 1),
+    ]
+
+    # A device's backlog arrives after the day was summarized, with a resent punch among it
+    punch(client, "DEV2", ("1", "2026-03-02 07:30:00"), ("1", "2026-03-02 12:00:00"))
+    punch(client, "DEV1", ("1", "2026-03-02 18:15:00"), ("1", "2026-03-02 17:00:00"), ("1", "2026-03-03 08:00:00"))
+
+    assert daily(client, user_id="1") == [
+        ("1", "2026-03-02", "2026-03-02 07:30:00", "2026-03-02 18:15:00", 5),
+        ("1", "2026-03-03", "2026-03-03 08:00:00", "2026-03-03 08:00:00", 1),
+    ]
+
+
+def test_imports_fold_into_the_same_summaries(client):
+    punch(client, "DEV1", ("1", "2026-03-02 08:00:00"))
+    imported = main.bulk_store_attendance_records("DEV2", [
+        ("1", "2026-03-02 06:45:00", 1, 0), ("1", "2026-03-02 19:00:00", 1, 0), ("1", "2026-03-02 08:00:00", 1, 0)
+    ])
+
+    assert imported == 3
+    assert daily(client) == [("1", "2026-03-02", "2026-03-02 06:45:00", "2026-03-02 19:00:00", 4)]
+
+
+def test_removing_a_device_recomputes_its_days(client):
+    punch(client, "DEV1", ("1", "2026-03-02 07:00:00"), ("1", "2026-03-02 18:00:00"))
+    punch(client, "DEV2", ("1", "2026-03-02 08:00:00"), ("2", "2026-03-02 09:00:00"))
+
+    job = client.delete("/api/devices/DEV2").json()
+    for _ in range(200):
+        if client.get(job["status_url"]).json()["status"] == "completed":
+            break
+        time.sleep(0.05)
+
+    assert daily(client) == [("1", "2026-03-02", "2026-03-02 07:00:00", "2026-03-02 18:00:00", 2)]
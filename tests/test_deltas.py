@@ -0,0 +1,101 @@
+import time
+
+import main
+
+
+def punch(client, sn: str, *times: str):
+    body = "".join(f"{n}\t{stamp}\t1\t0\n" for n, stamp in enumerate(times, start=1))
+    assert client.post(f"/iclock/cdata?SN={sn}&table=ATTLOG", content=body).status_code == 200
+
+
+def delta(client, path: str, since: str = "", **params):
+    response = client.get(path, params={**params, "since": since})
+    assert response.status_code == 200
+    return response.json()
+
+
+def wait_for_job(client, status_url: str):
+    for _ in range(200):
+        job = client.get(status_url).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("job did not finish")
+
+
+def test_attendance_since_returns_only_new_rows(client):
+    punch(client, "DEV1", "2026-03-02 08:00:00", "2026-03-02 08:01:00")
+    first = delta(client, "/api/attendance")
+    assert first["full"] is True
+    assert len(first["logs"]) == 2
+
+    assert delta(client, "/api/attendance", first["cursor"])["logs"] == []
+
+    punch(client, "DEV2", "2026-03-02 09:00:00")
+    second = delta(client, "/api/attendance", first["cursor"])
+    assert second["full"] is False
+    assert [(log["device_sn"], log["timestamp"]) for log in second["logs"]] == [("DEV2", "2026-03-02 09:00:00")]
+    assert delta(client, "/api/attendance", second["cursor"])["logs"] == []
+
+
+def test_commands_since_returns_status_changes(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    command_id = client.post("/api/devices/DEV1/command", json={"command": "info"}).json()["id"]
+    first = delta(client, "/api/commands")
+    assert [command["status"] for command in first["commands"]] == ["queued"]
+
+    client.get("/iclock/getrequest?SN=DEV1")
+    second = delta(client, "/api/commands", first["cursor"])
+    assert second["full"] is False
+    assert [(command["id"], command["status"]) for command in second["commands"]] == [(command_id, "sent")]
+    assert delta(client, "/api/commands", second["cursor"])["commands"] == []
+
+
+def test_devices_since_returns_devices_seen_after_the_cursor(client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    first = delta(client, "/api/devices")
+    assert [device["serial_number"] for device in first["devices"]] == ["DEV1"]
+
+    client.get("/iclock/getrequest?SN=DEV2")
+    second = delta(client, "/api/devices", first["cursor"])
+    assert second["full"] is False
+    # DEV1 may come again within the overlap window; DEV2 must be there
+    assert "DEV2" in [device["serial_number"] for device in second["devices"]]
+
+
+def test_deletes_and_foreign_cursors_get_a_full_listing(client):
+    punch(client, "DEV1", "2026-03-02 08:00:00")
+    punch(client, "DEV2", "2026-03-02 09:00:00")
+    cursor = delta(client, "/api/attendance")["cursor"]
+
+    response = client.delete("/api/devices/DEV1")
+    assert response.status_code == 202
+    assert wait_for_job(client, response.json()["status_url"])["status"] == "completed"
+    after_delete = delta(client, "/api/attendance", cursor)
+    assert after_delete["full"] is True
+    assert [log["device_sn"] for log in after_delete["logs"]] == ["DEV2"]
+
+    # A cursor from another process run cannot be continued
+    boot_id, _, rest = after_delete["cursor"].partition(".")
+    stale = delta(client, "/api/attendance", f"{'0' * len(boot_id)}.{rest}")
+    assert stale["full"] is True
+    assert delta(client, "/api/attendance", "not-a-cursor")["full"] is True
+    assert main.parse_delta_cursor("attendance", after_delete["cursor"])[1] is not None
+
+
+def test_a_page_cut_off_at_limit_continues_where_it_stopped(client):
+    cursor = delta(client, "/api/attendance")["cursor"]
+    punch(client, "DEV1", *(f"2026-03-02 08:0{minute}:00" for minute in range(5)))
+
+    pages = []
+    while True:
+        page = delta(client, "/api/attendance", cursor, limit=2)
+        assert page["full"] is False
+        pages.append([log["timestamp"] for log in page["logs"]])
+        cursor = page["cursor"]
+        if not page["more"]:
+            break
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert sorted(stamp for page in pages for stamp in page) == [f"2026-03-02 08:0{minute}:00" for minute in range(5)]
+    assert delta(client, "/api/attendance", cursor)["logs"] == []
@@ -0,0 +1,33 @@
+import pytest
+
+import main
+
+
+@pytest.fixture(params=[True, False], ids=["fast-path", "fastapi"])
+def stack(request, client, monkeypatch):
+    monkeypatch.setattr(main, "ICLOCK_FAST_PATH", request.param)
+    return client
+
+
+def test_device_replies_carry_the_preencoded_headers(stack):
+    response = stack.get("/iclock/cdata?SN=DEV1")
+    assert response.text == "OK"
+    assert response.headers.raw == [
+        (b"content-type", b"text/plain; charset=utf-8"), (b"cache-control", b"no-store"), (b"content-length", b"2")
+    ]
+
+    options = stack.get("/iclock/getrequest?SN=DEV1")
+    assert options.text.startswith("GET OPTION FROM: Stamp=")
+    assert int(options.headers["Content-Length"]) == len(options.content)
+
+
+def test_repeated_query_keys_read_the_same_on_both_stacks(stack):
+    stack.get("/iclock/getrequest?SN=DEV1&SN=DEV2")
+    devices = [device["serial_number"] for device in stack.get("/api/devices").json()]
+    assert devices == [main.QueryParams("SN=DEV1&SN=DEV2")["SN"]]
+
+
+def test_other_methods_are_not_allowed(stack):
+    response = stack.delete("/iclock/getrequest?SN=DEV1")
+    assert response.status_code == 405
+    assert response.json() == {"detail": "Method Not Allowed"}
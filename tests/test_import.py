@@ -0,0 +1,140 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+import uvicorn
+
+import main
+
+
+def write_export(path, lines):
+    path.write_text("".join(line + "\n" for line in lines))
+    return str(path)
+
+
+def export_lines(users: int, day: str = "2026-03-02"):
+    # USB exports pad the user id and carry two trailing work-code columns
+    return [f"{user:>9}\t{day} 08:{user % 60:02d}:00\t1\t0\t1\t0" for user in range(1, users + 1)]
+
+
+def stored_count(sn: str = None) -> int:
+    conn = main.connect_db()
+    if sn:
+        count = conn.execute("SELECT COUNT(*) FROM attendance_logs WHERE device_sn = ?", (sn,)).fetchone()[0]
+    else:
+        count = conn.execute("SELECT COUNT(*) FROM attendance_logs").fetchone()[0]
+    conn.close()
+    return count
+
+
+def wait_for_job(client, status_url: str):
+    for _ in range(200):
+        job = client.get(status_url).json()
+        if job["status"] in ("completed", "failed"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError("import job did not finish")
+
+
+def test_import_counts_new_duplicate_and_unparsed_records(workdir):
+    path = write_export(workdir / "ATTLOG.dat", export_lines(50) + ["garbage", "7\tnot-a-time\tx\t0"])
+
+    first = main.import_attlog_file(path, "DEV1")
+    again = main.import_attlog_file(path, "DEV1")
+
+    assert (first["records"], first["inserted"], first["duplicates"], first["invalid"]) == (50, 50, 0, 2)
+    assert first["skipped"] == 2
+    assert [number for number, _ in first["skipped_lines"]] == [51, 52]
+    assert (again["inserted"], again["duplicates"], again["skipped"]) == (0, 50, 52)
+    assert stored_count("DEV1") == 50
+
+
+def test_import_updates_daily_summaries(workdir):
+    path = write_export(workdir / "ATTLOG.dat", ["1\t2026-03-02 08:00:00\t1\t0", "1\t2026-03-02 17:30:00\t1\t0"])
+    main.store_attendance_records("DEV1", [("1", "2026-03-02 12:00:00", 1, 0)])
+
+    main.import_attlog_file(path, "DEV1")
+
+    conn = main.connect_db()
+    summary = conn.execute("SELECT first_in, last_out, punch_count FROM daily_attendance WHERE user_id = '1'").fetchone()
+    conn.close()
+    assert summary == ("2026-03-02 08:00:00", "2026-03-02 17:30:00", 3)
+
+
+def test_import_in_batches_alongside_live_ingest(workdir, monkeypatch):
+    monkeypatch.setattr(main, "IMPORT_BATCH_SIZE", 7)
+    path = write_export(workdir / "ATTLOG.dat", export_lines(40))
+    original = main.bulk_store_attendance_records
+
+    def interleaved(sn, records):
+        # A device uploads between the import's transactions
+        main.store_attendance_records("LIVE", [(str(len(records)), f"2026-03-0{1 + len(records) % 5} 09:00:00", 1, 0)])
+        return original(sn, records)
+
+    monkeypatch.setattr(main, "bulk_store_attendance_records", interleaved)
+    result = main.import_attlog_file(path, "DEV1")
+
+    assert result["inserted"] == 40
+    assert stored_count("DEV1") == 40
+
+
+def test_sharded_import_takes_ids_from_the_shared_sequence(workdir, monkeypatch):
+    monkeypatch.setattr(main, "ATTENDANCE_SHARDS", 4)
+    monkeypatch.setattr(main, "IMPORT_BATCH_SIZE", 10)
+    main.migrate_attendance_shards()
+    path = write_export(workdir / "ATTLOG.dat", export_lines(30))
+    main.store_attendance_records("DEV1", [("900", "2026-03-01 09:00:00", 1, 0)])
+
+    result = main.import_attlog_file(path, "DEV1")
+    main.store_attendance_records("DEV2", [("901", "2026-03-01 09:00:00", 1, 0)])
+
+    assert result["inserted"] == 30
+    ids = []
+    for db_path in main.attendance_db_paths():
+        conn = main.connect_db(db_path)
+        ids += [row[0] for row in conn.execute("SELECT id FROM attendance_logs")]
+        conn.close()
+    assert sorted(ids) == list(range(1, 33))
+
+
+def test_import_endpoint_runs_a_background_job(client):
+    response = client.post("/api/attendance/import?sn=DEV1", content="\n".join(export_lines(25)).encode())
+    assert response.status_code == 202
+
+    job = wait_for_job(client, response.json()["status_url"])
+
+    assert job["status"] == "completed"
+    assert job["result"]["inserted"] == 25
+    assert stored_count("DEV1") == 25
+    assert os.listdir(main.tenant_path(main.IMPORT_DIR)) == []
+
+
+@pytest.fixture
+def server(workdir, monkeypatch):
+    """The app served over HTTP on a free port, without its startup hooks"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    instance = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, lifespan="off", log_level="warning"))
+    thread = threading.Thread(target=instance.run, daemon=True)
+    thread.start()
+    while not instance.started:
+        time.sleep(0.01)
+    monkeypatch.setattr(main, "SERVER_URL", f"http://127.0.0.1:{port}")
+    yield
+    instance.should_exit = True
+    thread.join(5)
+
+
+def test_cli_import_goes_through_a_running_server(workdir, server):
+    path = write_export(workdir / "ATTLOG.dat", export_lines(15) + ["garbage"])
+    progress = []
+
+    result = main.import_through_server(path, "DEV1", on_progress=progress.append, poll_interval=0.05)
+
+    assert (result["inserted"], result["invalid"]) == (15, 1)
+    assert result["skipped_lines"] == [[16, "garbage"]]
+    assert progress and progress[-1]["inserted"] == 15
+    assert stored_count("DEV1") == 15
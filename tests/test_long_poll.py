@@ -0,0 +1,89 @@
+import asyncio
+import heapq
+import threading
+import time
+
+import httpx
+import pytest
+
+import main
+
+
+@pytest.fixture
+def long_poll(workdir, monkeypatch):
+    monkeypatch.setattr(main, "LONG_POLL_TIMEOUT", 5.0)
+    monkeypatch.setattr(main, "_long_poll_stats", {"held": 0, "woken": 0, "timed_out": 0})
+    main.register_or_update_device("DEV1", "192.168.1.201")
+
+    async def app(scope, receive, send):
+        if scope["type"] == "http":
+            scope["client"] = ("192.168.1.201", 4370)
+        await main.app(scope, receive, send)
+    return app
+
+
+def run(app, scenario):
+    async def with_client():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://adms", timeout=10) as client:
+            return await scenario(client)
+    return asyncio.run(with_client())
+
+
+async def held_poll(client):
+    poll = asyncio.ensure_future(client.get("/iclock/getrequest?SN=DEV1"))
+    for _ in range(200):
+        if main.get_long_poll_stats()["held"]:
+            return poll
+        await asyncio.sleep(0.01)
+    raise AssertionError("poll was not held")
+
+
+def test_queued_command_answers_a_held_poll(long_poll):
+    async def scenario(client):
+        poll = await held_poll(client)
+        started = time.monotonic()
+        queued = await client.post("/api/devices/DEV1/command", json={"command": "info"})
+        response = await poll
+        return queued.json()["id"], response.text, time.monotonic() - started
+
+    command_id, text, waited = run(long_poll, scenario)
+
+    assert text == f"C:{command_id}:INFO\r\n"
+    assert waited < 1
+    assert main.get_long_poll_stats() == {"held": 0, "woken": 1, "timed_out": 0, "devices": 0}
+
+
+def test_command_requeued_on_another_thread_wakes_the_poll(long_poll):
+    async def scenario(client):
+        command_id = (await client.post("/api/devices/DEV1/command", json={"command": "info"})).json()["id"]
+        assert (await client.get("/iclock/getrequest?SN=DEV1")).text == f"C:{command_id}:INFO\r\n"
+        poll = await held_poll(client)
+
+        # The ack timeout worker re-queues the unacknowledged command from its own thread
+        with main._ack_deadlines_cond:
+            expired = [heapq.heappop(main._ack_deadlines)]
+        worker = threading.Thread(target=main.expire_unacknowledged_commands, args=(expired,))
+        worker.start()
+        response = await poll
+        worker.join()
+        return command_id, response.text
+
+    command_id, text = run(long_poll, scenario)
+
+    assert text == f"C:{command_id}:INFO\r\n"
+    assert main.get_long_poll_stats()["woken"] == 1
+
+
+def test_poll_without_commands_times_out_with_the_options(long_poll, monkeypatch):
+    monkeypatch.setattr(main, "LONG_POLL_TIMEOUT", 0.2)
+
+    async def scenario(client):
+        started = time.monotonic()
+        response = await client.get("/iclock/getrequest?SN=DEV1")
+        return response.text, time.monotonic() - started
+
+    text, waited = run(long_poll, scenario)
+
+    assert text.startswith("GET OPTION FROM:")
+    assert waited >= 0.2
+    assert main.get_long_poll_stats() == {"held": 0, "woken": 0, "timed_out": 1, "devices": 0}
@@ -0,0 +1,133 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+def legacy_database(path: str):
+    """attendance_logs as created by early versions: no UNIQUE(device_sn, user_id, timestamp)"""
+    conn = sqlite3.connect(path)
+    conn.execute('''
+        CREATE TABLE devices (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            serial_number TEXT UNIQUE NOT NULL,
+            ip_address TEXT NOT NULL,
+            model TEXT,
+            last_seen TIMESTAMP,
+            firmware_version TEXT,
+            status TEXT DEFAULT 'offline'
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE attendance_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_sn TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            timestamp TIMESTAMP NOT NULL,
+            verify_mode INTEGER,
+            status INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES (?, ?, ?, 1, ?)",
+        [("DEV1", "1", "2026-03-02 08:00:00", 0), ("DEV1", "1", "2026-03-02 08:00:00", 1),
+         ("DEV1", "2", "2026-03-02 08:05:00", 0), ("DEV2", "1", "2026-03-02 08:00:00", 0)]
+    )
+    conn.commit()
+    return conn
+
+
+def test_unique_constraint_rebuild_drops_duplicates(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path).close()
+
+    assert main.run_migrations(path) == main.SCHEMA_VERSION
+
+    conn = sqlite3.connect(path)
+    assert main.has_unique_index(conn, "attendance_logs", ["device_sn", "user_id", "timestamp"])
+    rows = conn.execute("SELECT id, device_sn, user_id, status FROM attendance_logs ORDER BY id").fetchall()
+    assert rows == [(1, "DEV1", "1", 0), (3, "DEV1", "2", 0), (4, "DEV2", "1", 0)]
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == main.SCHEMA_VERSION
+    conn.close()
+
+
+def test_rebuild_discards_a_partial_copy(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = legacy_database(path)
+    # A copy left behind without the triggers that log changes to the source
+    conn.execute(main.attendance_logs_ddl("attendance_logs_new"))
+    conn.execute("INSERT INTO attendance_logs_new (id, device_sn, user_id, timestamp) VALUES (99, 'X', 'x', 'x')")
+    conn.commit()
+    conn.close()
+
+    main.run_migrations(path)
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT COUNT(*) FROM attendance_logs").fetchone()[0] == 3
+    assert not main.table_exists(conn, "attendance_logs_new")
+    conn.close()
+
+
+def attendance_rows(path: str):
+    conn = sqlite3.connect(path)
+    rows = conn.execute("SELECT id, device_sn, user_id, status FROM attendance_logs ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+def test_changes_during_the_copy_reach_the_rebuilt_table(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path).close()
+    monkeypatch.setattr(main, "MIGRATION_CHUNK_SIZE", 1)
+    pauses = []
+
+    def server_writes_between_chunks(seconds):
+        pauses.append(seconds)
+        if len(pauses) == 2:  # rows 1 and 2 are copied, 3 and 4 are not
+            conn = sqlite3.connect(path)
+            conn.execute("DELETE FROM attendance_logs WHERE id = 1")
+            conn.execute("UPDATE attendance_logs SET status = 5 WHERE id = 3")
+            conn.execute("UPDATE attendance_logs SET status = 6 WHERE id = 4")
+            conn.execute("INSERT INTO attendance_logs (device_sn, user_id, timestamp, status) "
+                         "VALUES ('DEV3', '1', '2026-03-02 10:00:00', 0)")
+            conn.commit()
+            conn.close()
+
+    monkeypatch.setattr(main.time, "sleep", server_writes_between_chunks)
+    main.run_migrations(path)
+
+    # Row 2 duplicates row 1, which is gone now, so row 2 takes its place
+    assert attendance_rows(path) == [(2, "DEV1", "1", 1), (3, "DEV1", "2", 5), (4, "DEV2", "1", 6), (5, "DEV3", "1", 0)]
+    conn = sqlite3.connect(path)
+    assert not main.table_exists(conn, "attendance_logs_changes")
+    assert not main.table_exists(conn, "attendance_logs_pending")
+    assert conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'attendance_logs'").fetchall() == []
+    assert conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'attendance_logs'").fetchone() == (5,)
+    conn.close()
+
+
+def test_interrupted_rebuild_resumes_with_the_changes_made_meanwhile(tmp_path, monkeypatch):
+    path = str(tmp_path / "legacy.db")
+    legacy_database(path).close()
+    monkeypatch.setattr(main, "MIGRATION_CHUNK_SIZE", 2)
+
+    def stop(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(main.time, "sleep", stop)
+    with pytest.raises(KeyboardInterrupt):
+        main.run_migrations(path)
+    monkeypatch.undo()
+
+    # The server runs on the old schema for a while
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM attendance_logs_new").fetchone()[0] == 1
+    conn.execute("DELETE FROM attendance_logs WHERE device_sn = 'DEV1' AND user_id = '1'")
+    conn.commit()
+    conn.close()
+
+    assert main.run_migrations(path) == main.SCHEMA_VERSION
+    assert attendance_rows(path) == [(3, "DEV1", "2", 0), (4, "DEV2", "1", 0)]
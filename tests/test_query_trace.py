@@ -0,0 +1,81 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def traced(workdir, monkeypatch):
+    monkeypatch.setattr(main, "QUERY_TRACE", True)
+    main.reset_query_stats()
+    yield
+    main.reset_query_stats()
+
+
+def calls(sql_prefix: str) -> int:
+    return sum(stats["calls"] for family, stats in main._query_stats.items() if family.startswith(sql_prefix))
+
+
+def test_statement_is_counted_when_its_rows_run_out(traced):
+    conn = main.connect_db()
+    cursor = conn.execute("SELECT serial_number FROM devices WHERE id > 5")
+    assert calls("SELECT serial_number FROM devices") == 0
+
+    cursor.fetchall()
+
+    # Counted while the cursor is still referenced, not when it is collected
+    assert calls("SELECT serial_number FROM devices WHERE id > ?") == 1
+    conn.close()
+
+
+def test_partly_read_statement_is_counted_when_the_connection_is_closed(traced):
+    conn = main.connect_db()
+    conn.executemany("INSERT INTO devices (serial_number, ip_address) VALUES (?, '10.0.0.1')", [("A",), ("B",)])
+    conn.commit()
+    cursor = conn.execute("SELECT serial_number FROM devices ORDER BY id")
+    assert cursor.fetchone() == ("A",)
+    assert calls("SELECT serial_number FROM devices ORDER BY id") == 0
+
+    conn.close()
+
+    stats = main._query_stats["SELECT serial_number FROM devices ORDER BY id"]
+    assert (stats["calls"], stats["rows"]) == (1, 1)
+    assert main._query_stats["INSERT INTO devices (serial_number, ip_address) VALUES (?, ?)"]["rows"] == 2
+
+
+def test_closed_cursor_is_counted_once(traced):
+    conn = main.connect_db()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM devices")
+    cursor.close()
+    conn.close()
+
+    assert calls("SELECT ? FROM devices") == 1
+
+
+def test_plans_are_captured_once_and_not_past_the_family_cap(traced, monkeypatch):
+    monkeypatch.setattr(main, "QUERY_FAMILIES_MAX", 2)
+    explained = []
+    original = main.explain_query
+    monkeypatch.setattr(main, "explain_query", lambda conn, sql, parameters: explained.append(sql) or original(conn, sql, parameters))
+
+    conn = main.connect_db()
+    for _ in range(3):
+        for column in ("id", "serial_number", "model", "status"):
+            conn.execute(f"SELECT {column} FROM devices").fetchall()
+    conn.close()
+
+    assert explained == ["SELECT id FROM devices", "SELECT serial_number FROM devices"]
+    assert main._query_stats[main.QUERY_FAMILY_OTHER]["calls"] == 6
+    assert main._query_stats["SELECT id FROM devices"]["plan"]
+
+
+def test_query_report_lists_full_scans(traced, client):
+    client.get("/iclock/getrequest?SN=DEV1")
+    conn = main.connect_db()
+    conn.execute("SELECT * FROM devices WHERE model = 'K40'").fetchall()
+    conn.close()
+
+    report = client.get("/api/admin/queries?limit=100").json()
+
+    scan = next(entry for entry in report["queries"] if entry["query"] == "SELECT * FROM devices WHERE model = ?")
+    assert scan["full_scans"] == ["devices"]
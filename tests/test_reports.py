@@ -0,0 +1,70 @@
+import pytest
+
+import main
+
+
+@pytest.fixture
+def punches(client, monkeypatch):
+    # Small blocks so every report is built from several fetches
+    monkeypatch.setattr(main, "REPORT_FETCH_SIZE", 2)
+    conn = main.connect_db()
+    conn.executemany("INSERT INTO users (user_id, name, group_id) VALUES (?, ?, ?)",
+                     [("1", "Alice", "A"), ("2", "Bob", "B"), ("3", "Carol", "A")])
+    conn.commit()
+    conn.close()
+    body = "".join(f"{user}\t{stamp}\t1\t0\n" for user, stamp in [
+        ("1", "2026-03-02 08:00:00"), ("1", "2026-03-02 17:00:00"),
+        ("1", "2026-03-03 08:30:00"), ("1", "2026-03-03 16:30:00"),
+        ("2", "2026-03-02 09:15:00"), ("2", "2026-03-02 12:15:00"),
+        ("2", "2026-03-04 08:00:00"),  # outside the range
+    ])
+    assert client.post("/iclock/cdata?SN=DEV1&table=ATTLOG", content=body).status_code == 200
+    return client
+
+
+def report(client, kind: str, **params):
+    response = client.get(f"/api/reports/{kind}", params={"start": "2026-03-02", "end": "2026-03-03", **params})
+    assert response.status_code == 200
+    return response.json()
+
+
+def by_user(result, *columns):
+    return {entry["user_id"]: tuple(entry[column] for column in columns) for entry in result["users"]}
+
+
+def test_hours_report(punches):
+    result = report(punches, "hours")
+    assert result["rows_processed"] == 6
+    assert by_user(result, "user_name", "days_present", "hours_worked") == {
+        "1": ("Alice", 2, 17.0),
+        "2": ("Bob", 1, 3.0),
+    }
+    assert result["departments"] == [
+        {"group_id": "A", "users": 1, "days_present": 2, "hours_worked": 17.0},
+        {"group_id": "B", "users": 1, "days_present": 1, "hours_worked": 3.0},
+    ]
+
+
+def test_late_report(punches):
+    result = report(punches, "late", shift_start="08:00", grace_minutes=10)
+    assert by_user(result, "late_days", "late_minutes") == {"1": (1, 20.0), "2": (1, 65.0)}
+    assert punches.get("/api/reports/late", params={"start": "2026-03-02", "shift_start": "8am"}).status_code == 400
+
+
+def test_absences_report_counts_users_without_punches(punches):
+    result = report(punches, "absences")
+    assert by_user(result, "expected_days", "absent_days") == {"1": (2, 0), "2": (2, 1), "3": (2, 2)}
+    assert [(entry["group_id"], entry["users"], entry["absent_days"]) for entry in result["departments"]] == [
+        ("A", 2, 2), ("B", 1, 1)
+    ]
+    # Monday the 2nd to Friday the 6th: Friday is the default weekend
+    assert by_user(report(punches, "absences", end="2026-03-06"), "expected_days")["3"] == (4,)
+
+
+def test_archived_punches_are_included(punches):
+    hot = by_user(report(punches, "hours"), "days_present", "hours_worked")
+    conn = main.connect_db()
+    assert main.archive_month(conn, 2026, 3) == 7
+    assert conn.execute("SELECT COUNT(*) FROM attendance_logs").fetchone()[0] == 0
+    conn.close()
+    assert by_user(report(punches, "hours"), "days_present", "hours_worked") == hot
@@ -0,0 +1,164 @@
+import datetime
+import os
+
+import main
+
+
+def months_ago(months: int, day: int = 10, hour: int = 8) -> str:
+    now = datetime.datetime.now()
+    year, month = now.year, now.month - months
+    while month < 1:
+        year, month = year - 1, month + 12
+    return f"{year:04d}-{month:02d}-{day:02d} {hour:02d}:00:00"
+
+
+def hot_count() -> int:
+    conn = main.connect_db()
+    count = conn.execute("SELECT COUNT(*) FROM attendance_logs").fetchone()[0]
+    conn.close()
+    return count
+
+
+def test_old_months_move_into_compressed_partitions(client):
+    main.store_attendance_records("DEV1", [(str(user), months_ago(14, day=1 + user % 28, hour=user % 24), 1, 0)
+                                           for user in range(100)])
+    main.store_attendance_records("DEV1", [("1", months_ago(1), 1, 0)])
+
+    result = client.post("/api/attendance/archive?retention_months=12").json()
+
+    assert result["months"] == [months_ago(14)[:7]]
+    assert result["records_archived"] == 100
+    assert hot_count() == 1
+    partition, = client.get("/api/attendance/archives").json()
+    assert partition["record_count"] == 100
+    assert partition["first_timestamp"] < partition["last_timestamp"]
+    assert os.stat(partition["file_path"]).st_mode & 0o222 == 0
+    rows = list(main.read_archive_rows(partition["file_path"]))
+    assert [row["timestamp"] for row in rows] == sorted((row["timestamp"] for row in rows), reverse=True)
+    assert rows[0]["timestamp"] == partition["last_timestamp"]
+    assert rows[-1]["timestamp"] == partition["first_timestamp"]
+
+
+def test_attendance_reads_through_to_the_archives(client):
+    main.store_attendance_records("DEV1", [("1", months_ago(14), 1, 0), ("2", months_ago(13), 1, 0)])
+    main.store_attendance_records("DEV1", [("3", months_ago(1), 1, 0)])
+    client.post("/api/attendance/archive?retention_months=12")
+
+    logs = client.get("/api/attendance?limit=10").json()
+
+    assert [log["user_id"] for log in logs] == ["3", "2", "1"]
+
+
+def test_late_records_merge_into_an_archived_month(client):
+    old = [(str(user), months_ago(14, hour=user), 1, 0) for user in range(5)]
+    main.store_attendance_records("DEV1", old)
+    client.post("/api/attendance/archive?retention_months=12")
+
+    # A device that was offline uploads the month again, plus one punch that was never seen
+    main.store_attendance_records("DEV1", old + [("9", months_ago(14, hour=20), 1, 0)])
+    result = client.post("/api/attendance/archive?retention_months=12").json()
+
+    assert result["records_archived"] == 6
+    assert hot_count() == 0
+    partition, = client.get("/api/attendance/archives").json()
+    rows = list(main.read_archive_rows(partition["file_path"]))
+    assert partition["record_count"] == len(rows) == 6
+    assert sorted(row["user_id"] for row in rows) == ["0", "1", "2", "3", "4", "9"]
+    assert partition["last_timestamp"] == months_ago(14, hour=20)
+
+
+def test_archiving_never_runs_a_full_vacuum(workdir):
+    conn = main.connect_db()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    conn.close()
+    main.store_attendance_records("DEV1", [(str(user), months_ago(14, hour=user % 24), 1, 0) for user in range(3000)])
+
+    main.archive_old_attendance(12)
+
+    # Without incremental auto-vacuum the freed pages stay on the free list
+    conn = main.connect_db()
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] > 0
+    conn.close()
+
+
+
+def test_freed_pages_are_reclaimed_with_incremental_auto_vacuum(workdir):
+    main.store_attendance_records("DEV1", [(str(user), months_ago(14, hour=user % 24), 1, 0) for user in range(3000)])
+
+    main.archive_old_attendance(12)
+
+    conn = main.connect_db()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
+    conn.close()
+
+
+def test_vacuum_command_converts_an_existing_database(workdir, caplog):
+    conn = main.connect_db()
+    conn.execute("PRAGMA auto_vacuum = NONE")
+    conn.execute("VACUUM")
+    main.reclaim_free_pages(conn)
+    main.reclaim_free_pages(conn)
+    conn.close()
+    assert sum("predates incremental auto-vacuum" in message for message in caplog.messages) == 1
+
+    assert main.enable_incremental_vacuum("adms.db")
+    assert not main.enable_incremental_vacuum("adms.db")
+
+    conn = main.connect_db()
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert main.reclaim_free_pages(conn)
+    conn.close()
+
+
+def test_punch_committed_while_archiving_stays_in_the_hot_table(workdir, monkeypatch):
+    main.store_attendance_records("DEV1", [("1", months_ago(14), 1, 0)])
+    write_archive_file = main.write_archive_file
+
+    def write_while_a_device_uploads(file_path, rows):
+        # A device with a reset clock uploads a punch for the month being archived
+        main.store_attendance_records("DEV2", [("2", months_ago(14, hour=9), 1, 0)])
+        return write_archive_file(file_path, rows)
+
+    monkeypatch.setattr(main, "write_archive_file", write_while_a_device_uploads)
+    assert main.archive_old_attendance(12)["records_archived"] == 1
+    monkeypatch.setattr(main, "write_archive_file", write_archive_file)
+
+    conn = main.connect_db()
+    assert conn.execute("SELECT user_id FROM attendance_logs").fetchall() == [("2",)]
+    file_path, = conn.execute("SELECT file_path FROM attendance_archives").fetchone()
+    conn.close()
+    assert [row["user_id"] for row in main.read_archive_rows(file_path)] == ["1"]
+
+    # The next run merges it into the partition
+    assert main.archive_old_attendance(12)["records_archived"] == 1
+    assert sorted(row["user_id"] for row in main.read_archive_rows(file_path)) == ["1", "2"]
+
+
+def test_removing_a_device_rewrites_its_archived_months_as_a_stream(workdir, monkeypatch):
+    main.store_attendance_records("DEV1", [(str(user), months_ago(14, hour=user), 1, 0) for user in range(4)])
+    main.store_attendance_records("DEV2", [("9", months_ago(14, day=12), 1, 0)])
+    main.store_attendance_records("DEV1", [("1", months_ago(15), 1, 0)])
+    main.archive_old_attendance(12)
+    write_archive_file = main.write_archive_file
+    rewritten = []
+
+    def record_rewrite(file_path, rows):
+        assert not isinstance(rows, list)
+        rewritten.append(file_path)
+        return write_archive_file(file_path, rows)
+
+    monkeypatch.setattr(main, "write_archive_file", record_rewrite)
+    removed_days = set()
+    conn = main.connect_db()
+    assert main.purge_archived_attendance(conn, "DEV2", removed_days) == 1
+    partitions = {month: (record_count, first, last)
+                  for month, _, record_count, first, last, _ in main.get_archive_partitions(conn)}
+    conn.close()
+
+    # Only the month holding DEV2's punch is rewritten; the other month is left alone
+    assert len(rewritten) == 1
+    assert removed_days == {("9", months_ago(14, day=12)[:10])}
+    assert partitions[months_ago(14)[:7]] == (4, months_ago(14, hour=0), months_ago(14, hour=3))
+    assert partitions[months_ago(15)[:7]][0] == 1
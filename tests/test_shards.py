@@ -0,0 +1,101 @@
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def sharded(workdir, monkeypatch):
+    monkeypatch.setattr(main, "ATTENDANCE_SHARDS", 4)
+    return workdir
+
+
+def punches(count: int, day: str = "2026-03-02"):
+    return [(str(user), f"{day} 08:{user % 60:02d}:00", 1, 0) for user in range(count)]
+
+
+def attendance_ids():
+    ids = []
+    for db_path in main.attendance_db_paths():
+        conn = main.connect_db(db_path)
+        ids += [row[0] for row in conn.execute("SELECT id FROM attendance_logs")]
+        conn.close()
+    return sorted(ids)
+
+
+def test_ids_come_from_the_shared_sequence(sharded):
+    main.migrate_attendance_shards()
+    main.store_attendance_records("DEV1", punches(3))
+
+    # Another process reserving ids moves the same sequence row
+    conn = sqlite3.connect("adms.db")
+    conn.execute("UPDATE id_sequences SET next_id = next_id + 100 WHERE name = 'attendance_logs'")
+    conn.commit()
+    conn.close()
+    main.store_attendance_records("DEV2", punches(3))
+
+    assert attendance_ids() == [1, 2, 3, 104, 105, 106]
+
+
+def test_duplicate_punches_are_skipped_but_id_collisions_raise(sharded):
+    main.migrate_attendance_shards()
+    main.store_attendance_records("DEV1", punches(3))
+    assert main.store_attendance_records("DEV1", punches(3)) == []
+
+    conn = sqlite3.connect("adms.db")
+    conn.execute("UPDATE id_sequences SET next_id = 1 WHERE name = 'attendance_logs'")
+    conn.commit()
+    conn.close()
+    with pytest.raises(sqlite3.IntegrityError):
+        main.store_attendance_records("DEV1", punches(1, day="2026-03-03"))
+
+
+def test_unsharded_attendance_moves_into_the_shards(sharded, monkeypatch):
+    monkeypatch.setattr(main, "ATTENDANCE_SHARDS", 0)
+    for sn in ("DEV1", "DEV2", "DEV3"):
+        main.store_attendance_records(sn, punches(5))
+    before = [(row["device_sn"], row["user_id"], row["timestamp"]) for row in main.recent_attendance(main.connect_db(), 100)]
+
+    monkeypatch.setattr(main, "ATTENDANCE_SHARDS", 4)
+    monkeypatch.setattr(main, "MIGRATION_CHUNK_SIZE", 4)
+    main.migrate_attendance_shards()
+
+    conn = main.connect_db()
+    assert conn.execute("SELECT COUNT(*) FROM attendance_logs").fetchone()[0] == 0
+    assert conn.execute("SELECT COUNT(*) FROM daily_attendance").fetchone()[0] == 0
+    conn.close()
+    assert attendance_ids() == list(range(1, 16))
+    moved = []
+    for db_path in main.attendance_db_paths():
+        conn = main.connect_db(db_path)
+        moved += [(row["device_sn"], row["user_id"], row["timestamp"]) for row in main.recent_attendance(conn, 100)]
+        conn.close()
+    assert sorted(moved) == sorted(before)
+
+    # Each user punched once on each of three devices that day
+    summaries = {}
+    for db_path in main.attendance_db_paths():
+        conn = main.connect_db(db_path)
+        for user_id, punch_count in conn.execute("SELECT user_id, punch_count FROM daily_attendance"):
+            summaries[user_id] = summaries.get(user_id, 0) + punch_count
+        conn.close()
+    assert summaries == {str(user): 3 for user in range(5)}
+
+    # New records continue above the moved ones
+    main.store_attendance_records("DEV4", punches(1, day="2026-03-03"))
+    assert attendance_ids()[-1] == 16
+
+
+def test_second_process_cannot_take_the_lock(workdir, monkeypatch):
+    monkeypatch.setattr(main, "_process_lock", None)
+    other = open(main.PROCESS_LOCK_FILE, "a+")
+    main.fcntl.flock(other.fileno(), main.fcntl.LOCK_EX | main.fcntl.LOCK_NB)
+    try:
+        assert not main.acquire_process_lock()
+    finally:
+        other.close()
+
+    assert main.acquire_process_lock()
+    assert main.acquire_process_lock()
+    main._process_lock.close()
@@ -0,0 +1,66 @@
+import gzip
+import os
+import types
+
+import pytest
+
+import main
+
+
+PAGE = b"<!DOCTYPE html><title>ADMS</title>" + b"<p>dashboard</p>" * 200
+
+
+@pytest.fixture
+def dashboard(client, monkeypatch):
+    with open(main.DASHBOARD_FILE, "wb") as f:
+        f.write(PAGE)
+    monkeypatch.setattr(main, "_static_assets", {})
+    return client
+
+
+def get(client, **headers):
+    return client.get("/", headers=headers)
+
+
+def test_unchanged_dashboard_answers_304_per_encoding(dashboard):
+    first = get(dashboard, **{"Accept-Encoding": "gzip"})
+    assert first.headers["Content-Encoding"] == "gzip"
+    assert first.headers["Vary"] == "Accept-Encoding"
+    assert first.headers["Cache-Control"] == f"public, max-age={main.DASHBOARD_MAX_AGE}"
+    assert first.content == PAGE
+    etag = first.headers["ETag"]
+    assert etag.endswith('-gzip"')
+
+    again = get(dashboard, **{"Accept-Encoding": "gzip", "If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+    # The uncompressed variant has its own tag
+    plain = get(dashboard, **{"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert plain.status_code == 200
+    assert "Content-Encoding" not in plain.headers
+    assert plain.content == PAGE
+
+
+def test_brotli_is_preferred_when_accepted(dashboard, monkeypatch):
+    monkeypatch.setattr(main, "brotli", types.SimpleNamespace(compress=lambda data, quality: b"br:" + gzip.compress(data)))
+
+    assert get(dashboard, **{"Accept-Encoding": "gzip, br"}).headers["Content-Encoding"] == "br"
+    assert get(dashboard, **{"Accept-Encoding": "*"}).headers["Content-Encoding"] == "br"
+    assert get(dashboard, **{"Accept-Encoding": "br;q=0, gzip"}).headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in get(dashboard, **{"Accept-Encoding": "deflate"}).headers
+
+
+def test_edited_dashboard_is_reloaded(dashboard, monkeypatch):
+    monkeypatch.setattr(main, "STATIC_ASSET_CHECK_INTERVAL", 0)
+    etag = get(dashboard, **{"Accept-Encoding": "identity"}).headers["ETag"]
+
+    with open(main.DASHBOARD_FILE, "ab") as f:
+        f.write(b"<p>edited</p>")
+    os.utime(main.DASHBOARD_FILE)
+
+    response = get(dashboard, **{"Accept-Encoding": "identity", "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.content.endswith(b"<p>edited</p>")
+    assert response.headers["ETag"] != etag
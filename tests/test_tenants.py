@@ -0,0 +1,65 @@
+import os
+import sqlite3
+
+import pytest
+
+import main
+
+
+@pytest.fixture
+def tenants(client, monkeypatch):
+    monkeypatch.setattr(main, "MULTI_TENANT", True)
+    for name in ("acme", "globex"):
+        assert client.post("/api/admin/tenants", json={"name": name}).status_code == 201
+    return client
+
+
+def punch(client, prefix: str, sn: str, stamp: str):
+    response = client.post(f"{prefix}/iclock/cdata?SN={sn}&table=ATTLOG", content=f"1\t{stamp}\t1\t0\n")
+    assert response.status_code == 200
+
+
+def logged_devices(client, prefix: str = ""):
+    return sorted(log["device_sn"] for log in client.get(f"{prefix}/api/attendance").json())
+
+
+def test_tenant_prefix_selects_the_database(tenants):
+    punch(tenants, "/t/acme", "ACME1", "2026-03-02 08:00:00")
+    punch(tenants, "/t/globex", "GLOBEX1", "2026-03-02 09:00:00")
+    punch(tenants, "", "HQ1", "2026-03-02 10:00:00")
+
+    assert logged_devices(tenants, "/t/acme") == ["ACME1"]
+    assert logged_devices(tenants, "/t/globex") == ["GLOBEX1"]
+    assert logged_devices(tenants) == ["HQ1"]
+    conn = sqlite3.connect(os.path.join(main.TENANT_DIR, "acme", "adms.db"))
+    assert conn.execute("SELECT device_sn FROM attendance_logs").fetchall() == [("ACME1",)]
+    conn.close()
+
+
+def test_devices_are_routed_by_serial_number(tenants):
+    assert tenants.put("/api/admin/tenants/acme/devices/ACME2").status_code == 200
+
+    # The terminal cannot be given a path prefix; its serial number picks the tenant
+    punch(tenants, "", "ACME2", "2026-03-02 08:00:00")
+    assert logged_devices(tenants, "/t/acme") == ["ACME2"]
+    assert logged_devices(tenants) == []
+
+    assert tenants.delete("/api/admin/tenants/acme/devices/ACME2").status_code == 200
+    punch(tenants, "", "ACME2", "2026-03-02 09:00:00")
+    assert logged_devices(tenants) == ["ACME2"]
+
+
+def test_unknown_tenants_and_admin_under_a_prefix_are_not_found(tenants):
+    assert tenants.get("/t/initech/api/devices").status_code == 404
+    assert tenants.get("/t/acme/api/admin/tenants").status_code == 404
+    assert tenants.post("/api/admin/tenants", json={"name": "acme"}).status_code == 409
+    assert tenants.post("/api/admin/tenants", json={"name": "Bad Name"}).status_code == 400
+    listed = tenants.get("/api/admin/tenants").json()["tenants"]
+    assert [tenant["name"] for tenant in listed] == ["acme", "globex"]
+
+
+def test_etags_are_per_tenant(tenants):
+    etag = tenants.get("/t/acme/api/devices").headers["ETag"]
+    assert tenants.get("/t/acme/api/devices", headers={"If-None-Match": etag}).status_code == 304
+    assert tenants.get("/t/globex/api/devices", headers={"If-None-Match": etag}).status_code == 200
+    assert tenants.get("/api/devices", headers={"If-None-Match": etag}).status_code == 200
@@ -0,0 +1,85 @@
+import time
+
+import main
+
+
+def punch(client, sn: str, user: str, stamp: str):
+    assert client.post(f"/iclock/cdata?SN={sn}&table=ATTLOG", content=f"{user}\t{stamp}\t1\t0\n").status_code == 200
+
+
+def timeline(client, user: str):
+    response = client.get(f"/api/users/{user}/attendance", params={"start": "2026-03-02", "end": "2026-03-08"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def stamps(client, user: str):
+    return [punch["timestamp"] for punch in timeline(client, user)["punches"]]
+
+
+def insert_behind_the_cache(user: str, stamp: str):
+    conn = main.connect_db()
+    conn.execute("INSERT INTO attendance_logs (device_sn, user_id, timestamp, verify_mode, status) VALUES ('DEV9', ?, ?, 1, 0)",
+                 (user, stamp))
+    conn.commit()
+    conn.close()
+
+
+def test_ingestion_drops_only_the_punching_users_entries(client):
+    punch(client, "DEV1", "1", "2026-03-02 08:00:00")
+    punch(client, "DEV1", "2", "2026-03-02 09:00:00")
+    assert stamps(client, "1") == ["2026-03-02 08:00:00"]
+    assert stamps(client, "2") == ["2026-03-02 09:00:00"]
+
+    # A write that skips the ingestion path is not seen while the entry is fresh
+    insert_behind_the_cache("2", "2026-03-03 09:00:00")
+    assert stamps(client, "2") == ["2026-03-02 09:00:00"]
+
+    punch(client, "DEV1", "1", "2026-03-03 08:00:00")
+
+    assert stamps(client, "1") == ["2026-03-03 08:00:00", "2026-03-02 08:00:00"]
+    assert stamps(client, "2") == ["2026-03-02 09:00:00"]
+
+
+def test_user_sync_and_device_delete_invalidate(client):
+    punch(client, "DEV1", "1", "2026-03-02 08:00:00")
+    punch(client, "DEV2", "1", "2026-03-02 17:00:00")
+    assert timeline(client, "1")["user_name"] is None
+
+    client.post("/iclock/cdata?SN=DEV1&table=USERINFO", content="PIN=1\tName=Alice\tPri=0\n")
+    assert timeline(client, "1")["user_name"] == "Alice"
+
+    job = client.delete("/api/devices/DEV2").json()
+    for _ in range(200):
+        if client.get(job["status_url"]).json()["status"] == "completed":
+            break
+        time.sleep(0.05)
+    assert stamps(client, "1") == ["2026-03-02 08:00:00"]
+
+
+def test_a_read_racing_an_insert_is_not_cached(client, monkeypatch):
+    punch(client, "DEV1", "1", "2026-03-02 08:00:00")
+    read_user_timeline = main.read_user_timeline
+
+    def read_then_insert(*args):
+        punches = read_user_timeline(*args)
+        # Committed after the read, before the result is cached
+        main.store_attendance_records("DEV1", [("1", "2026-03-02 17:00:00", 1, 0)])
+        return punches
+
+    monkeypatch.setattr(main, "read_user_timeline", read_then_insert)
+    assert stamps(client, "1") == ["2026-03-02 08:00:00"]
+    monkeypatch.setattr(main, "read_user_timeline", read_user_timeline)
+
+    assert stamps(client, "1") == ["2026-03-02 17:00:00", "2026-03-02 08:00:00"]
+
+
+def test_entries_expire_after_the_ttl(client, monkeypatch):
+    monkeypatch.setattr(main, "USER_TIMELINE_TTL", 0.05)
+    punch(client, "DEV1", "1", "2026-03-02 08:00:00")
+    assert stamps(client, "1") == ["2026-03-02 08:00:00"]
+
+    insert_behind_the_cache("1", "2026-03-02 17:00:00")
+    time.sleep(0.1)
+
+    assert stamps(client, "1") == ["2026-03-02 17:00:00", "2026-03-02 08:00:00"]
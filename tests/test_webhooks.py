@@ -0,0 +1,151 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class Receiver(http.server.BaseHTTPRequestHandler):
+    """Webhook endpoint that records every batch, or answers 503 while the server is down"""
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.server.attempts += 1
+        if self.server.down:
+            self.send_response(503)
+        else:
+            self.server.batches.append((self.headers["X-ADMS-Batch"], body))
+            self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def receiver():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Receiver)
+    server.batches, server.attempts, server.down = [], 0, False
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def subscriber(client, receiver, monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_BATCH_SIZE", 3)
+    response = client.post("/api/webhooks", json={"name": "payroll", "url": f"http://127.0.0.1:{receiver.server_port}/"})
+    assert response.status_code == 201
+    return main._webhooks[main.current_tenant(), response.json()["id"]]
+
+
+def punch(client, sn: str, *times: str):
+    body = "".join(f"{n}\t{stamp}\t1\t0\n" for n, stamp in enumerate(times, start=1))
+    assert client.post(f"/iclock/cdata?SN={sn}&table=ATTLOG", content=body).status_code == 200
+
+
+def forward(state):
+    """What webhook_forwarder_worker does with one subscriber each interval"""
+    with main._webhooks_cond:
+        rows, state["queue"] = state["queue"], []
+    main.flush_webhook(state, rows)
+
+
+def delivered_ids(receiver):
+    return [record["id"] for _, body in receiver.batches for record in body["records"]]
+
+
+def test_new_rows_are_delivered_in_batches(client, receiver, subscriber):
+    punch(client, "DEV1", "2026-03-02 08:00:00", "2026-03-02 08:01:00", "2026-03-02 08:02:00", "2026-03-02 08:03:00")
+
+    forward(subscriber)
+
+    assert [len(body["records"]) for _, body in receiver.batches] == [3, 1]
+    header, body = receiver.batches[0]
+    assert header == f"{body['first_id']}-{body['last_id']}"
+    assert body["subscriber"] == "payroll"
+    ids = delivered_ids(receiver)
+    assert ids == sorted(ids) and len(ids) == 4
+    webhook = client.get("/api/webhooks").json()[0]
+    assert webhook["cursor"] == ids[-1]
+    assert webhook["lag_records"] == 0 and webhook["spooled_batches"] == 0
+
+
+def test_failed_batches_are_spooled_and_retried_with_backoff(client, receiver, subscriber, monkeypatch):
+    monkeypatch.setattr(main, "WEBHOOK_RETRY_DELAY", 5)
+    receiver.down = True
+    punch(client, "DEV1", "2026-03-02 08:00:00", "2026-03-02 08:01:00")
+
+    forward(subscriber)
+    assert receiver.attempts == 1
+    assert len(main.webhook_spool_files(subscriber["id"])) == 1
+    assert 4 < subscriber["next_attempt"] - time.monotonic() <= 5
+    assert "Service Unavailable" in client.get("/api/webhooks").json()[0]["last_error"]
+
+    # Nothing is attempted before the retry is due; new rows queue behind the spool
+    punch(client, "DEV2", "2026-03-02 09:00:00")
+    forward(subscriber)
+    assert receiver.attempts == 1
+    assert len(main.webhook_spool_files(subscriber["id"])) == 2
+
+    subscriber["next_attempt"] = 0.0
+    forward(subscriber)
+    assert receiver.attempts == 2
+    assert 9 < subscriber["next_attempt"] - time.monotonic() <= 10  # doubled
+
+    receiver.down = False
+    subscriber["next_attempt"] = 0.0
+    forward(subscriber)
+    ids = delivered_ids(receiver)
+    assert ids == sorted(ids) and len(ids) == 3
+    assert main.webhook_spool_files(subscriber["id"]) == []
+    assert subscriber["failures"] == 0
+    assert client.get("/api/webhooks").json()[0]["last_error"] is None
+
+
+def test_spool_is_replayed_after_a_restart(client, receiver, subscriber):
+    receiver.down = True
+    punch(client, "DEV1", "2026-03-02 08:00:00", "2026-03-02 08:01:00")
+    forward(subscriber)
+    # Committed but still in memory when the server stopped
+    punch(client, "DEV2", "2026-03-02 09:00:00", "2026-03-02 09:01:00")
+    main._webhooks.clear()
+
+    receiver.down = False
+    assert main.load_webhooks() == 1
+    restarted = main._webhooks[main.current_tenant(), subscriber["id"]]
+    assert len(main.webhook_spool_files(subscriber["id"])) == 2
+    forward(restarted)
+
+    ids = delivered_ids(receiver)
+    assert ids == sorted(ids) and len(ids) == len(set(ids)) == 4
+    assert main.webhook_spool_files(subscriber["id"]) == []
+    assert client.get("/api/webhooks").json()[0]["cursor"] == ids[-1]
+
+
+def test_a_concurrent_upload_cannot_overtake_an_import(workdir, monkeypatch):
+    state = main.add_webhook("payroll", "http://127.0.0.1:9/")
+    publish_attendance = main.publish_attendance
+    uploads = []
+
+    def publish_after_an_upload(rows):
+        if not uploads:
+            # A device upload arrives between the import's commit and its hand-over
+            upload = threading.Thread(target=main.store_attendance_records,
+                                      args=("DEV2", [("7", "2026-03-02 09:00:00", 1, 0)]))
+            uploads.append(upload)
+            upload.start()
+            upload.join(0.3)
+        publish_attendance(rows)
+
+    monkeypatch.setattr(main, "publish_attendance", publish_after_an_upload)
+    imported = main.bulk_store_attendance_records("DEV1", [(str(user), "2026-03-02 08:00:00", 1, 0) for user in range(5)])
+    uploads[0].join()
+
+    assert imported == 5
+    ids = [row["id"] for row in state["queue"]]
+    assert len(ids) == 6 and ids == sorted(ids)